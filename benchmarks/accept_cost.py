@@ -0,0 +1,84 @@
+"""
+measures the per-accept cost of sock2's wrapper: the time it takes to wrap
+an accepted real-socket (through the generic wrap() and through the accept
+loop's fast path), the time of a whole accept() compared to a raw _socket
+accept, and the memory taken by each wrapper object.
+
+usage: python accept_cost.py [iterations]
+"""
+import os
+import sys
+import time
+import timeit
+import select
+import _socket
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    ".."))
+import sock2
+from sock2 import TcpConnectedSocket
+
+
+def measure(func, iterations):
+    """returns the cost of a single call, in nanoseconds"""
+    return min(timeit.repeat(func, number = iterations, repeat = 3)) / \
+        iterations * 1e9
+
+def accept_loop(listener, accept, count):
+    """accepts `count` connections from a forked client, timing only the
+    accept calls themselves; returns the cost of one, in nanoseconds"""
+    endpoint = listener.getsockname()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            for i in xrange(count):
+                sock = _socket.socket(_socket.AF_INET, _socket.SOCK_STREAM)
+                sock.connect(endpoint)
+                sock.close()
+        finally:
+            os._exit(0)
+    poller = select.poll()
+    poller.register(listener.fileno(), select.POLLIN)
+    elapsed = 0
+    for i in xrange(count):
+        poller.poll()
+        t0 = time.time()
+        accept().close()
+        elapsed += time.time() - t0
+    os.waitpid(pid, 0)
+    return elapsed / count * 1e9
+
+def main(iterations):
+    raw = _socket.socket(_socket.AF_INET, _socket.SOCK_STREAM)
+    wrap = lambda: TcpConnectedSocket.wrap(_sock = raw, _is_bound = True,
+        _is_connected = True)
+    fast = lambda: TcpConnectedSocket._accepted(raw)
+    print "wrapping an accepted socket:"
+    print "    wrap()       %8.1f ns" % (measure(wrap, iterations),)
+    print "    _accepted()  %8.1f ns" % (measure(fast, iterations),)
+
+    conn = fast()
+    print "wrapper memory:"
+    print "    %s: %d bytes, __dict__: %s" % (type(conn).__name__,
+        sys.getsizeof(conn), hasattr(conn, "__dict__"))
+    udp = sock2.UdpSocket()
+    print "    %s: %d bytes, __dict__: %s" % (type(udp).__name__,
+        sys.getsizeof(udp), hasattr(udp, "__dict__"))
+    udp.close()
+
+    count = min(iterations, 5000)
+    listener = sock2.TcpListener("127.0.0.1", 0, backlog = 128)
+    wrapped = accept_loop(listener._sock, listener.accept, count)
+    listener.close()
+    listener = _socket.socket(_socket.AF_INET, _socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(128)
+    unwrapped = accept_loop(listener, lambda: listener.accept()[0], count)
+    listener.close()
+    print "a whole accept (with a connection pending):"
+    print "    _socket      %8.1f ns" % (unwrapped,)
+    print "    sock2        %8.1f ns (+%.1f ns)" % (wrapped,
+        wrapped - unwrapped)
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,43 @@
+"""
+measures the time it takes to `import sock2`, and verifies that importing
+it performs no DNS lookups (and hence no network access): the resolver
+functions of _socket are replaced with ones that record their calls.
+
+usage: python import_time.py
+"""
+import os
+import sys
+import time
+import _socket
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    ".."))
+
+
+lookups = []
+def recorder(name):
+    real = getattr(_socket, name)
+    def wrapper(*args):
+        lookups.append((name, args))
+        return real(*args)
+    return wrapper
+
+for name in ("gethostbyname", "gethostbyname_ex", "gethostbyaddr",
+        "getaddrinfo", "getnameinfo", "gethostname"):
+    setattr(_socket, name, recorder(name))
+
+t0 = time.time()
+import sock2
+elapsed = time.time() - t0
+import_lookups = lookups[:]
+
+print "import sock2: %.2f ms" % (elapsed * 1000,)
+print "lookups at import: %d" % (len(import_lookups),)
+for name, args in import_lookups:
+    print "    %s%r" % (name, args)
+
+t0 = time.time()
+str(sock2.loopback)
+print "first use of sock2.loopback: %.2f ms" % ((time.time() - t0) * 1000,)
+
+sys.exit(1 if import_lookups else 0)
@@ -0,0 +1,377 @@
+"""
+measures the cost of sock2's wrapper layer: each benchmark runs the same
+loopback workload twice -- once over sock2's classes, and once over the raw
+_socket objects they wrap -- so the difference is the wrapper's overhead.
+the peer side of each benchmark always uses raw _socket, in a forked
+process, so it costs the same in both runs.
+
+benchmarks:
+    pingpong -- TCP round-trip latency of small messages (p50/p99/mean)
+    stream_send, stream_recv -- TCP throughput, per chunk size
+    udp_send -- UDP packet rate
+    accept -- accept() calls per second (with connections pending)
+    options -- the cost of getting and setting a socket option
+
+usage: python suite.py [options]
+    --quick             fewer iterations (for smoke-testing the suite)
+    --only NAME[,NAME]  run only the given benchmarks
+    --json FILE         write the results to FILE, as JSON
+    --compare FILE      compare the sock2 results to a previous --json run,
+                        and exit with status 1 if any metric regressed by
+                        more than the threshold
+    --threshold FRAC    the allowed regression, as a fraction (default 0.1)
+"""
+import os
+import sys
+import time
+import json
+import array
+import errno
+import select
+import signal
+import _socket
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    ".."))
+import sock2
+
+
+VARIANTS = ("raw", "sock2")
+LOCALHOST = "127.0.0.1"
+
+
+#
+# helpers
+#
+def _raw_listener():
+    listener = _socket.socket(_socket.AF_INET, _socket.SOCK_STREAM)
+    listener.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEADDR, 1)
+    listener.bind((LOCALHOST, 0))
+    listener.listen(128)
+    return listener
+
+def _fork(func, *args):
+    """runs func(*args) in a child process; returns the child's pid"""
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            try:
+                func(*args)
+            except:
+                sys.excepthook(*sys.exc_info())
+                status = 1
+        finally:
+            os._exit(status)
+    return pid
+
+def _reap(pid):
+    while True:
+        try:
+            os.waitpid(pid, 0)
+        except OSError, ex:
+            if ex.errno == errno.EINTR:
+                continue
+            if ex.errno != errno.ECHILD:
+                raise
+        return
+
+def _connect(variant, endpoint):
+    if variant == "raw":
+        sock = _socket.socket(_socket.AF_INET, _socket.SOCK_STREAM)
+        sock.connect(endpoint)
+        sock.setsockopt(_socket.IPPROTO_TCP, _socket.TCP_NODELAY, 1)
+    else:
+        sock = sock2.TcpSocket(*endpoint)
+        sock.no_delay = True
+    return sock
+
+def _percentile(sorted_samples, fraction):
+    index = min(int(len(sorted_samples) * fraction), len(sorted_samples) - 1)
+    return sorted_samples[index]
+
+
+#
+# peers (raw _socket, run in a child process)
+#
+def _echo_peer(listener):
+    conn, addr = listener.accept()
+    conn.setsockopt(_socket.IPPROTO_TCP, _socket.TCP_NODELAY, 1)
+    while True:
+        data = conn.recv(65536)
+        if not data:
+            break
+        conn.sendall(data)
+
+def _sink_peer(listener):
+    conn, addr = listener.accept()
+    while conn.recv(1 << 20):
+        pass
+
+def _source_peer(listener, total, chunk_size):
+    conn, addr = listener.accept()
+    chunk = "x" * chunk_size
+    for i in xrange(total // chunk_size):
+        conn.sendall(chunk)
+    conn.close()
+
+def _udp_sink_peer(sock):
+    sock.settimeout(1)
+    try:
+        while True:
+            sock.recv(65536)
+    except _socket.timeout:
+        pass
+
+def _connect_peer(endpoint, count):
+    for i in xrange(count):
+        sock = _socket.socket(_socket.AF_INET, _socket.SOCK_STREAM)
+        sock.connect(endpoint)
+        sock.close()
+
+
+#
+# benchmarks
+#
+def bench_pingpong(variant, rounds, size = 64):
+    listener = _raw_listener()
+    pid = _fork(_echo_peer, listener)
+    sock = _connect(variant, listener.getsockname())
+    listener.close()
+    message = "x" * size
+    samples = array.array("d")
+    timer = time.time
+    try:
+        for i in xrange(rounds):
+            t0 = timer()
+            sock.send(message)
+            received = len(sock.recv(size))
+            while received < size:
+                received += len(sock.recv(size - received))
+            samples.append(timer() - t0)
+    finally:
+        sock.close()
+        _reap(pid)
+    samples = sorted(samples)
+    return {
+        "p50_us" : _percentile(samples, 0.50) * 1e6,
+        "p99_us" : _percentile(samples, 0.99) * 1e6,
+        "mean_us" : sum(samples) / len(samples) * 1e6,
+    }
+
+def bench_stream_send(variant, total, chunk_sizes):
+    results = {}
+    for chunk_size in chunk_sizes:
+        listener = _raw_listener()
+        pid = _fork(_sink_peer, listener)
+        sock = _connect(variant, listener.getsockname())
+        listener.close()
+        chunk = "x" * chunk_size
+        count = total // chunk_size
+        try:
+            t0 = time.time()
+            for i in xrange(count):
+                sock.sendall(chunk)
+            elapsed = time.time() - t0
+        finally:
+            sock.close()
+            _reap(pid)
+        results["%d_mb_per_sec" % (chunk_size,)] = (
+            count * chunk_size / elapsed / 1e6)
+    return results
+
+def bench_stream_recv(variant, total, chunk_sizes):
+    results = {}
+    for chunk_size in chunk_sizes:
+        listener = _raw_listener()
+        pid = _fork(_source_peer, listener, total, chunk_size)
+        sock = _connect(variant, listener.getsockname())
+        listener.close()
+        received = 0
+        try:
+            t0 = time.time()
+            if variant == "raw":
+                while True:
+                    data = sock.recv(chunk_size)
+                    if not data:
+                        break
+                    received += len(data)
+            else:
+                try:
+                    while True:
+                        received += len(sock.recv(chunk_size))
+                except EOFError:
+                    pass
+            elapsed = time.time() - t0
+        finally:
+            sock.close()
+            _reap(pid)
+        results["%d_mb_per_sec" % (chunk_size,)] = received / elapsed / 1e6
+    return results
+
+def bench_udp_send(variant, count, size = 64):
+    peer = _socket.socket(_socket.AF_INET, _socket.SOCK_DGRAM)
+    peer.bind((LOCALHOST, 0))
+    endpoint = peer.getsockname()
+    pid = _fork(_udp_sink_peer, peer)
+    peer.close()
+    if variant == "raw":
+        sock = _socket.socket(_socket.AF_INET, _socket.SOCK_DGRAM)
+        send = sock.sendto
+    else:
+        sock = sock2.UdpSocket(LOCALHOST, 0)
+        send = sock.send
+    message = "x" * size
+    try:
+        t0 = time.time()
+        for i in xrange(count):
+            send(message, endpoint)
+        elapsed = time.time() - t0
+    finally:
+        sock.close()
+        _reap(pid)
+    return {"packets_per_sec" : count / elapsed}
+
+def bench_accept(variant, count):
+    if variant == "raw":
+        listener = _raw_listener()
+        endpoint = listener.getsockname()
+        accept = lambda: listener.accept()[0]
+    else:
+        listener = sock2.TcpListener(LOCALHOST, 0, backlog = 128)
+        listener.reuse_address = True
+        endpoint = listener.local_endpoint
+        accept = listener.accept
+    pid = _fork(_connect_peer, endpoint, count)
+    # the peer's connect rate would dominate the wall time, so only the
+    # accept calls themselves are timed, once a connection is pending
+    poller = select.poll()
+    poller.register(listener.fileno(), select.POLLIN)
+    elapsed = 0
+    try:
+        for i in xrange(count):
+            poller.poll()
+            t0 = time.time()
+            accept().close()
+            elapsed += time.time() - t0
+    finally:
+        listener.close()
+        _reap(pid)
+    return {"accepts_per_sec" : count / elapsed}
+
+def bench_options(variant, count):
+    if variant == "raw":
+        sock = _socket.socket(_socket.AF_INET, _socket.SOCK_STREAM)
+        setsockopt, getsockopt = sock.setsockopt, sock.getsockopt
+        level, option = _socket.IPPROTO_TCP, _socket.TCP_NODELAY
+        t0 = time.time()
+        for i in xrange(count):
+            setsockopt(level, option, 1)
+        t1 = time.time()
+        for i in xrange(count):
+            bool(getsockopt(level, option))
+        t2 = time.time()
+    else:
+        sock = sock2.TcpSocket()
+        t0 = time.time()
+        for i in xrange(count):
+            sock.no_delay = True
+        t1 = time.time()
+        for i in xrange(count):
+            sock.no_delay
+        t2 = time.time()
+    sock.close()
+    return {
+        "set_ns" : (t1 - t0) / count * 1e9,
+        "get_ns" : (t2 - t1) / count * 1e9,
+    }
+
+
+def make_benchmarks(quick):
+    scale = 10 if quick else 1
+    chunk_sizes = (1024, 16384, 65536, 262144)
+    total = (256 << 20) // scale
+    return [
+        ("pingpong", bench_pingpong, (20000 // scale,)),
+        ("stream_send", bench_stream_send, (total, chunk_sizes)),
+        ("stream_recv", bench_stream_recv, (total, chunk_sizes)),
+        ("udp_send", bench_udp_send, (200000 // scale,)),
+        ("accept", bench_accept, (5000 // scale,)),
+        ("options", bench_options, (200000 // scale,)),
+    ]
+
+
+#
+# reporting
+#
+def lower_is_better(metric):
+    return metric.endswith("_us") or metric.endswith("_ns")
+
+def report(results):
+    print "%-14s %-22s %14s %14s %9s" % ("benchmark", "metric", "raw",
+        "sock2", "ratio")
+    for name in sorted(results):
+        raw, wrapped = results[name]["raw"], results[name]["sock2"]
+        for metric in sorted(raw):
+            print "%-14s %-22s %14.2f %14.2f %9.2f" % (name, metric,
+                raw[metric], wrapped[metric], wrapped[metric] / raw[metric])
+
+def compare(results, baseline, threshold):
+    """returns a list of (benchmark, metric, baseline, current) tuples for
+    the sock2 metrics that regressed by more than `threshold`"""
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        current, previous = results[name]["sock2"], baseline[name]["sock2"]
+        for metric in sorted(current):
+            if metric not in previous:
+                continue
+            if lower_is_better(metric):
+                change = current[metric] / previous[metric] - 1
+            else:
+                change = previous[metric] / current[metric] - 1
+            if change > threshold:
+                regressions.append((name, metric, previous[metric],
+                    current[metric]))
+    return regressions
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage = "%prog [options]")
+    parser.add_option("--quick", action = "store_true", default = False)
+    parser.add_option("--only", default = None)
+    parser.add_option("--json", dest = "json_file", default = None)
+    parser.add_option("--compare", default = None)
+    parser.add_option("--threshold", type = "float", default = 0.1)
+    options, args = parser.parse_args(argv)
+    # the peers may be gone by the time we write to them
+    signal.signal(signal.SIGPIPE, signal.SIG_IGN)
+
+    benchmarks = make_benchmarks(options.quick)
+    if options.only:
+        only = options.only.split(",")
+        benchmarks = [bm for bm in benchmarks if bm[0] in only]
+    results = {}
+    for name, func, args in benchmarks:
+        results[name] = dict((variant, func(variant, *args))
+            for variant in VARIANTS)
+    report(results)
+
+    if options.json_file:
+        with open(options.json_file, "w") as f:
+            json.dump(results, f, indent = 4, sort_keys = True)
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, options.threshold)
+        for name, metric, previous, current in regressions:
+            print "REGRESSION: %s %s: %.2f -> %.2f" % (name, metric,
+                previous, current)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
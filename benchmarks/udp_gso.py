@@ -0,0 +1,47 @@
+"""
+measures the datagram rate of send_segmented() (one call per up to 64
+datagrams, with UDP segmentation offload) against sending the same
+datagrams one by one with send(), and with send_many(), over loopback.
+
+usage: python udp_gso.py [datagrams] [datagram size]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    ".."))
+import sock2
+
+
+def main(count, size):
+    receiver = sock2.UdpSocket("127.0.0.1", 0)
+    # nobody reads: the datagrams are simply dropped once the receive
+    # buffer fills up, which doesn't slow the sender down
+    sender = sock2.UdpSocket("127.0.0.1", 0)
+    endpoint = receiver.local_endpoint
+    payload = "x" * (size * 64)
+    datagrams = [(payload[:size], endpoint)] * 64
+    rounds = count // 64
+    t0 = time.time()
+    for i in xrange(rounds):
+        for data, addr in datagrams:
+            sender.send(data, addr)
+    t1 = time.time()
+    for i in xrange(rounds):
+        sender.send_many(datagrams)
+    t2 = time.time()
+    for i in xrange(rounds):
+        sender.send_segmented(payload, size, endpoint)
+    t3 = time.time()
+    print "GSO %s" % ("available" if sock2.socket._udp_gso else
+        "unavailable (send_segmented falls back to send_many)",)
+    for name, elapsed in [("send", t1 - t0), ("send_many", t2 - t1),
+            ("send_segmented", t3 - t2)]:
+        print "%-15s %12.0f datagrams/sec" % (name, rounds * 64 / elapsed)
+    sender.close()
+    receiver.close()
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 640000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1200)
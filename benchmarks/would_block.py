@@ -0,0 +1,40 @@
+"""
+measures the would-block path of non-blocking receives: recv() on a socket
+with no data (which raises and catches an EAGAIN error before returning an
+empty string) against try_recv() (which polls first, and returns None
+without raising anything), for TCP and UDP sockets.
+
+usage: python would_block.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    ".."))
+import sock2
+
+
+def measure(func, iterations):
+    """returns the cost of a single call, in nanoseconds"""
+    return min(timeit.repeat(func, number = iterations, repeat = 3)) / \
+        iterations * 1e9
+
+def main(iterations):
+    listener = sock2.TcpListener("127.0.0.1", 0)
+    client = sock2.TcpSocket(*listener.local_endpoint)
+    conn = listener.accept()
+    conn.timeout = 0
+    udp = sock2.UdpSocket("127.0.0.1", 0)
+    udp.timeout = 0
+    for name, sock in [("tcp", conn), ("udp", udp)]:
+        assert sock.try_recv(100) is None
+        recv = measure(lambda: sock.recv(100), iterations)
+        try_recv = measure(lambda: sock.try_recv(100), iterations)
+        print "%s: recv %8.1f ns, try_recv %8.1f ns (%.1fx cheaper)" % (
+            name, recv, try_recv, recv / try_recv)
+    for sock in (udp, conn, client, listener):
+        sock.close()
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,86 @@
+"""
+measures sendall() against ZeroCopySender.send() (with no threshold), per
+write size, to find the size below which zerocopy doesn't pay off (the
+default threshold of zerocopy.ZeroCopySender). the sink is a forked process
+over loopback by default, where the kernel copies anyway -- so for meaningful
+numbers, pass the endpoint of a sink on another host (e.g., a netcat writing
+to /dev/null).
+
+usage: python zerocopy.py [host:port] [total MB]
+"""
+import os
+import sys
+import time
+import signal
+import _socket
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    ".."))
+import sock2
+from sock2.zerocopy import ZeroCopySender
+
+
+SIZES = (1024, 4096, 8192, 16384, 32768, 65536, 262144, 1 << 20)
+
+def _sink(listener):
+    while True:
+        conn, addr = listener.accept()
+        while conn.recv(1 << 20):
+            pass
+        conn.close()
+
+def measure(endpoint, size, total, zerocopy):
+    """returns the throughput, in MB/sec"""
+    sock = sock2.TcpSocket(*endpoint)
+    # a ring of buffers, so the ones in flight aren't reused
+    free = [bytearray("x" * size) for i in range(64)]
+    sender = ZeroCopySender(sock, threshold = 0, on_complete = free.append)
+    count = total // size
+    t0 = time.time()
+    for i in xrange(count):
+        if not zerocopy:
+            sock.sendall(free[-1])
+            continue
+        while not free:
+            sender.wait(0.01)
+        sender.send(free.pop())
+    sender.wait()
+    elapsed = time.time() - t0
+    sock.close()
+    return count * size / elapsed / 1e6
+
+def main(argv):
+    signal.signal(signal.SIGPIPE, signal.SIG_IGN)
+    pid = None
+    if argv and ":" in argv[0]:
+        host, port = argv.pop(0).rsplit(":", 1)
+        endpoint = (host, int(port))
+    else:
+        listener = _socket.socket(_socket.AF_INET, _socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(8)
+        endpoint = listener.getsockname()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _sink(listener)
+            finally:
+                os._exit(0)
+        listener.close()
+        print "(loopback: the kernel copies zerocopy sends too)"
+    total = int(argv[0] if argv else 256) << 20
+    try:
+        print "%10s %14s %14s %8s" % ("size", "copy MB/s", "zerocopy MB/s",
+            "ratio")
+        for size in SIZES:
+            copy = measure(endpoint, size, total, False)
+            zerocopy = measure(endpoint, size, total, True)
+            print "%10d %14.1f %14.1f %8.2f" % (size, copy, zerocopy,
+                zerocopy / copy)
+    finally:
+        if pid is not None:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -10,6 +10,7 @@ setup(name = "sock2",
     author_email = "tomerfiliba@gmail.com",
     license = "MIT",
     url = "http://tomerfiliba.com/projects/sock2",
-    packages = ['sock2']
+    packages = ['sock2'],
+    extras_require = {"aio" : ["trollius"]},
 )
 
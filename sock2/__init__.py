@@ -55,7 +55,6 @@ Design Goals:
 
 To-do list for the final version:
     * finish ipv6 support
-    * finish raw sockets support
     * thorough unittests
     * documentation:
         * user level docs and examples
@@ -65,7 +64,13 @@ To-do list for the final version:
 import consts
 from errors import *
 from socket import *
-from dns import Address, loopback, thishost
+from dns import Address, ResolverCache, loopback, thishost
+from buffers import BufferPool, DatagramBatch
+from options import (OptionProfile, low_latency_profile,
+    bulk_throughput_profile)
+from stream import NetworkStream
+from pool import ConnectionPool
+from zerocopy import ZeroCopySender
 
 
 # shorthands
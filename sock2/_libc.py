@@ -0,0 +1,500 @@
+"""
+Libc -- the system calls that _socket does not expose
+
+_socket only wraps the classic BSD calls; the vectored and batched ones
+(writev, sendmsg, etc.) are reached here through ctypes, when the platform's
+libc provides them. a function that is not available on this platform is
+None, so callers can check for it and fall back to the plain _socket calls.
+
+errors are raised as _socket.error(errno, strerror), exactly like _socket
+does, so callers can handle both the same way.
+"""
+import os
+import sys
+import errno
+import struct
+import ctypes
+import _socket
+import threading
+
+
+try:
+    libc = ctypes.CDLL(None, use_errno = True)
+except (OSError, TypeError):
+    libc = None
+
+is_linux = sys.platform.startswith("linux")
+
+# the max number of buffers a single vectored call may take
+IOV_MAX = 1024
+
+
+def _function(name, restype, *argtypes):
+    func = getattr(libc, name, None)
+    if func is None:
+        return None
+    func.restype = restype
+    func.argtypes = argtypes
+    return func
+
+def _raise_errno():
+    err = ctypes.get_errno()
+    raise _socket.error(err, os.strerror(err))
+
+
+#
+# buffers
+#
+class Py_buffer(ctypes.Structure):
+    # only the leading fields are of interest; the rest is padding that is
+    # large enough for the struct on all python versions
+    _fields_ = [
+        ("buf", ctypes.c_void_p),
+        ("obj", ctypes.c_void_p),
+        ("len", ctypes.c_ssize_t),
+        ("_rest", ctypes.c_char * 128),
+    ]
+
+_get_buffer = ctypes.pythonapi.PyObject_GetBuffer
+_get_buffer.argtypes = [ctypes.py_object, ctypes.POINTER(Py_buffer),
+    ctypes.c_int]
+_release_buffer = ctypes.pythonapi.PyBuffer_Release
+_release_buffer.argtypes = [ctypes.POINTER(Py_buffer)]
+_release_buffer.restype = None
+_as_read_buffer = getattr(ctypes.pythonapi, "PyObject_AsReadBuffer", None)
+if _as_read_buffer is not None:
+    _as_read_buffer.argtypes = [ctypes.py_object,
+        ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_ssize_t)]
+
+# the offset of a str's characters from the start of the object (CPython)
+_probe = "probe"
+_str_data_offset = ctypes.cast(ctypes.c_char_p(_probe),
+    ctypes.c_void_p).value - id(_probe)
+del _probe
+
+def buffer_address(obj):
+    """returns the (address, length) of the memory underlying the given
+    buffer object (str, bytearray, memoryview, etc.), without copying it.
+    the caller must keep `obj` alive for as long as the address is used"""
+    if type(obj) is str:
+        # the common case, without going through the buffer protocol
+        return id(obj) + _str_data_offset, len(obj)
+    view = Py_buffer()
+    try:
+        _get_buffer(obj, ctypes.byref(view), 0)
+    except (TypeError, BufferError):
+        if _as_read_buffer is None:
+            raise
+        # old-style buffers (e.g., python 2's `buffer`)
+        address = ctypes.c_void_p()
+        length = ctypes.c_ssize_t()
+        _as_read_buffer(obj, ctypes.byref(address), ctypes.byref(length))
+        return address.value, length.value
+    address, length = view.buf, view.len
+    _release_buffer(ctypes.byref(view))
+    return address, length
+
+
+#
+# structs
+#
+class iovec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+class msghdr(ctypes.Structure):
+    # this is the linux (glibc) layout; the BSDs use ints for the lengths
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", msghdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+# large enough for any sockaddr (sizeof(struct sockaddr_storage))
+SOCKADDR_SIZE = 128
+# the size of sockaddr_un's sun_path
+UNIX_PATH_MAX = 108
+
+class cmsghdr(ctypes.Structure):
+    _fields_ = [
+        ("cmsg_len", ctypes.c_size_t),
+        ("cmsg_level", ctypes.c_int),
+        ("cmsg_type", ctypes.c_int),
+    ]
+
+# ancillary data types
+SCM_RIGHTS = 1
+
+_cmsghdr_struct = struct.Struct("=%sii" % (
+    "Q" if ctypes.sizeof(ctypes.c_size_t) == 8 else "I",))
+
+def CMSG_ALIGN(length):
+    align = ctypes.sizeof(ctypes.c_size_t)
+    return (length + align - 1) & ~(align - 1)
+
+def CMSG_LEN(length):
+    return CMSG_ALIGN(ctypes.sizeof(cmsghdr)) + length
+
+def CMSG_SPACE(length):
+    return CMSG_ALIGN(ctypes.sizeof(cmsghdr)) + CMSG_ALIGN(length)
+
+def pack_ancillary(items):
+    """packs a list of (level, type, data) tuples into a control buffer, as
+    sendmsg takes it; returns a ctypes char buffer"""
+    raw = ""
+    for level, type, data in items:
+        header = _cmsghdr_struct.pack(CMSG_LEN(len(data)), level, type)
+        chunk = header + data
+        raw += chunk + "\x00" * (CMSG_SPACE(len(data)) - len(chunk))
+    return ctypes.create_string_buffer(raw, len(raw))
+
+def unpack_ancillary(raw, length):
+    """unpacks the first `length` bytes of a control buffer, as filled by
+    recvmsg, into a list of (level, type, data) tuples"""
+    items = []
+    header_size = CMSG_ALIGN(ctypes.sizeof(cmsghdr))
+    offset = 0
+    while offset + header_size <= length:
+        cmsg_len, level, type = _cmsghdr_struct.unpack_from(raw, offset)
+        if cmsg_len < header_size:
+            break
+        items.append((level, type,
+            raw[offset + header_size:offset + min(cmsg_len, length - offset)]))
+        offset += CMSG_ALIGN(cmsg_len)
+    return items
+
+def make_iovecs(buffers):
+    """returns a ctypes array of iovecs, pointing at the given buffers"""
+    vecs = (iovec * len(buffers))()
+    for i, buf in enumerate(buffers):
+        vecs[i].iov_base, vecs[i].iov_len = buffer_address(buf)
+    return vecs
+
+def pack_sockaddr(family, endpoint):
+    """packs the given endpoint into a sockaddr structure of the given
+    family, returned as a ctypes char buffer"""
+    if family == _socket.AF_INET:
+        host, port = endpoint
+        try:
+            packed = _socket.inet_aton(host)
+        except _socket.error:
+            packed = _socket.inet_aton(_socket.gethostbyname(host))
+        raw = struct.pack("=H", family) + struct.pack("!H4s", port, packed)
+        raw += "\x00" * 8
+    elif family == _socket.AF_INET6:
+        host, port = endpoint[:2]
+        flowinfo, scope_id = (tuple(endpoint[2:]) + (0, 0))[:2]
+        raw = (struct.pack("=H", family) +
+            struct.pack("!HI16s", port, flowinfo,
+                _socket.inet_pton(_socket.AF_INET6, host)) +
+            struct.pack("=I", scope_id))
+    elif family == getattr(_socket, "AF_UNIX", None):
+        # a path, or an abstract name (starting with a NUL, linux specific)
+        if len(endpoint) >= UNIX_PATH_MAX:
+            raise ValueError("path too long", endpoint)
+        raw = struct.pack("=H", family) + endpoint
+        if not endpoint.startswith("\x00"):
+            raw += "\x00"
+    else:
+        raise ValueError("unsupported address family", family)
+    return ctypes.create_string_buffer(raw, len(raw))
+
+def unpack_sockaddr(raw, offset = 0):
+    """unpacks the sockaddr structure at the given offset of `raw` into an
+    endpoint tuple, like the ones _socket returns"""
+    family, = struct.unpack_from("=H", raw, offset)
+    if family == _socket.AF_INET:
+        port, packed = struct.unpack_from("!H4s", raw, offset + 2)
+        return _socket.inet_ntoa(packed), port
+    elif family == _socket.AF_INET6:
+        port, flowinfo, packed = struct.unpack_from("!HI16s", raw, offset + 2)
+        scope_id, = struct.unpack_from("=I", raw, offset + 24)
+        return (_socket.inet_ntop(_socket.AF_INET6, packed), port, flowinfo,
+            scope_id)
+    elif family == getattr(_socket, "AF_UNIX", None):
+        path = raw[offset + 2:offset + 2 + UNIX_PATH_MAX]
+        if path.startswith("\x00"):
+            # an abstract name (or none at all, for an unbound socket)
+            return path.rstrip("\x00")
+        return path.split("\x00", 1)[0]
+    else:
+        raise ValueError("unsupported address family", family)
+
+
+#
+# system calls
+#
+_writev = _function("writev", ctypes.c_ssize_t, ctypes.c_int,
+    ctypes.POINTER(iovec), ctypes.c_int)
+_sendmsg = _function("sendmsg", ctypes.c_ssize_t, ctypes.c_int,
+    ctypes.POINTER(msghdr), ctypes.c_int) if is_linux else None
+
+def writev(fd, buffers):
+    """writes the given buffers to the fd in a single call; returns the
+    number of bytes written"""
+    vecs = make_iovecs(buffers)
+    while True:
+        n = _writev(fd, vecs, len(buffers))
+        if n >= 0:
+            return n
+        if ctypes.get_errno() != errno.EINTR:
+            _raise_errno()
+
+def sendmsg(fd, buffers, family = None, endpoint = None, flags = 0,
+        ancillary = None):
+    """sends the given buffers as a single message, optionally to the given
+    endpoint (for unconnected sockets), and with the given ancillary data (a
+    list of (level, type, data) tuples); returns the number of bytes sent"""
+    vecs = make_iovecs(buffers)
+    msg = msghdr()
+    msg.msg_iov = vecs
+    msg.msg_iovlen = len(buffers)
+    if endpoint is not None:
+        name = pack_sockaddr(family, endpoint)
+        msg.msg_name = ctypes.addressof(name)
+        msg.msg_namelen = len(name)
+    if ancillary:
+        control = pack_ancillary(ancillary)
+        msg.msg_control = ctypes.addressof(control)
+        msg.msg_controllen = len(control)
+    while True:
+        n = _sendmsg(fd, ctypes.byref(msg), flags)
+        if n >= 0:
+            return n
+        if ctypes.get_errno() != errno.EINTR:
+            _raise_errno()
+
+_recvmsg = _function("recvmsg", ctypes.c_ssize_t, ctypes.c_int,
+    ctypes.POINTER(msghdr), ctypes.c_int) if is_linux else None
+
+# recvmsg's flags (linux)
+MSG_CTRUNC = 0x8
+MSG_CMSG_CLOEXEC = 0x40000000
+
+def recvmsg(fd, buffer, ancillary_size, flags = 0, with_endpoint = False):
+    """receives a message into the given writable buffer, along with up to
+    `ancillary_size` bytes of ancillary data. returns a tuple of (the number
+    of bytes received, a list of (level, type, data) tuples, the message's
+    flags); with `with_endpoint`, the sender's endpoint (for unconnected
+    sockets) is appended to the tuple"""
+    address, length = buffer_address(buffer)
+    vec = iovec(address, length)
+    control = ctypes.create_string_buffer(ancillary_size)
+    msg = msghdr()
+    msg.msg_iov = ctypes.pointer(vec)
+    msg.msg_iovlen = 1
+    msg.msg_control = ctypes.addressof(control)
+    msg.msg_controllen = ancillary_size
+    if with_endpoint:
+        name = ctypes.create_string_buffer(SOCKADDR_SIZE)
+        msg.msg_name = ctypes.addressof(name)
+        msg.msg_namelen = SOCKADDR_SIZE
+    while True:
+        n = _recvmsg(fd, ctypes.byref(msg), flags)
+        if n >= 0:
+            break
+        if ctypes.get_errno() != errno.EINTR:
+            _raise_errno()
+    result = (n, unpack_ancillary(control.raw, msg.msg_controllen),
+        msg.msg_flags)
+    if with_endpoint:
+        result += (unpack_sockaddr(name.raw) if msg.msg_namelen else None,)
+    return result
+
+_getsockname = _function("getsockname", ctypes.c_int, ctypes.c_int,
+    ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint32)) if is_linux else None
+
+def socket_family(fd):
+    """returns the address family of the socket behind the given fd"""
+    name = ctypes.create_string_buffer(SOCKADDR_SIZE)
+    length = ctypes.c_uint32(SOCKADDR_SIZE)
+    if _getsockname(fd, name, ctypes.byref(length)) != 0:
+        _raise_errno()
+    return struct.unpack_from("=H", name.raw)[0]
+
+# linux-specific
+MSG_WAITFORONE = 0x10000
+
+# UDP segmentation offload (linux/udp.h): with UDP_SEGMENT, a single send
+# is split by the kernel (or the NIC) into datagrams of the given size; with
+# UDP_GRO, consecutive datagrams of the same flow may be received as one
+# buffer, along with their segment size
+SOL_UDP = 17
+UDP_SEGMENT = 103
+UDP_GRO = 104
+# the max number of segments per send (newer kernels allow 128)
+UDP_MAX_SEGMENTS = 64
+
+_recvmmsg = _function("recvmmsg", ctypes.c_int, ctypes.c_int,
+    ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int,
+    ctypes.c_void_p) if is_linux else None
+_sendmmsg = _function("sendmmsg", ctypes.c_int, ctypes.c_int,
+    ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int) if is_linux else None
+
+def recvmmsg(fd, mmsgs, count, flags = 0):
+    """receives up to `count` messages into the given (prepared) array of
+    mmsghdrs; returns the number of messages received"""
+    while True:
+        n = _recvmmsg(fd, mmsgs, count, flags, None)
+        if n >= 0:
+            return n
+        if ctypes.get_errno() != errno.EINTR:
+            _raise_errno()
+
+# (family, endpoint) -> (sockaddr buffer, its address, its length). only
+# literal addresses are cached (names may resolve differently later), and the
+# entries are never evicted, so their addresses stay valid
+_sockaddr_cache = {}
+_SOCKADDR_CACHE_SIZE = 1024
+
+def _sockaddr_of(family, endpoint):
+    key = (family, endpoint)
+    try:
+        return _sockaddr_cache[key]
+    except KeyError:
+        pass
+    name = pack_sockaddr(family, endpoint)
+    entry = (name, ctypes.addressof(name), len(name))
+    cacheable = len(_sockaddr_cache) < _SOCKADDR_CACHE_SIZE
+    if cacheable and family in (_socket.AF_INET, _socket.AF_INET6):
+        try:
+            _socket.inet_pton(family, endpoint[0])
+        except (_socket.error, ValueError, TypeError):
+            cacheable = False
+    if cacheable:
+        _sockaddr_cache[key] = entry
+    return entry
+
+# sendmmsg's headers are allocated once per thread, with each message 
+# pointing at its own iovec, and they remember the sockaddr they point at:
+# setting ctypes fields one by one costs more than the system call itself, so
+# a call only packs the iovecs (with a single struct.pack), and updates the
+# names that changed -- usually none, as most batches go to a single peer
+_send_headers = threading.local()
+_iovec_format = "Q" if ctypes.sizeof(ctypes.c_void_p) == 8 else "I"
+_iovec_format += "Q" if ctypes.sizeof(ctypes.c_size_t) == 8 else "I"
+# count -> Struct of count iovecs
+_iovec_structs = {}
+
+def _send_headers_for(count):
+    headers = getattr(_send_headers, "headers", None)
+    if headers is None or len(headers[0]) < count:
+        capacity = max(count, 64)
+        mmsgs = (mmsghdr * capacity)()
+        vecs = (iovec * capacity)()
+        for i in range(capacity):
+            hdr = mmsgs[i].msg_hdr
+            hdr.msg_iov = ctypes.pointer(vecs[i])
+            hdr.msg_iovlen = 1
+        # the (address, length) of each message's sockaddr
+        names = [(0, 0)] * capacity
+        headers = _send_headers.headers = (mmsgs, vecs, names)
+    return headers
+
+def _iovec_struct(count):
+    try:
+        return _iovec_structs[count]
+    except KeyError:
+        packer = _iovec_structs[count] = struct.Struct("=" + 
+            _iovec_format * count)
+        return packer
+
+def sendmmsg(fd, family, datagrams, flags = 0):
+    """sends the given (data, endpoint) tuples in a single call; returns the
+    number of datagrams sent, which may be less than len(datagrams)"""
+    count = len(datagrams)
+    mmsgs, vecs, slot_names = _send_headers_for(count)
+    buffers = []
+    add_buffer = buffers.extend
+    # keeps the sockaddrs that weren't cached alive
+    names = []
+    last_endpoint = None
+    name = (0, 0)
+    for i, (data, endpoint) in enumerate(datagrams):
+        if type(data) is str:
+            add_buffer((id(data) + _str_data_offset, len(data)))
+        else:
+            add_buffer(buffer_address(data))
+        if endpoint is not last_endpoint:
+            if endpoint is None:
+                name = (0, 0)
+            else:
+                buf, address, length = _sockaddr_of(family, endpoint)
+                names.append(buf)
+                name = (address, length)
+            last_endpoint = endpoint
+        if slot_names[i] != name:
+            hdr = mmsgs[i].msg_hdr
+            hdr.msg_name, hdr.msg_namelen = name
+            slot_names[i] = name
+    raw = _iovec_struct(count).pack(*buffers)
+    ctypes.memmove(vecs, raw, len(raw))
+    while True:
+        n = _sendmmsg(fd, mmsgs, count, flags)
+        if n >= 0:
+            return n
+        if ctypes.get_errno() != errno.EINTR:
+            _raise_errno()
+
+_sendfile = _function("sendfile", ctypes.c_ssize_t, ctypes.c_int, 
+    ctypes.c_int, ctypes.POINTER(ctypes.c_int64), 
+    ctypes.c_size_t) if is_linux else None
+_splice = _function("splice", ctypes.c_ssize_t, ctypes.c_int, ctypes.c_void_p,
+    ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, 
+    ctypes.c_uint) if is_linux else None
+
+SPLICE_F_MOVE = 1
+SPLICE_F_NONBLOCK = 2
+SPLICE_F_MORE = 4
+
+def sendfile(out_fd, in_fd, offset, count):
+    """sends up to `count` bytes of the file `in_fd`, starting at `offset`,
+    to `out_fd`; the file's position is not changed. returns the number of
+    bytes sent (0 means the file's end was reached)"""
+    offset = ctypes.c_int64(offset)
+    while True:
+        n = _sendfile(out_fd, in_fd, ctypes.byref(offset), count)
+        if n >= 0:
+            return n
+        if ctypes.get_errno() != errno.EINTR:
+            _raise_errno()
+
+def splice(in_fd, out_fd, count, flags = SPLICE_F_MOVE):
+    """moves up to `count` bytes from `in_fd` to `out_fd`, one of which 
+    must be a pipe, without copying them through user space. returns the 
+    number of bytes moved (0 means end-of-file)"""
+    while True:
+        n = _splice(in_fd, None, out_fd, None, count, flags)
+        if n >= 0:
+            return n
+        if ctypes.get_errno() != errno.EINTR:
+            _raise_errno()
+
+if _writev is None:
+    writev = None
+if _sendmsg is None:
+    sendmsg = None
+if _recvmsg is None:
+    recvmsg = None
+if _getsockname is None:
+    socket_family = None
+if _recvmmsg is None:
+    recvmmsg = None
+if _sendmmsg is None:
+    sendmmsg = None
+if _sendfile is None:
+    sendfile = None
+if _splice is None:
+    splice = None
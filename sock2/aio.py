@@ -0,0 +1,182 @@
+"""
+AIO -- asyncio integration for sock2 sockets
+
+Awaitable counterparts of the blocking socket operations, built directly on
+the event loop's add_reader/add_writer, so sock2 sockets can be served by an
+asyncio application without wrapping them back into stdlib sockets. each
+function first attempts the operation right away, and only if it would block
+does it wait for readiness -- so a socket that's already readable costs a
+single system call.
+
+the functions return futures, which coroutines wait on with `yield From()`.
+they return the same types and raise the same exceptions as their blocking
+counterparts; the sockets are switched to non-blocking mode (timeout = 0) as
+needed.
+
+Example:
+    @trollius.coroutine
+    def echo(listener):
+        conn = yield From(aio.accept(listener))
+        data = yield From(aio.recv(conn, 1000))
+        yield From(aio.sendall(conn, data))
+
+Notes:
+    * this module requires trollius (the python 2 port of asyncio; pip 
+      install sock2[aio]), or asyncio itself where it's available
+"""
+import os
+import errno
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+from errors import TimeoutError, ConnectError
+from socket import DatagramSocket
+
+
+class _WouldBlock(object):
+    __slots__ = []
+    def __repr__(self):
+        return "<would block>"
+_would_block = _WouldBlock()
+
+
+def _nonblocking(sock):
+    if sock._sock.gettimeout() != 0.0:
+        sock.timeout = 0
+
+def _new_future(loop):
+    if hasattr(loop, "create_future"):
+        return loop.create_future()
+    return asyncio.Future(loop = loop)
+
+def _perform(loop, sock, writable, attempt, wait_first = False):
+    """calls attempt() right away (unless wait_first is set), and then again
+    whenever the socket becomes ready, until it returns anything other than
+    _would_block. returns a future of the attempt's result (or exception)"""
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    _nonblocking(sock)
+    future = _new_future(loop)
+    if not wait_first:
+        try:
+            result = attempt()
+        except Exception, ex:
+            future.set_exception(ex)
+            return future
+        if result is not _would_block:
+            future.set_result(result)
+            return future
+
+    fd = sock.fileno()
+    if writable:
+        add, remove = loop.add_writer, loop.remove_writer
+    else:
+        add, remove = loop.add_reader, loop.remove_reader
+
+    def ready():
+        if future.done():
+            return
+        try:
+            result = attempt()
+        except Exception, ex:
+            future.set_exception(ex)
+        else:
+            if result is not _would_block:
+                future.set_result(result)
+
+    # also takes care of removing the callback if the future is cancelled
+    future.add_done_callback(lambda future: remove(fd))
+    add(fd, ready)
+    return future
+
+
+#
+# APIs
+#
+def accept(listener, loop = None):
+    """accepts a connection on the given ListenerSocket; the future's result
+    is the new (non-blocking) connected socket, as returned by accept()"""
+    def attempt():
+        try:
+            conn = listener.accept()
+        except TimeoutError:
+            return _would_block
+        conn.timeout = 0
+        return conn
+    return _perform(loop, listener, False, attempt)
+
+def connect(sock, endpoint, loop = None):
+    """connects the given ConnectedSocket to the remote endpoint. note that
+    host names are resolved synchronously; pass an ip address to avoid it"""
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    _nonblocking(sock)
+    try:
+        sock.connect(endpoint)
+    except (TimeoutError, ConnectError), ex:
+        if ex.errno not in (errno.EINPROGRESS, errno.EAGAIN, errno.EWOULDBLOCK,
+                None):
+            future = _new_future(loop)
+            future.set_exception(ex)
+            return future
+    else:
+        future = _new_future(loop)
+        future.set_result(None)
+        return future
+
+    def attempt():
+        err = sock.error_state
+        if err:
+            raise ConnectError(err, os.strerror(err))
+        sock._is_connected = True
+        sock._is_bound = True
+    return _perform(loop, sock, True, attempt, wait_first = True)
+
+def recv(sock, count, loop = None):
+    """receives up to `count` bytes from the given socket. for a
+    ConnectedSocket, the future's result is the data (and EOFError is raised
+    if the connection was closed); for a DatagramSocket, it's a tuple of
+    (data, addr)"""
+    if isinstance(sock, DatagramSocket):
+        def attempt():
+            data, addr = sock.recv(count)
+            if addr is None:
+                return _would_block
+            return data, addr
+    else:
+        def attempt():
+            return sock.recv(count) or _would_block
+    return _perform(loop, sock, False, attempt)
+
+def send(sock, data, addr = None, loop = None):
+    """sends the given data over the socket (to `addr`, for a
+    DatagramSocket). the future's result is the number of bytes sent, which
+    may be less than len(data) for a ConnectedSocket; see sendall()"""
+    if isinstance(sock, DatagramSocket):
+        def attempt():
+            try:
+                return sock.send(data, addr)
+            except TimeoutError:
+                return _would_block
+    else:
+        def attempt():
+            try:
+                return sock.send(data)
+            except TimeoutError:
+                return _would_block
+    return _perform(loop, sock, True, attempt)
+
+def sendall(sock, data, loop = None):
+    """sends all of the given data over the ConnectedSocket, resuming on
+    partial sends. the future's result is the number of bytes sent"""
+    view = memoryview(data)
+    progress = [0]
+    def attempt():
+        while progress[0] < len(view):
+            try:
+                progress[0] += sock.send(view[progress[0]:])
+            except TimeoutError:
+                return _would_block
+        return progress[0]
+    return _perform(loop, sock, True, attempt)
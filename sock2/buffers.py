@@ -0,0 +1,168 @@
+"""
+Buffers -- reusable memory for the zero-copy APIs
+
+recv_into() and friends fill memory owned by the caller, rather than
+returning a newly allocated string. this module provides that memory: a
+BufferPool carves fixed-size chunks out of a single arena (one bytearray)
+and hands them out as memoryviews, so a long-lived connection can receive
+into the same memory over and over again. similarly, a DatagramBatch holds
+many received datagrams in one preallocated arena.
+"""
+import array
+import ctypes
+import _libc
+
+
+class BufferPool(object):
+    """
+    a pool of fixed-size buffers, all carved out of a single arena.
+
+    chunk_size - the size of each buffer
+    count - the number of buffers in the arena
+
+    acquire() returns a memoryview of `chunk_size` bytes, which should be
+    given back with release() once the caller is done with it. if the arena
+    is exhausted, acquire() allocates a standalone buffer instead of failing,
+    so the pool never blocks; such buffers are simply dropped on release.
+    """
+    __slots__ = ["arena", "chunk_size", "_free", "_chunks"]
+
+    def __init__(self, chunk_size = 65536, count = 4):
+        if chunk_size <= 0 or count <= 0:
+            raise ValueError("chunk_size and count must be positive")
+        self.chunk_size = chunk_size
+        self.arena = bytearray(chunk_size * count)
+        view = memoryview(self.arena)
+        self._free = [view[i:i + chunk_size]
+            for i in range(0, len(self.arena), chunk_size)]
+        # the arena's chunks, by identity
+        self._chunks = dict((id(chunk), chunk) for chunk in self._free)
+
+    def __repr__(self):
+        return "<%s(chunk_size = %d, free = %d)>" % (self.__class__.__name__,
+            self.chunk_size, len(self._free))
+
+    def __len__(self):
+        """the number of free buffers in the arena"""
+        return len(self._free)
+
+    def acquire(self):
+        """returns a free buffer (a writable memoryview of chunk_size bytes)"""
+        try:
+            return self._free.pop()
+        except IndexError:
+            return memoryview(bytearray(self.chunk_size))
+
+    def release(self, buffer):
+        """returns a buffer obtained from acquire() to the pool"""
+        if self._chunks.get(id(buffer)) is buffer:
+            self._free.append(buffer)
+
+    def recv(self, sock, count = 0):
+        """receives from the given ConnectedSocket into a pooled buffer.
+        returns a tuple of (buffer, length); the data is buffer[:length], and
+        the buffer should be release()d once it has been consumed. on timeout
+        the buffer is released right away, and (None, 0) is returned"""
+        buffer = self.acquire()
+        try:
+            n = sock.recv_into(buffer, count)
+        except:
+            self.release(buffer)
+            raise
+        if not n:
+            self.release(buffer)
+            return None, 0
+        return buffer, n
+
+
+class DatagramBatch(object):
+    """
+    a batch of datagrams, as received by DatagramSocket.recv_many(). rather
+    than a list of (data, addr) tuples, the payloads are stored back to back
+    in a single preallocated arena, and described by compact arrays:
+
+    arena - the bytearray holding the payloads, `bufsize` bytes apart
+    offsets - an array of the datagrams' offsets in the arena
+    lengths - an array of the datagrams' lengths
+    count - the number of datagrams currently in the batch
+
+    batch[i] is a memoryview of the i'th datagram (no copying is involved),
+    and batch.address(i) is its sender; iterating over the batch yields
+    (memoryview, address) tuples. a batch can be passed back to recv_many()
+    to be refilled, which reuses all of its memory.
+    """
+    __slots__ = ["capacity", "bufsize", "count", "arena", "offsets",
+        "lengths", "_view", "_names", "_addrs", "_mmsgs"]
+
+    def __init__(self, capacity = 64, bufsize = 2048):
+        if capacity <= 0 or bufsize <= 0:
+            raise ValueError("capacity and bufsize must be positive")
+        self.capacity = capacity
+        self.bufsize = bufsize
+        self.count = 0
+        self.arena = bytearray(capacity * bufsize)
+        self.offsets = array.array("l", range(0, len(self.arena), bufsize))
+        self.lengths = array.array("l", [0] * capacity)
+        self._view = memoryview(self.arena)
+        if _libc.recvmmsg is not None:
+            self._prepare_mmsgs()
+        else:
+            self._names = None
+            self._mmsgs = None
+            self._addrs = [None] * capacity
+
+    def _prepare_mmsgs(self):
+        # the message headers are built once, pointing into the arena, so
+        # refilling the batch involves no allocations at all
+        self._addrs = None
+        self._names = bytearray(self.capacity * _libc.SOCKADDR_SIZE)
+        arena = (ctypes.c_char * len(self.arena)).from_buffer(self.arena)
+        names = (ctypes.c_char * len(self._names)).from_buffer(self._names)
+        vecs = (_libc.iovec * self.capacity)()
+        self._mmsgs = (_libc.mmsghdr * self.capacity)()
+        for i in range(self.capacity):
+            vecs[i].iov_base = ctypes.addressof(arena) + self.offsets[i]
+            vecs[i].iov_len = self.bufsize
+            hdr = self._mmsgs[i].msg_hdr
+            hdr.msg_iov = ctypes.pointer(vecs[i])
+            hdr.msg_iovlen = 1
+            hdr.msg_name = ctypes.addressof(names) + i * _libc.SOCKADDR_SIZE
+            hdr.msg_namelen = _libc.SOCKADDR_SIZE
+
+    def _collect(self, count):
+        """records the lengths of the `count` messages just received"""
+        lengths = self.lengths
+        mmsgs = self._mmsgs
+        for i in range(count):
+            lengths[i] = mmsgs[i].msg_len
+            # the kernel overwrites the name's length; restore it
+            mmsgs[i].msg_hdr.msg_namelen = _libc.SOCKADDR_SIZE
+        self.count = count
+
+    def __repr__(self):
+        return "<%s(%d/%d datagrams)>" % (self.__class__.__name__, self.count,
+            self.capacity)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError(index)
+        offset = self.offsets[index]
+        return self._view[offset:offset + self.lengths[index]]
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i], self.address(i)
+
+    def address(self, index):
+        """the address of the i'th datagram's sender"""
+        if index < 0 or index >= self.count:
+            raise IndexError(index)
+        if self._addrs is not None:
+            return self._addrs[index]
+        return _libc.unpack_sockaddr(self._names,
+            index * _libc.SOCKADDR_SIZE)
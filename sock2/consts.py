@@ -7,6 +7,8 @@ work with.
 these consts are platform dependent and are generated from the _socket
 module when this module is loaded.
 """
+import sys
+import platform
 import _socket
 
 
@@ -32,3 +34,58 @@ TcpLevelOptions = _ConstContainer("TCP_")
 IpAddresses = _ConstContainer("INADDR_")
 EthernetAddresses = _ConstContainer("BDADDR_")
 RecvFlags = _ConstContainer("MSG_")
+
+
+#
+# options that _socket doesn't export (they're newer than it), by platform.
+# these are only added where _socket doesn't define them itself
+#
+if sys.platform.startswith("linux"):
+    # asm-generic/socket.h values; alpha, mips, parisc and sparc define
+    # their own SO_ numbers
+    if not platform.machine().startswith(("alpha", "mips", "parisc",
+            "sparc")):
+        _fallbacks = [(SocketLevelOptions, {
+            "SNDBUFFORCE" : 32,
+            "RCVBUFFORCE" : 33,
+            "BUSY_POLL" : 46,
+            "MAX_PACING_RATE" : 47,
+            "INCOMING_CPU" : 49,
+            "ZEROCOPY" : 60,
+        })]
+    else:
+        _fallbacks = []
+    _fallbacks.append((TcpLevelOptions, {
+        "CONGESTION" : 13,
+        "USER_TIMEOUT" : 18,
+        "FASTOPEN" : 23,
+        "NOTSENT_LOWAT" : 25,
+    }))
+    # MSG_ZEROCOPY sends and their notifications (see zerocopy.py)
+    _fallbacks.append((RecvFlags, {
+        "ERRQUEUE" : 0x2000,
+        "ZEROCOPY" : 0x4000000,
+    }))
+    _fallbacks.append((IpLevelOptions, {"RECVERR" : 11}))
+    _fallbacks.append((Ipv6LevelOptions, {"RECVERR" : 25}))
+elif sys.platform == "darwin":
+    _fallbacks = [(TcpLevelOptions, {
+        "FASTOPEN" : 0x105,
+        "NOTSENT_LOWAT" : 0x201,
+    })]
+elif sys.platform.startswith("freebsd"):
+    _fallbacks = [(TcpLevelOptions, {
+        "FASTOPEN" : 1025,
+        "CONGESTION" : 64,
+    })]
+else:
+    _fallbacks = []
+
+# (the loop variables are bound up front, so they can be deleted even where
+# there are no fallbacks)
+_container = _values = _name = _value = None
+for _container, _values in _fallbacks:
+    for _name, _value in _values.iteritems():
+        if not hasattr(_container, _name):
+            setattr(_container, _name, _value)
+del _fallbacks, _container, _values, _name, _value
@@ -6,7 +6,11 @@ to represent resolved DNS records.
 """
 import _socket
 import re
-from errors import AddressError
+import time
+import Queue
+import threading
+from collections import OrderedDict
+from errors import AddressError, TimeoutError
 
 
 #
@@ -91,14 +95,17 @@ class Address(object):
         return cls(official_name, addresses[0], aliases, addresses)
 
 
-def resolve(name_or_addr):
+def resolve(name_or_addr, cache = None):
     """
     resolves the given host name or host address to a Resolver instance.
     this function uses a heuristic to 'guess' the format of name_or_addr:
     if it's a valid ip string, it is resolved by address; otherwise it is
     resolved by name. if you need to be explicit, use Address.from_addr or
-    Address.from_name instead.
+    Address.from_name instead. if a ResolverCache is given, the lookup goes
+    through it.
     """
+    if cache is not None:
+        return cache.resolve(name_or_addr)
     try:
         canonize_ipaddr(name_or_addr)
     except ValueError:
@@ -106,11 +113,330 @@ def resolve(name_or_addr):
     else:
         return Address.from_addr(name_or_addr)
 
+
+class _PendingLookup(object):
+    __slots__ = ["done", "result", "error"]
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        # an unexpected exception of the query, which the waiters re-raise
+        self.error = None
+
+
+class ResolverPool(object):
+    """
+    a pool of worker threads, for running blocking lookups concurrently
+    (e.g., the A and AAAA queries of resolve_concurrently). the workers are
+    daemon threads, so an unfinished lookup doesn't hold up the process.
+    
+    workers - the number of worker threads
+    """
+    def __init__(self, workers = 4):
+        self._queue = Queue.Queue()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target = self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+    
+    def __repr__(self):
+        return "<%s(%d workers)>" % (self.__class__.__name__, 
+            len(self._threads))
+    
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            pending, func, args, done = job
+            try:
+                pending.result = func(*args)
+            except Exception, ex:
+                pending.result = ex
+            pending.done.set()
+            if done is not None:
+                done.put(pending)
+    
+    def submit(self, func, args = (), done = None):
+        """runs func(*args) on one of the workers. returns a pending lookup,
+        whose `result` is set (to the return value, or to the exception 
+        func raised) before its `done` event is; if a Queue is given as 
+        `done`, the pending lookup is also put into it when it finishes"""
+        pending = _PendingLookup()
+        self._queue.put((pending, func, args, done))
+        return pending
+    
+    def close(self):
+        """stops the workers, once they finish the lookups already queued"""
+        for thread in self._threads:
+            self._queue.put(None)
+        del self._threads[:]
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+def default_pool():
+    """returns the shared ResolverPool (created on first use)"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ResolverPool()
+        return _default_pool
+
+def _get_ips(name, family):
+    try:
+        infos = _socket.getaddrinfo(name, None, family, _socket.SOCK_STREAM)
+    except _socket.error:
+        return []
+    ips = []
+    for family, type, proto, canonname, sockaddr in infos:
+        if sockaddr[0] not in ips:
+            ips.append(sockaddr[0])
+    return ips
+
+def resolve_concurrently(name, pool = None, resolution_delay = 0.05,
+        timeout = None):
+    """
+    resolves the given host name's IPv6 (AAAA) and IPv4 (A) addresses in 
+    parallel, on a ResolverPool (default: default_pool()), in the spirit of
+    RFC 8305: once either query returns addresses, the other is given at 
+    most `resolution_delay` seconds more (a query that fails or comes up 
+    empty doesn't cut the other one short). returns a list of (family, 
+    ip-string) tuples, alternating between the families (starting with 
+    IPv6), which is the order in which connection attempts should be made.
+    
+    name may also be an ip-string, or an Address, in which case no lookups 
+    are made. raises TimeoutError if no addresses have been found within 
+    `timeout` seconds (None means no limit) while a query is still pending,
+    and AddressError if both queries come up empty.
+    """
+    if isinstance(name, (Address, LazyAddress)):
+        ips = [name.addr] + [a for a in name.addresses if a != name.addr]
+        return [(_socket.AF_INET, ip) for ip in ips]
+    for family in (_socket.AF_INET, getattr(_socket, "AF_INET6", None)):
+        if family is None:
+            continue
+        try:
+            _socket.inet_pton(family, name)
+        except (_socket.error, ValueError):
+            pass
+        else:
+            return [(family, name)]
+    
+    if pool is None:
+        pool = default_pool()
+    done = Queue.Queue()
+    v6 = pool.submit(_get_ips, (name, _socket.AF_INET6), done)
+    v4 = pool.submit(_get_ips, (name, _socket.AF_INET), done)
+    deadline = None if timeout is None else time.time() + timeout
+    try:
+        first = done.get(timeout = timeout)
+    except Queue.Empty:
+        raise TimeoutError()
+    if isinstance(first.result, Exception) or not first.result:
+        # the first query came up empty, so the other one is all there is:
+        # it's waited for as long as the timeout allows
+        if deadline is not None:
+            timeout = max(deadline - time.time(), 0)
+        try:
+            done.get(timeout = timeout)
+        except Queue.Empty:
+            raise TimeoutError()
+    else:
+        if deadline is not None:
+            resolution_delay = max(min(resolution_delay, 
+                deadline - time.time()), 0)
+        try:
+            done.get(timeout = resolution_delay)
+        except Queue.Empty:
+            pass
+    
+    v6_ips = v6.result if v6.done.is_set() else []
+    v4_ips = v4.result if v4.done.is_set() else []
+    if isinstance(v6_ips, Exception):
+        v6_ips = []
+    if isinstance(v4_ips, Exception):
+        v4_ips = []
+    if not v6_ips and not v4_ips:
+        raise AddressError("no addresses found", name)
+    endpoints = []
+    for i in range(max(len(v6_ips), len(v4_ips))):
+        if i < len(v6_ips):
+            endpoints.append((_socket.AF_INET6, v6_ips[i]))
+        if i < len(v4_ips):
+            endpoints.append((_socket.AF_INET, v4_ips[i]))
+    return endpoints
+
+
+class ResolverCache(object):
+    """
+    caches resolved Addresses, so that repeated lookups of the same host
+    don't block on the resolver every time.
+    
+    maxsize - the max number of entries; the least recently used entry is 
+              evicted when the cache is full
+    ttl - the default time-to-live of an entry, in seconds
+    negative_ttl - how long failed lookups (AddressError) are remembered
+    
+    the cache is thread-safe, and concurrent lookups of the same host are 
+    coalesced: only the first one queries the resolver, and the rest wait 
+    for its result.
+    """
+    def __init__(self, maxsize = 1024, ttl = 300, negative_ttl = 30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+    
+    def __repr__(self):
+        return "<%s(%d entries, %d hits, %d misses)>" % (
+            self.__class__.__name__, len(self._entries), self.hits, 
+            self.misses)
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def clear(self):
+        """removes all entries"""
+        with self._lock:
+            self._entries.clear()
+    
+    def invalidate(self, name_or_addr):
+        """removes the entries of the given host, if there are any"""
+        with self._lock:
+            self._entries.pop(("name", name_or_addr), None)
+            self._entries.pop(("addr", name_or_addr), None)
+    
+    def _lookup(self, key, query, arg, ttl):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > time.time():
+                # re-insert, to mark the entry as the most recently used
+                self._entries[key] = entry
+                self.hits += 1
+                pending = None
+                result = entry[1]
+            else:
+                self.misses += 1
+                pending = self._pending.get(key)
+                owner = pending is None
+                if owner:
+                    pending = self._pending[key] = _PendingLookup()
+        
+        if pending is not None:
+            if owner:
+                result = None
+                try:
+                    try:
+                        result = query(arg)
+                    except AddressError, ex:
+                        result = ex
+                    except Exception, ex:
+                        pending.error = ex
+                        raise
+                    self._store(key, result, ttl)
+                finally:
+                    # whatever happened, release the waiters
+                    with self._lock:
+                        self._pending.pop(key, None)
+                    pending.result = result
+                    pending.done.set()
+            else:
+                pending.done.wait()
+                if pending.error is not None:
+                    raise pending.error
+                result = pending.result
+        
+        if isinstance(result, AddressError):
+            raise AddressError(*result.args)
+        return result
+    
+    def _store(self, key, result, ttl):
+        if isinstance(result, AddressError):
+            ttl = self.negative_ttl
+        elif ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            if ttl > 0:
+                self._entries[key] = (time.time() + ttl, result)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last = False)
+    
+    def from_name(self, name, ttl = None):
+        """like Address.from_name, but cached; `ttl` overrides the default
+        time-to-live for this entry"""
+        return self._lookup(("name", name), Address.from_name, name, ttl)
+    
+    def from_addr(self, addr, ttl = None):
+        """like Address.from_addr, but cached; `ttl` overrides the default
+        time-to-live for this entry"""
+        return self._lookup(("addr", addr), Address.from_addr, addr, ttl)
+    
+    def resolve(self, name_or_addr, ttl = None):
+        """like resolve(), but cached"""
+        try:
+            canonize_ipaddr(name_or_addr)
+        except ValueError:
+            return self.from_name(name_or_addr, ttl)
+        else:
+            return self.from_addr(name_or_addr, ttl)
+
+class LazyAddress(object):
+    """
+    stands in for an Address that is resolved only when it's first used
+    (and then cached), so that merely defining it costs no DNS lookups.
+    
+    factory - a function that returns the Address
+    args - the arguments to pass to it
+    """
+    __slots__ = ["_factory", "_args", "_address"]
+    
+    def __init__(self, factory, *args):
+        self._factory = factory
+        self._args = args
+        self._address = None
+    
+    def resolve(self):
+        """returns the underlying Address, resolving it if necessary"""
+        if self._address is None:
+            self._address = self._factory(*self._args)
+        return self._address
+    
+    def _get_resolved(self):
+        return self._address is not None
+    resolved = property(_get_resolved, doc = 
+        "indicates whether or not the address has been resolved yet")
+    
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+    
+    def __str__(self):
+        return str(self.resolve())
+    
+    def __repr__(self):
+        if self._address is None:
+            return "<%s(unresolved)>" % (self.__class__.__name__,)
+        return repr(self._address)
+    
+    def __hash__(self):
+        return hash(self.resolve())
+    
+    def __cmp__(self, other):
+        return cmp(self.resolve(), other)
+
 #
-# built-in addresses
+# built-in addresses (resolved lazily, so importing sock2 does no lookups)
 #
-loopback = Address.from_addr("127.0.0.1")
-thishost = Address.from_name(_socket.gethostname())
-anyhost = Address.from_addr("0.0.0.0")
+def _thishost():
+    return Address.from_name(_socket.gethostname())
+
+loopback = LazyAddress(Address.from_addr, "127.0.0.1")
+thishost = LazyAddress(_thishost)
+anyhost = LazyAddress(Address.from_addr, "0.0.0.0")
 
 
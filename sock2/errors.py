@@ -28,6 +28,8 @@ class ConnectError(SocketError):
     pass
 class AlreadyConnectedError(ConnectError):
     pass
+class FramingError(SocketError):
+    pass
 
 class AddressError(IOError):
     pass
@@ -0,0 +1,262 @@
+"""
+Framing -- message framing codecs over ConnectedSocket
+
+Stream sockets deliver bytes, not messages, so message-oriented protocols
+need to frame their messages. this module provides the common framing
+schemes as codecs -- fixed-size length prefixes (2, 4 or 8 bytes, big or
+little endian), protobuf-style varint length prefixes, and delimiters --
+along with a FrameReader that decodes as many frames as are available out of
+a single large recv, and send_frames(), which sends many frames in a single
+vectored write.
+
+Notes:
+    * frames are returned as memoryviews into the reader's buffer (no copy);
+      they remain valid only until the next read, so copy them (tobytes())
+      if they need to outlive it
+    * every codec enforces a max frame size, so a corrupt or malicious 
+      length can't make the reader buffer without bound; violations raise 
+      FramingError
+"""
+import struct
+from errors import FramingError
+
+
+#
+# codecs
+#
+class LengthPrefixCodec(object):
+    """
+    frames are prefixed by their length, as a fixed-size unsigned integer.
+    
+    size - the size of the prefix, in bytes (1, 2, 4 or 8)
+    byteorder - "big" or "little"
+    max_frame_size - the max length of a frame
+    """
+    _formats = {1 : "B", 2 : "H", 4 : "I", 8 : "Q"}
+    
+    def __init__(self, size = 4, byteorder = "big", 
+            max_frame_size = 16 * 1024 * 1024):
+        if size not in self._formats:
+            raise ValueError("size must be one of 1, 2, 4 or 8", size)
+        if byteorder == "big":
+            prefix = ">"
+        elif byteorder == "little":
+            prefix = "<"
+        else:
+            raise ValueError("byteorder must be 'big' or 'little'", byteorder)
+        self._struct = struct.Struct(prefix + self._formats[size])
+        self.max_frame_size = min(max_frame_size, 2 ** (size * 8) - 1)
+    
+    def __repr__(self):
+        return "<%s(%r)>" % (self.__class__.__name__, self._struct.format)
+    
+    def encode(self, frame):
+        """returns the list of buffers that make up the encoded frame"""
+        if len(frame) > self.max_frame_size:
+            raise FramingError("frame too large", len(frame))
+        return [self._struct.pack(len(frame)), frame]
+    
+    def decode(self, buffer, start, end):
+        """looks for a frame in buffer[start:end]. returns a tuple of the
+        frame's (start, end, end-of-encoding) offsets, or None if the frame 
+        is incomplete"""
+        header_end = start + self._struct.size
+        if header_end > end:
+            return None
+        length, = self._struct.unpack_from(buffer, start)
+        if length > self.max_frame_size:
+            raise FramingError("frame too large", length)
+        frame_end = header_end + length
+        if frame_end > end:
+            return None
+        return header_end, frame_end, frame_end
+
+
+class VarintCodec(object):
+    """
+    frames are prefixed by their length, as a protobuf-style varint (7 bits
+    per byte, least significant group first, high bit set on all bytes but
+    the last).
+    
+    max_frame_size - the max length of a frame
+    """
+    def __init__(self, max_frame_size = 16 * 1024 * 1024):
+        self.max_frame_size = max_frame_size
+    
+    def __repr__(self):
+        return "<%s>" % (self.__class__.__name__,)
+    
+    def encode(self, frame):
+        """returns the list of buffers that make up the encoded frame"""
+        length = len(frame)
+        if length > self.max_frame_size:
+            raise FramingError("frame too large", length)
+        header = bytearray()
+        while length >= 0x80:
+            header.append((length & 0x7f) | 0x80)
+            length >>= 7
+        header.append(length)
+        return [header, frame]
+    
+    def decode(self, buffer, start, end):
+        """looks for a frame in buffer[start:end]. returns a tuple of the
+        frame's (start, end, end-of-encoding) offsets, or None if the frame 
+        is incomplete"""
+        length = 0
+        shift = 0
+        pos = start
+        while True:
+            if pos >= end:
+                return None
+            byte = buffer[pos]
+            pos += 1
+            length |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+            if shift >= 64:
+                raise FramingError("varint too long")
+        if length > self.max_frame_size:
+            raise FramingError("frame too large", length)
+        frame_end = pos + length
+        if frame_end > end:
+            return None
+        return pos, frame_end, frame_end
+
+
+class DelimiterCodec(object):
+    """
+    frames are terminated by a delimiter (which must not appear within the
+    frames themselves).
+    
+    delimiter - the delimiter string
+    max_frame_size - the max length of a frame
+    """
+    def __init__(self, delimiter = "\n", max_frame_size = 65536):
+        if not delimiter:
+            raise ValueError("empty delimiter")
+        self.delimiter = delimiter
+        self.max_frame_size = max_frame_size
+    
+    def __repr__(self):
+        return "<%s(%r)>" % (self.__class__.__name__, self.delimiter)
+    
+    def encode(self, frame):
+        """returns the list of buffers that make up the encoded frame"""
+        if len(frame) > self.max_frame_size:
+            raise FramingError("frame too large", len(frame))
+        return [frame, self.delimiter]
+    
+    def decode(self, buffer, start, end):
+        """looks for a frame in buffer[start:end]. returns a tuple of the
+        frame's (start, end, end-of-encoding) offsets, or None if the frame 
+        is incomplete"""
+        index = buffer.find(self.delimiter, start, end)
+        if index < 0:
+            if end - start > self.max_frame_size + len(self.delimiter):
+                raise FramingError("frame too large", end - start)
+            return None
+        if index - start > self.max_frame_size:
+            raise FramingError("frame too large", index - start)
+        return start, index, index + len(self.delimiter)
+
+
+#
+# reading and writing frames
+#
+class FrameReader(object):
+    """
+    reads frames off a ConnectedSocket, in batches.
+    
+    sock - the ConnectedSocket to read from
+    codec - the framing codec
+    buffer_size - the initial size of the receive buffer (it grows as 
+                  needed to hold a single frame, up to the codec's max)
+    """
+    def __init__(self, sock, codec, buffer_size = 65536):
+        self.sock = sock
+        self.codec = codec
+        self._buf = bytearray(buffer_size)
+        self._start = 0
+        self._end = 0
+    
+    def __repr__(self):
+        return "<%s(%r, %r)>" % (self.__class__.__name__, self.sock, 
+            self.codec)
+    
+    def _decode(self, max_frames):
+        frames = []
+        view = memoryview(self._buf)
+        while max_frames is None or len(frames) < max_frames:
+            result = self.codec.decode(self._buf, self._start, self._end)
+            if result is None:
+                break
+            frame_start, frame_end, self._start = result
+            frames.append(view[frame_start:frame_end])
+        return frames
+    
+    def _make_room(self):
+        if self._start == self._end:
+            self._start = self._end = 0
+        if self._end < len(self._buf):
+            return
+        remaining = self._end - self._start
+        if self._start > 0:
+            # move the partial frame to the front
+            self._buf[:remaining] = self._buf[self._start:self._end]
+        else:
+            # the partial frame fills the whole buffer. allocate a new one 
+            # (rather than resizing this one, which frames returned earlier
+            # may still be viewing)
+            newbuf = bytearray(len(self._buf) * 2)
+            newbuf[:remaining] = self._buf[self._start:self._end]
+            self._buf = newbuf
+        self._start = 0
+        self._end = remaining
+    
+    def read_frames(self, max_frames = None):
+        """returns a list of frames (memoryviews): those already buffered, 
+        or else, those decoded out of a single receive. returns an empty 
+        list if the operation timed out, and raises EOFError once the 
+        connection is closed"""
+        frames = self._decode(max_frames)
+        if frames:
+            return frames
+        self._make_room()
+        n = self.sock.recv_into(memoryview(self._buf)[self._end:])
+        if not n:
+            return frames
+        self._end += n
+        return self._decode(max_frames)
+    
+    def read_frame(self):
+        """returns a single frame (a memoryview), waiting for it to arrive
+        in full; returns None if the operation timed out"""
+        while True:
+            frames = self._decode(1)
+            if frames:
+                return frames[0]
+            self._make_room()
+            n = self.sock.recv_into(memoryview(self._buf)[self._end:])
+            if not n:
+                return None
+            self._end += n
+    
+    def __iter__(self):
+        """yields frames until the connection is closed"""
+        try:
+            while True:
+                for frame in self.read_frames():
+                    yield frame
+        except EOFError:
+            pass
+
+
+def send_frames(sock, frames, codec):
+    """encodes the given frames and sends them all over the ConnectedSocket 
+    in a single vectored write (see ConnectedSocket.sendv), without joining
+    them. returns the number of bytes sent"""
+    buffers = []
+    for frame in frames:
+        buffers.extend(codec.encode(frame))
+    return sock.sendv(buffers)
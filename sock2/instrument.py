@@ -0,0 +1,392 @@
+"""
+Instrument -- optional I/O counters and latency histograms for sock2 sockets
+
+Call enable() to start counting, per socket: the bytes and calls of sends and
+receives, timeouts, EOFs, partial sends, accepts, and errors (grouped by
+class of errno), as well as a latency histogram per operation. the registry
+aggregates them across all sockets, and exports a snapshot as a dict.
+
+nothing is checked on the I/O paths while instrumentation is disabled: enable()
+replaces the I/O methods of the socket classes with instrumented versions,
+and disable() puts the originals back, so the disabled cost is zero.
+
+Example:
+    instrument.enable()
+    ...
+    print instrument.registry.snapshot()["totals"]["bytes_received"]
+    print instrument.registry.get(sock).latency["recv"].percentile(0.99)
+
+Notes:
+    * the counters are updated without locking, so with many threads using
+      the *same* socket, they may undercount slightly (a lost increment when
+      two threads update the same counter at the same moment)
+    * the stats of a socket are kept while it's alive; once it's collected,
+      they're folded into the registry's totals
+    * latencies are bucketed by powers of two (of microseconds), so the
+      percentiles are upper bounds, accurate to a factor of two
+"""
+import time
+import array
+import errno
+import weakref
+import threading
+from errors import TimeoutError
+from socket import ConnectedSocket, DatagramSocket, ListenerSocket
+
+
+#
+# errno classes
+#
+_errno_classes = {}
+for _cls, _names in [
+        ("timeout", ("EAGAIN", "EWOULDBLOCK", "ETIMEDOUT")),
+        ("reset", ("ECONNRESET", "ECONNABORTED", "EPIPE", "ENOTCONN",
+            "ESHUTDOWN")),
+        ("refused", ("ECONNREFUSED",)),
+        ("unreachable", ("ENETUNREACH", "EHOSTUNREACH", "ENETDOWN",
+            "EHOSTDOWN", "EADDRNOTAVAIL")),
+        ("resources", ("ENOBUFS", "ENOMEM", "EMFILE", "ENFILE")),
+        ("interrupted", ("EINTR",)),
+        ("invalid", ("EBADF", "EINVAL", "ENOTSOCK", "EFAULT", "EMSGSIZE")),
+    ]:
+    for _name in _names:
+        if hasattr(errno, _name):
+            _errno_classes[getattr(errno, _name)] = _cls
+del _cls, _names, _name
+
+def errno_class(err):
+    """returns the class of the given errno: one of 'timeout', 'reset',
+    'refused', 'unreachable', 'resources', 'interrupted', 'invalid' or
+    'other'"""
+    return _errno_classes.get(err, "other")
+
+
+#
+# stats
+#
+class LatencyHistogram(object):
+    """a histogram of latencies, in power-of-two buckets of microseconds:
+    bucket i counts the latencies of [2**(i-1), 2**i) microseconds"""
+    __slots__ = ["buckets", "count", "total"]
+    BUCKETS = 32
+
+    def __init__(self):
+        self.buckets = array.array("L", [0] * self.BUCKETS)
+        self.count = 0
+        self.total = 0.0
+
+    def __repr__(self):
+        if not self.count:
+            return "<%s(empty)>" % (self.__class__.__name__,)
+        return "<%s(%d samples, p50 = %d us, p99 = %d us)>" % (
+            self.__class__.__name__, self.count, self.percentile(0.5),
+            self.percentile(0.99))
+
+    def record(self, seconds):
+        """records a latency, given in seconds"""
+        bucket = int(seconds * 1000000).bit_length()
+        if bucket >= self.BUCKETS:
+            bucket = self.BUCKETS - 1
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += seconds
+
+    def merge(self, other):
+        """adds the samples of another histogram to this one"""
+        for i, n in enumerate(other.buckets):
+            self.buckets[i] += n
+        self.count += other.count
+        self.total += other.total
+
+    def percentile(self, fraction):
+        """returns (an upper bound of) the given percentile (a fraction,
+        e.g., 0.99), in microseconds; 0 if there are no samples"""
+        rank = fraction * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return 1 << i
+        return 0
+
+    def mean(self):
+        """the mean latency, in microseconds"""
+        if not self.count:
+            return 0.0
+        return self.total / self.count * 1000000
+
+
+class SocketStats(object):
+    """the counters of a single socket (or the totals of many)"""
+    __slots__ = ["bytes_sent", "bytes_received", "sends", "recvs",
+        "accepts", "timeouts", "eofs", "partial_sends", "errors", "latency"]
+    counters = ("bytes_sent", "bytes_received", "sends", "recvs", "accepts",
+        "timeouts", "eofs", "partial_sends")
+
+    def __init__(self):
+        for name in self.counters:
+            setattr(self, name, 0)
+        # errno class -> count
+        self.errors = {}
+        # operation -> LatencyHistogram
+        self.latency = {}
+
+    def __repr__(self):
+        return "<%s(sent %d in %d, received %d in %d)>" % (
+            self.__class__.__name__, self.bytes_sent, self.sends,
+            self.bytes_received, self.recvs)
+
+    def merge(self, other):
+        """adds the counters of another SocketStats to this one"""
+        for name in self.counters:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for cls, count in other.errors.iteritems():
+            self.errors[cls] = self.errors.get(cls, 0) + count
+        for op, hist in other.latency.iteritems():
+            if op not in self.latency:
+                self.latency[op] = LatencyHistogram()
+            self.latency[op].merge(hist)
+
+    def as_dict(self):
+        """returns the counters (and the latency summaries) as a dict"""
+        info = dict((name, getattr(self, name)) for name in self.counters)
+        info["errors"] = dict(self.errors)
+        info["latency"] = dict((op, {
+                "count" : hist.count,
+                "mean_us" : hist.mean(),
+                "p50_us" : hist.percentile(0.5),
+                "p99_us" : hist.percentile(0.99),
+            }) for op, hist in self.latency.iteritems())
+        return info
+
+
+class Registry(object):
+    """keeps the stats of all the (instrumented) sockets"""
+    def __init__(self):
+        # id(sock) -> (weakref, SocketStats)
+        self._live = {}
+        self._retired = SocketStats()
+        # reentrant, as the weakref callbacks may run (on garbage collection)
+        # while the lock is held
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return "<%s(%d sockets)>" % (self.__class__.__name__, len(self._live))
+
+    def get(self, sock):
+        """returns the SocketStats of the given socket, or None if it has
+        none (yet)"""
+        entry = self._live.get(id(sock))
+        if entry is None or entry[0]() is not sock:
+            return None
+        return entry[1]
+
+    def stats_for(self, sock):
+        """returns the SocketStats of the given socket, creating them on
+        first use"""
+        entry = self._live.get(id(sock))
+        if entry is not None and entry[0]() is sock:
+            return entry[1]
+        key = id(sock)
+        stats = SocketStats()
+        ref = weakref.ref(sock, lambda ref: self._retire(key, ref))
+        with self._lock:
+            self._live[key] = (ref, stats)
+        return stats
+
+    def _retire(self, key, ref):
+        with self._lock:
+            entry = self._live.get(key)
+            if entry is not None and entry[0] is ref:
+                del self._live[key]
+                self._retired.merge(entry[1])
+
+    def totals(self):
+        """returns a SocketStats of the totals, across all the sockets (live
+        and collected)"""
+        with self._lock:
+            totals = SocketStats()
+            totals.merge(self._retired)
+            for ref, stats in self._live.values():
+                totals.merge(stats)
+        return totals
+
+    def snapshot(self):
+        """returns the totals, and the stats of each live socket, as a dict:
+        {"totals" : {...}, "sockets" : {id(sock) : {...}, ...}}. the reprs
+        of sockets needn't be unique (e.g., those of closed sockets), so 
+        each socket's stats include its repr, as "socket", for display"""
+        sockets = {}
+        with self._lock:
+            entries = self._live.items()
+        for key, (ref, stats) in entries:
+            sock = ref()
+            if sock is not None:
+                sockets[key] = info = stats.as_dict()
+                info["socket"] = repr(sock)
+        return {"totals" : self.totals().as_dict(), "sockets" : sockets}
+
+    def reset(self):
+        """discards all the stats"""
+        with self._lock:
+            self._live.clear()
+            self._retired = SocketStats()
+
+registry = Registry()
+
+
+#
+# instrumented methods
+#
+def _count_recv(stats, args, data):
+    stats.recvs += 1
+    if data:
+        stats.bytes_received += len(data)
+    else:
+        stats.timeouts += 1
+
+def _count_recv_into(stats, args, count):
+    stats.recvs += 1
+    if count:
+        stats.bytes_received += count
+    else:
+        stats.timeouts += 1
+
+def _count_recvfrom(stats, args, (data, addr)):
+    stats.recvs += 1
+    if addr is None:
+        stats.timeouts += 1
+    else:
+        stats.bytes_received += len(data)
+
+def _count_try_recv(stats, args, data):
+    stats.recvs += 1
+    if data is None:
+        stats.timeouts += 1
+    else:
+        stats.bytes_received += len(data)
+
+def _count_try_recvfrom(stats, args, result):
+    stats.recvs += 1
+    if result is None:
+        stats.timeouts += 1
+    else:
+        stats.bytes_received += len(result[0])
+
+def _count_recv_many(stats, args, batch):
+    stats.recvs += batch.count
+    if batch.count:
+        stats.bytes_received += sum(batch.lengths[:batch.count])
+    else:
+        stats.timeouts += 1
+
+def _count_send(stats, args, count):
+    stats.sends += 1
+    stats.bytes_sent += count
+    if count < len(memoryview(args[0])):
+        stats.partial_sends += 1
+
+def _count_sendall(stats, args, count):
+    stats.sends += 1
+    stats.bytes_sent += count
+
+def _count_send_many(stats, args, count):
+    stats.sends += count
+    stats.bytes_sent += sum(len(memoryview(data))
+        for data, addr in args[0][:count])
+
+def _count_accept(stats, args, conn):
+    stats.accepts += 1
+
+def _count_accept_many(stats, args, conns):
+    if conns:
+        stats.accepts += len(conns)
+    else:
+        stats.timeouts += 1
+
+_instrumented = [
+    (ConnectedSocket, "recv", "recv", _count_recv),
+    (ConnectedSocket, "recv_into", "recv", _count_recv_into),
+    (ConnectedSocket, "try_recv", "recv", _count_try_recv),
+    (ConnectedSocket, "send", "send", _count_send),
+    (ConnectedSocket, "sendall", "send", _count_sendall),
+    (ConnectedSocket, "sendv", "send", _count_sendall),
+    (DatagramSocket, "recv", "recv", _count_recvfrom),
+    (DatagramSocket, "try_recv", "recv", _count_try_recvfrom),
+    (DatagramSocket, "recv_many", "recv", _count_recv_many),
+    (DatagramSocket, "send", "send", _count_sendall),
+    (DatagramSocket, "sendv", "send", _count_sendall),
+    (DatagramSocket, "send_many", "send", _count_send_many),
+    (ListenerSocket, "accept", "accept", _count_accept),
+    (ListenerSocket, "accept_many", "accept", _count_accept_many),
+]
+
+# the ids of the sockets that the current thread is inside an instrumented
+# method of
+_in_progress = threading.local()
+
+def _instrument(func, op, count):
+    timer = time.time
+    def wrapper(self, *args, **kw):
+        stats = registry.stats_for(self)
+        try:
+            active = _in_progress.ids
+        except AttributeError:
+            active = _in_progress.ids = set()
+        key = id(self)
+        if key in active:
+            # called from within another instrumented method (e.g., sendv
+            # falling back to sendall), which will do the counting
+            return func(self, *args, **kw)
+        active.add(key)
+        t0 = timer()
+        try:
+            result = func(self, *args, **kw)
+        except TimeoutError:
+            stats.timeouts += 1
+            raise
+        except EOFError:
+            stats.eofs += 1
+            raise
+        except EnvironmentError, ex:
+            cls = errno_class(ex.errno)
+            stats.errors[cls] = stats.errors.get(cls, 0) + 1
+            raise
+        else:
+            count(stats, args, result)
+            return result
+        finally:
+            active.discard(key)
+            hist = stats.latency.get(op)
+            if hist is None:
+                hist = stats.latency[op] = LatencyHistogram()
+            hist.record(timer() - t0)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    wrapper._original = func
+    return wrapper
+
+_enabled = False
+
+def enable():
+    """installs the instrumented methods on the socket classes"""
+    global _enabled
+    if _enabled:
+        return
+    for cls, name, op, count in _instrumented:
+        setattr(cls, name, _instrument(cls.__dict__[name], op, count))
+    _enabled = True
+
+def disable():
+    """restores the original methods of the socket classes. the stats
+    collected so far are kept (see Registry.reset)"""
+    global _enabled
+    if not _enabled:
+        return
+    for cls, name, op, count in _instrumented:
+        setattr(cls, name, cls.__dict__[name]._original)
+    _enabled = False
+
+def is_enabled():
+    """indicates whether or not the instrumented methods are installed"""
+    return _enabled
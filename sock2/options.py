@@ -21,87 +21,97 @@ import struct
 import _socket
 import consts
 from errors import SocketOptionError
+from tcpinfo import TcpInfo, tcp_info_struct
 
 
 #
 # different option types
 #
-def option_error_decorator(func):
-    def wrapper(*a, **k):
-        try:
-            return func(*a, **k)
-        except _socket.error, (errno, info):
-            raise SocketOptionError(errno, info)
-    return wrapper
+class OptionProperty(property):
+    """
+    a property that gets/sets a socket option. besides the getter and the 
+    setter, it exposes the option's level and number, and the functions that
+    convert values to and from their raw form, so options can also be set 
+    in bulk (see OptionProfile).
+    
+    decode - converts the raw value returned by getsockopt to a python object
+    encode - converts a python object to a raw value for setsockopt
+    size - the buffer size to pass to getsockopt (None for int options)
+    """
+    def __init__(self, level, option, doc, decode, encode, size = None):
+        self.level = level
+        self.option = option
+        self.decode = decode
+        self.encode = encode
+        self.size = size
+        if size is None:
+            def getter(sock):
+                try:
+                    return decode(sock._sock.getsockopt(level, option))
+                except _socket.error, (errno, info):
+                    raise SocketOptionError(errno, info)
+        else:
+            def getter(sock):
+                try:
+                    return decode(sock._sock.getsockopt(level, option, size))
+                except _socket.error, (errno, info):
+                    raise SocketOptionError(errno, info)
+        def setter(sock, value):
+            try:
+                sock._sock.setsockopt(level, option, encode(value))
+            except _socket.error, (errno, info):
+                raise SocketOptionError(errno, info)
+        property.__init__(self, getter, setter, None, doc)
 
 def BoolOption(level, option, doc):
-    @option_error_decorator
-    def getter(self):
-        return bool(self._sock.getsockopt(level, option))
-    @option_error_decorator
-    def setter(self, value):
-        return self._sock.setsockopt(level, option, int(value))
-    return property(getter, setter, doc = doc)
+    return OptionProperty(level, option, doc, bool, int)
 
 def IntOption(level, option, doc):
-    @option_error_decorator
-    def getter(self):
-        return int(self._sock.getsockopt(level, option))
-    @option_error_decorator
-    def setter(self, value):
-        return self._sock.setsockopt(level, option, int(value))
-    return property(getter, setter, doc = doc)
+    return OptionProperty(level, option, doc, int, int)
 
-def LingerOption(level, option, doc):
-    if os.name == "nt":
-        format = "HH"
+if os.name == "nt":
+    _linger_struct = struct.Struct("HH")
+else:
+    _linger_struct = struct.Struct("ii")
+
+def _decode_linger(raw):
+    active, value = _linger_struct.unpack(raw)
+    if active:
+        return value
     else:
-        format = "ii"
-    size = struct.calcsize(format)
-
-    @option_error_decorator
-    def getter(self):
-        active, value = struct.unpack(format, self._sock.getsockopt(level,
-            option, size))
-        if active:
-            return value
-        else:
-            return None
-    @option_error_decorator
-    def setter(self, value):
-        if value is None:
-            active = 0
-            value = 0
-        else:
-            active = 1
-        return self._sock.setsockopt(level, option, struct.pack(format, active,
-            value))
-    return property(getter, setter, doc = doc)
-
-def _winsock_timeval_option(level, option, doc):
-    @option_error_decorator
-    def getter(self):
-        return self._sock.getsockopt(level, option) / 1000.0
-    @option_error_decorator
-    def setter(self, value):
-        self._sock.setsockopt(level, option, int(value * 1000))
-    return property(getter, setter, doc = doc)
+        return None
+
+def _encode_linger(value):
+    if value is None:
+        return _linger_struct.pack(0, 0)
+    else:
+        return _linger_struct.pack(1, value)
+
+def LingerOption(level, option, doc):
+    return OptionProperty(level, option, doc, _decode_linger, _encode_linger,
+        _linger_struct.size)
+
+def MillisecondsOption(level, option, doc):
+    return OptionProperty(level, option, doc, 
+        lambda raw: raw / 1000.0, 
+        lambda value: int(value * 1000))
+
+_winsock_timeval_option = MillisecondsOption
+
+_timeval_struct = struct.Struct("ll")
+
+def _decode_timeval(raw):
+    sec, usec = _timeval_struct.unpack(raw)
+    return sec + usec / 1e6
+
+def _encode_timeval(value):
+    sec = int(value)
+    usec = int((value - sec) * 1e6)
+    return _timeval_struct.pack(sec, usec)
 
 def _bsd_timeval_option(level, option, doc):
-    format = "ll"
-    size = struct.calcsize(format)
-    @option_error_decorator
-    def getter(self):
-        sec, usec = struct.unpack(format, self._sock.getsockopt(level, option,
-            size))
-        return sec + usec / 1e6
-    @option_error_decorator
-    def setter(self, value):
-        sec = int(value)
-        usec = int((value - sec) * 1e6)
-        return self._sock.setsockopt(level, option, struct.pack(format, sec,
-            usec))
-    return property(getter, setter, doc = doc)
+    return OptionProperty(level, option, doc, _decode_timeval, 
+        _encode_timeval, _timeval_struct.size)
 
 def TimevalOption(level, option, doc):
     if os.name == "nt":
@@ -109,58 +119,93 @@ def TimevalOption(level, option, doc):
     else:
         return _bsd_timeval_option(level, option, doc)
 
+_ipv4_mreq_struct = struct.Struct("4s4s")
+
+def _decode_ipv4_mreq(raw):
+    mcast, iface = _ipv4_mreq_struct.unpack(raw)
+    return _socket.inet_ntoa(mcast), _socket.inet_ntoa(iface)
+
+def _encode_ipv4_mreq((mcast, iface)):
+    return _ipv4_mreq_struct.pack(_socket.inet_aton(mcast),
+        _socket.inet_aton(iface))
+
 def Ipv4MreqOption(level, option, doc):
-    format = "4s4s"
-    size = struct.calcsize(format)
-    @option_error_decorator
-    def getter(self):
-        mcast, iface = struct.unpack(format, self._sock.getsockopt(level,
-            option, size))
-        return _socket.inet_ntoa(mcast), _socket.inet_ntoa(iface)
-    @option_error_decorator
-    def setter(self, (mcast, iface)):
-        raw = struct.pack(format, _socket.inet_aton(mcast),
-            _socket.inet_aton(iface))
-        self._sock.setsockopt(level, option, raw)
-    return property(getter, setter, doc = doc)
+    return OptionProperty(level, option, doc, _decode_ipv4_mreq, 
+        _encode_ipv4_mreq, _ipv4_mreq_struct.size)
+
+_ipv6_mreq_struct = struct.Struct("<16sI")
+
+def _decode_ipv6_mreq(raw):
+    mcast, iface = _ipv6_mreq_struct.unpack(raw)
+    return _socket.inet6_ntoa(mcast), iface
+
+def _encode_ipv6_mreq((mcast, iface)):
+    return _ipv6_mreq_struct.pack(_socket.inet6_aton(mcast), iface)
 
 def Ipv6MreqOption(level, option, doc):
-    format = "<16sI"
-    size = struct.calcsize(format)
-    @option_error_decorator
-    def getter(self):
-        mcast, iface = struct.unpack(format, self._sock.getsockopt(level,
-            option, size))
-        return _socket.inet6_ntoa(mcast), iface
-    @option_error_decorator
-    def setter(self, (mcast, iface)):
-        raw = struct.pack(format, _socket.inet6_aton(mcast), iface)
-        self._sock.setsockopt(level, option, raw)
-    return property(getter, setter, doc = doc)
+    return OptionProperty(level, option, doc, _decode_ipv6_mreq, 
+        _encode_ipv6_mreq, _ipv6_mreq_struct.size)
+
+_sockaddr_in6_struct = struct.Struct("<BBHL16s")
+
+def _decode_sockaddr_in6(raw):
+    len, fam, port, flow, addr = _sockaddr_in6_struct.unpack(raw)
+    return port, flow, _socket.inet6_ntoa(addr)
+
+def _encode_sockaddr_in6((port, flow, addr)):
+    return _sockaddr_in6_struct.pack(_sockaddr_in6_struct.size, 
+        consts.AddressFamily.IPv6, port, flow, _socket.inet6_aton(addr))
 
 def SockaddrIn6Option(level, option, doc):
-    format = "<BBHL16s"
-    size = struct.calcsize(format)
-    @option_error_decorator
-    def getter(self):
-        len, fam, port, flow, addr = struct.unpack(format,
-            self._sock.getsockopt(level, option, size))
-        return port, flow, _socket.inet6_ntoa(addr)
-    @option_error_decorator
-    def setter(self, (port, flow, addr)):
-        raw = struct.pack(format, size, consts.AddressFamily.IPv6, port, flow,
-            _socket.inet6_aton(mcast))
-        self._sock.setsockopt(level, option, raw)
-    return property(getter, setter, doc = doc)
+    return OptionProperty(level, option, doc, _decode_sockaddr_in6, 
+        _encode_sockaddr_in6, _sockaddr_in6_struct.size)
+
+def _read_only(value):
+    raise AttributeError("this option is read-only")
+
+def TcpInfoOption(level, option, doc):
+    return OptionProperty(level, option, doc, TcpInfo, _read_only,
+        tcp_info_struct.size)
+
+def _identity(value):
+    return value
+
+def _decode_string(raw):
+    return raw.split("\x00", 1)[0]
+
+def StringOption(level, option, doc):
+    return OptionProperty(level, option, doc, _decode_string, str, 64)
+
+# a rate of ~0 means unlimited; newer kernels (4.20 and on) also take (and 
+# return) the rate as a 64-bit value, so rates beyond 4GB/sec can be set
+_u32_struct = struct.Struct("=I")
+_u64_struct = struct.Struct("=Q")
+
+def _decode_rate(raw):
+    if len(raw) >= _u64_struct.size:
+        rate, = _u64_struct.unpack_from(raw)
+        unlimited = (1 << 64) - 1
+    else:
+        rate, = _u32_struct.unpack_from(raw)
+        unlimited = (1 << 32) - 1
+    if rate == unlimited:
+        return None
+    return rate
+
+def _encode_rate(value):
+    if value is None:
+        return _u32_struct.pack((1 << 32) - 1)
+    elif value >= (1 << 32) - 1:
+        return _u64_struct.pack(value)
+    else:
+        return _u32_struct.pack(value)
+
+def RateOption(level, option, doc):
+    return OptionProperty(level, option, doc, _decode_rate, _encode_rate,
+        _u64_struct.size)
 
 def RawOption(level, option, doc):
-    @option_error_decorator
-    def getter(self):
-        return self._sock.getsockopt(level, option, 1024)
-    @option_error_decorator
-    def setter(self, value):
-        self._sock.setsockopt(level, option, value)
-    return property(getter, setter, doc = doc)
+    return OptionProperty(level, option, doc, _identity, _identity, 1024)
 
 
 #
@@ -246,8 +291,14 @@ tcp_level_options = (
     ("DEFER_ACCEPT",           "defer_accept",         IntOption,      "timeout for connect(), in seconds (int)"),
     ("LINGER2",                "fin_wait_timeout",     IntOption,      "timeout for FIN_WAIT2 (int)"),
     ("WINDOW_CLAMP",           "window_size",          IntOption,      "max TCP-window size (int)"),
+    ("NOTSENT_LOWAT",          "notsent_low_water",    IntOption,      "max unsent bytes in the send queue, above which the socket isn't writable; keeps queued data (and latency) low (int)"),
+    ("FASTOPEN",               "fast_open",            IntOption,      "the queue length of TCP fast open (RFC 7413) requests on a listener; 0 disables it (int)"),
+
+    ("USER_TIMEOUT",           "user_timeout",         MillisecondsOption, "max time that sent data may remain unacknowledged before the connection is dropped, in seconds; 0 for the system default (float)"),
+    ("CONGESTION",             "congestion_control",   StringOption,   "the congestion control algorithm (e.g., 'cubic', 'bbr'); linux and freebsd (str)"),
 
     ("INFO",                   "_tcp_info",            RawOption,      "obtain TCP metrics for this socket; linux specific (raw)"),
+    ("INFO",                   "tcp_info",             TcpInfoOption,  "TCP metrics for this socket (rtt, snd_cwnd, retransmits, etc.); linux specific (TcpInfo)"),
 )
 
 socket_level_options = (
@@ -257,6 +308,7 @@ socket_level_options = (
     ("EXCLUSIVEADDRUSE",   "exclusive_address",        BoolOption,     "don't allow rebinding the address (bool)"),
     ("KEEPALIVE",          "use_keepalives",           BoolOption,     "use keepalives (idle-time and interval are TCP-specific) (bool)"),
     ("DONTROUTE",          "dont_route",               BoolOption,     "disable routing (bool)"),
+    ("ZEROCOPY",           "zero_copy",                BoolOption,     "allow MSG_ZEROCOPY sends (see zerocopy.ZeroCopySender), linux specific (bool)"),
     ("BROADCAST",          "allow_broadcast",          BoolOption,     "allow broadcasts from this socket (bool)"),
     ("USELOOPBACK",        "use_loopback",             BoolOption,     "use the loopback device (bool)"),
     ("OOBINLINE",          "oob_inline",               BoolOption,     "keep out-of-band (urgent) data in-line (bool)"),
@@ -266,6 +318,10 @@ socket_level_options = (
     ("RCVBUF",             "recv_buffer_size",         IntOption,      "recv buffer size (int)"),
     ("SNDLOWAT",           "min_send_size",            IntOption,      "minimun size for send()ing (int)"),
     ("RCVLOWAT",           "min_recv_size",            IntOption,      "minimum size for recv()ing (int)"),
+    ("SNDBUFFORCE",        "force_send_buffer_size",   IntOption,      "send buffer size, beyond the system limit; requires CAP_NET_ADMIN, linux specific (int; write only)"),
+    ("RCVBUFFORCE",        "force_recv_buffer_size",   IntOption,      "recv buffer size, beyond the system limit; requires CAP_NET_ADMIN, linux specific (int; write only)"),
+    ("BUSY_POLL",          "busy_poll",                IntOption,      "time to busy-poll the device for packets when blocking on receive, in microseconds; raising it requires CAP_NET_ADMIN, linux specific (int)"),
+    ("INCOMING_CPU",       "incoming_cpu",             IntOption,      "the cpu that handles the socket's incoming packets (or -1), linux specific (int)"),
     ("ERROR",              "error_state",              IntOption,      "gets the error code of the socket (int)"),
     ("TYPE",               "socket_type",              IntOption,      "gets the type of the socket (one of consts.SocketType.xxx) (int)"),
 
@@ -273,6 +329,8 @@ socket_level_options = (
     ("RCVTIMEO",           "recv_timeout",             TimevalOption,  "recv timeout in seconds (float)"),
 
     ("LINGER",             "linger",                   LingerOption,   "linger-after-close timeout in seconds (int or None)"),
+
+    ("MAX_PACING_RATE",    "max_pacing_rate",          RateOption,     "max sending rate in bytes per second, None for unlimited; linux specific (int or None)"),
 )
 
 
@@ -337,3 +395,93 @@ class TcpLevelMixin(object):
 
 
 
+
+
+#
+# option profiles
+#
+_option_names = frozenset(propname for table in (socket_level_options,
+    ip_level_options, ipv6_level_options, tcp_level_options)
+    for optname, propname, proptype, doc in table)
+
+class OptionProfile(object):
+    """
+    a named set of socket options, applied to a socket in a single call:
+    
+        profile = OptionProfile("rpc", no_delay = True, use_keepalives = True,
+            keepalives_idle = 60, send_buffer_size = 262144)
+        profile.apply(sock)
+    
+    options are given by their pythonic (property) names. for each socket 
+    class, the profile is compiled once into a list of (level, option, raw 
+    value) tuples, so applying it costs no more than the setsockopt calls
+    themselves. options that the socket class doesn't support (e.g., TCP 
+    options on a UDP socket, or options missing on this platform) are 
+    skipped. a profile can also be attached to a TcpListenerSocket, as its
+    accept_profile, to be applied to every accepted socket.
+    """
+    __slots__ = ["name", "options", "_compiled"]
+    
+    def __init__(self, name, **options):
+        unknown = set(options) - _option_names
+        if unknown:
+            raise ValueError("unknown options", sorted(unknown))
+        self.name = name
+        self.options = options
+        self._compiled = {}
+    
+    def __repr__(self):
+        return "<%s(%r)>" % (self.__class__.__name__, self.name)
+    
+    def derive(self, name, **options):
+        """returns a new profile, with the given options added to (or 
+        overriding) those of this profile"""
+        combined = dict(self.options)
+        combined.update(options)
+        return self.__class__(name, **combined)
+    
+    def compile(self, cls):
+        """returns the list of (level, option, raw value) tuples of this 
+        profile, for sockets of the given class"""
+        try:
+            return self._compiled[cls]
+        except KeyError:
+            pass
+        compiled = []
+        for name, value in sorted(self.options.items()):
+            prop = getattr(cls, name, None)
+            if isinstance(prop, OptionProperty):
+                compiled.append((prop.level, prop.option, prop.encode(value)))
+        self._compiled[cls] = compiled
+        return compiled
+    
+    def apply(self, sock):
+        """sets all of the profile's options on the given socket"""
+        setsockopt = sock._sock.setsockopt
+        for level, option, value in self.compile(sock.__class__):
+            try:
+                setsockopt(level, option, value)
+            except _socket.error, (errno, info):
+                raise SocketOptionError(errno, info)
+        return sock
+
+
+#
+# presets
+#
+# for request/response traffic: small writes go out at once (no Nagle), and
+# the send queue is kept short, so that new data doesn't queue up behind old.
+# busy_poll would shave off more, but raising it takes CAP_NET_ADMIN; use
+# low_latency_profile.derive("busy", busy_poll = 50). quickack isn't part of
+# the profile, as the kernel clears it again after the next ack: to avoid
+# delayed acks, set it after each recv
+low_latency_profile = OptionProfile("low_latency", no_delay = True,
+    notsent_low_water = 16384)
+
+# for moving a lot of data: full-sized segments (Nagle is left on). the
+# buffer sizes are left alone on purpose: setting them disables the kernel's
+# buffer autotuning, and they're capped by net.core.wmem_max/rmem_max (only
+# 208KB by default), way below what autotuning reaches. to pin them anyway,
+# derive a profile with send_buffer_size/recv_buffer_size (or the force_
+# variants, which aren't capped, with CAP_NET_ADMIN)
+bulk_throughput_profile = OptionProfile("bulk_throughput", no_delay = False)
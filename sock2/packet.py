@@ -0,0 +1,220 @@
+"""
+Packet -- memory-mapped receive rings for AF_PACKET sockets (linux specific)
+
+Receiving packets with one recv per packet caps a capture at the rate of
+system calls. with a TPACKET_V3 ring (PACKET_RX_RING), the kernel writes
+the packets into memory shared with the process, a block of many packets at
+a time, and hands each block over once it fills up (or once it has been
+open for `retire_timeout` milliseconds); the process reads the packets in
+place, as memoryviews, and hands the block back. the only system call is a
+poll, when no block is ready.
+
+Example:
+    sock = PacketSocket("eth0")
+    ring = sock.rx_ring()
+    while True:
+        with ring.next_block() as block:
+            for frame in block:
+                process(frame)
+
+Notes:
+    * the memoryviews point into the ring itself: they're only valid until
+      the block is released (copy what you need to keep, e.g., with
+      tobytes()), and must not be used once the ring is closed
+    * blocks must be released in order, as the kernel fills them in order
+"""
+import time
+import mmap
+import errno
+import ctypes
+import struct
+import select
+import _socket
+from errors import SocketError
+
+
+# linux/if_packet.h, linux/if_ether.h
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+ETH_P_ALL = 3
+ETH_P_IP = 0x0800
+
+# struct tpacket_req3
+tpacket_req3 = struct.Struct("=7I")
+# struct tpacket_block_desc, up to hdr.bh1.blk_len: version, offset_to_priv,
+# block_status, num_pkts, offset_to_first_pkt, blk_len
+_block_desc = struct.Struct("=6I")
+_BLOCK_STATUS_OFFSET = 8
+_block_status = struct.Struct("=I")
+# struct tpacket3_hdr, up to tp_net: tp_next_offset, tp_sec, tp_nsec,
+# tp_snaplen, tp_len, tp_status, tp_mac, tp_net
+_frame_header = struct.Struct("=6I2H")
+# struct tpacket_stats_v3: tp_packets, tp_drops, tp_freeze_q_cnt
+_stats_v3 = struct.Struct("=3I")
+
+
+class PacketBlock(object):
+    """
+    a block of packets, handed over by the kernel. iterating over it yields
+    the packets' data, as memoryviews into the ring; see packets() for their
+    metadata. release() the block (or use it as a context manager) to hand
+    it back to the kernel.
+    """
+    __slots__ = ["ring", "offset", "count", "_first", "_released"]
+
+    def __init__(self, ring, offset, count, first):
+        self.ring = ring
+        self.offset = offset
+        self.count = count
+        self._first = first
+        self._released = False
+
+    def __repr__(self):
+        return "<%s(%d packets)>" % (self.__class__.__name__, self.count)
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, v, tb):
+        self.release()
+
+    def packets(self):
+        """yields a tuple of (timestamp, wire length, data) for each packet,
+        where the timestamp is in seconds since the epoch (float), and the
+        data is a memoryview, which may be shorter than the wire length if
+        the packet was truncated"""
+        view = self.ring._view
+        mapping = self.ring._map
+        offset = self.offset + self._first
+        for i in xrange(self.count):
+            (next_offset, sec, nsec, snaplen, length, status, mac,
+                net) = _frame_header.unpack_from(mapping, offset)
+            start = offset + mac
+            yield sec + nsec * 1e-9, length, view[start:start + snaplen]
+            offset += next_offset
+
+    def __iter__(self):
+        for timestamp, length, data in self.packets():
+            yield data
+
+    def release(self):
+        """hands the block back to the kernel, and moves the ring on to the
+        next one. the block's memoryviews are no longer valid afterwards"""
+        if self._released:
+            return
+        self._released = True
+        _block_status.pack_into(self.ring._map,
+            self.offset + _BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+        self.ring._advance()
+
+
+class PacketRing(object):
+    """
+    a TPACKET_V3 receive ring over an AF_PACKET socket (see
+    PacketSocket.rx_ring).
+
+    block_size - the size of each block (a multiple of the page size)
+    block_count - the number of blocks in the ring
+    frame_size - the max size of a packet's slot (larger packets are
+                 truncated)
+    retire_timeout - the time (in milliseconds) after which the kernel hands
+                     over a block that isn't full
+    """
+    def __init__(self, sock, block_size = 1 << 22, block_count = 64,
+            frame_size = 2048, retire_timeout = 60):
+        self.sock = sock
+        self.block_size = block_size
+        self.block_count = block_count
+        self._current = 0
+        raw = sock._sock
+        try:
+            raw.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            raw.setsockopt(SOL_PACKET, PACKET_RX_RING, tpacket_req3.pack(
+                block_size, block_count, frame_size,
+                block_size * block_count // frame_size, retire_timeout,
+                0, 0))
+        except _socket.error, (err, info):
+            raise SocketError(err, info)
+        size = block_size * block_count
+        self._map = mmap.mmap(raw.fileno(), size, mmap.MAP_SHARED,
+            mmap.PROT_READ | mmap.PROT_WRITE)
+        self._view = memoryview((ctypes.c_char * size).from_buffer(self._map))
+        self._poller = select.poll()
+        self._poller.register(raw.fileno(), select.POLLIN | select.POLLERR)
+
+    def __repr__(self):
+        return "<%s(%d blocks of %d bytes)>" % (self.__class__.__name__,
+            self.block_count, self.block_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, v, tb):
+        self.close()
+
+    def close(self):
+        """unmaps the ring. no memoryview obtained from it may be used
+        afterwards"""
+        if self._map is not None:
+            self._view = None
+            self._map.close()
+            self._map = None
+
+    def _advance(self):
+        self._current = (self._current + 1) % self.block_count
+
+    def _ready(self, offset):
+        status, = _block_status.unpack_from(self._map,
+            offset + _BLOCK_STATUS_OFFSET)
+        return status & TP_STATUS_USER
+
+    def next_block(self, timeout = None):
+        """returns the next PacketBlock, waiting up to `timeout` seconds
+        (None means forever) for the kernel to hand it over. returns None if
+        the operation timed out. the previous block must have been released
+        first"""
+        offset = self._current * self.block_size
+        if not self._ready(offset):
+            deadline = None if timeout is None else time.time() + timeout
+            while not self._ready(offset):
+                if deadline is None:
+                    wait = -1
+                else:
+                    wait = (deadline - time.time()) * 1000
+                    if wait <= 0:
+                        return None
+                try:
+                    self._poller.poll(wait)
+                except select.error, ex:
+                    if ex.args[0] != errno.EINTR:
+                        raise
+        (version, offset_to_priv, status, count, first,
+            length) = _block_desc.unpack_from(self._map, offset)
+        return PacketBlock(self, offset, count, first)
+
+    def __iter__(self):
+        """yields the packets' data (as memoryviews) forever. each block is
+        released once all of its packets have been yielded"""
+        while True:
+            with self.next_block() as block:
+                for data in block:
+                    yield data
+
+    def stats(self):
+        """returns the socket's packet statistics since the last call, as a
+        tuple of (packets received, packets dropped, times the queue was
+        frozen)"""
+        try:
+            raw = self.sock._sock.getsockopt(SOL_PACKET, PACKET_STATISTICS,
+                _stats_v3.size)
+        except _socket.error, (err, info):
+            raise SocketError(err, info)
+        return _stats_v3.unpack(raw)
@@ -0,0 +1,225 @@
+"""
+Pool -- a client connection pool for TcpConnectedSockets
+
+Opening a new connection per request pays for name resolution, the TCP
+handshake and option setup every single time. a ConnectionPool keeps the
+connections to each endpoint around once they're checked in, and hands them
+out again (most recently used first, as those are the least likely to have
+been dropped by the peer), after a cheap liveness check.
+
+Example:
+    pool = ConnectionPool(max_per_host = 4, idle_timeout = 30)
+    with pool.connection("backend", 8080) as sock:
+        sock.sendall(request)
+        ...
+"""
+import time
+import threading
+from contextlib import contextmanager
+from errors import TimeoutError, SocketClosed
+from socket import TcpConnectedSocket, _poll
+from dns import canonize_ipaddr
+
+
+class _HostEntry(object):
+    __slots__ = ["idle", "count"]
+    def __init__(self):
+        # (sock, time-of-checkin) tuples; the most recent is last
+        self.idle = []
+        # the number of connections, idle and checked-out
+        self.count = 0
+
+
+class ConnectionPool(object):
+    """
+    a thread-safe pool of TcpConnectedSockets, keyed by (host, port).
+
+    max_per_host - the max number of connections (idle and checked out) to
+                   each endpoint; checkout() waits for one to be checked in
+                   once the limit is reached
+    idle_timeout - idle connections older than this (in seconds) are closed
+                   rather than reused
+    timeout - the timeout of new connections (for connecting, and for the
+              socket's operations thereafter)
+    profile - an OptionProfile to apply to new connections (before they
+              connect, so buffer sizes take effect on the handshake)
+    resolver - a dns.ResolverCache to resolve host names through
+    """
+    def __init__(self, max_per_host = 8, idle_timeout = 60, timeout = None,
+            profile = None, resolver = None):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.profile = profile
+        self.resolver = resolver
+        self._hosts = {}
+        self._checked_out = {}
+        self._closed = False
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._stats = dict(checkouts = 0, created = 0, reused = 0,
+            expired = 0, dead = 0, discarded = 0)
+
+    def __repr__(self):
+        return "<%s(%d endpoints, %d checked out)>" % (
+            self.__class__.__name__, len(self._hosts),
+            len(self._checked_out))
+
+    def stats(self):
+        """returns a snapshot of the pool's statistics, as a dict: the number
+        of checkouts, of connections created and reused, of idle connections
+        dropped for being expired or dead, and of connections discarded on
+        checkin; as well as the current number of idle and checked-out
+        connections"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["idle"] = sum(len(entry.idle)
+                for entry in self._hosts.itervalues())
+            stats["checked_out"] = len(self._checked_out)
+        return stats
+
+    def _is_alive(self, sock):
+        # an idle connection should have nothing to read: if it's readable,
+        # the peer has either closed it or sent something unsolicited, and
+        # either way it can't be reused
+        try:
+            return not _poll(sock.fileno(), False, 0)
+        except IOError:
+            return False
+
+    def checkout(self, host, port, timeout = None):
+        """returns a connection to the given endpoint: an idle one if there
+        is one (and it's alive), or else a new one. if the endpoint already
+        has max_per_host connections, waits up to `timeout` seconds (None
+        means forever) for one to be checked in, and then raises
+        TimeoutError. raises SocketClosed once the pool is closed"""
+        key = (host, port)
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            self._stats["checkouts"] += 1
+            entry = self._hosts.get(key)
+            if entry is None:
+                entry = self._hosts[key] = _HostEntry()
+            while True:
+                if self._closed:
+                    raise SocketClosed("the pool is closed")
+                now = time.time()
+                while entry.idle:
+                    sock, checked_in = entry.idle.pop()
+                    if now - checked_in > self.idle_timeout:
+                        self._stats["expired"] += 1
+                    elif not self._is_alive(sock):
+                        self._stats["dead"] += 1
+                    else:
+                        self._stats["reused"] += 1
+                        self._checked_out[sock] = key
+                        return sock
+                    entry.count -= 1
+                    sock.close()
+                if entry.count < self.max_per_host:
+                    entry.count += 1
+                    break
+                if deadline is None:
+                    self._available.wait()
+                else:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise TimeoutError()
+                    self._available.wait(remaining)
+
+        # connect outside of the lock
+        try:
+            sock = self._connect(host, port)
+        except:
+            with self._lock:
+                entry.count -= 1
+                self._available.notify_all()
+            raise
+        with self._lock:
+            if self._closed:
+                entry.count -= 1
+                sock.close()
+                raise SocketClosed("the pool is closed")
+            self._stats["created"] += 1
+            self._checked_out[sock] = key
+        return sock
+
+    def _connect(self, host, port):
+        if self.resolver is not None:
+            try:
+                canonize_ipaddr(host)
+            except ValueError:
+                host = self.resolver.from_name(host).addr
+        sock = TcpConnectedSocket()
+        try:
+            if self.profile is not None:
+                self.profile.apply(sock)
+            sock.timeout = self.timeout
+            sock.connect((host, port))
+        except:
+            sock.close()
+            raise
+        return sock
+
+    def checkin(self, sock, reuse = True):
+        """returns a connection obtained from checkout() to the pool. pass
+        reuse = False (e.g., after an error, or if the protocol state is
+        unknown) to have it closed instead"""
+        with self._lock:
+            key = self._checked_out.pop(sock)
+            entry = self._hosts[key]
+            if reuse and not sock.closed and not self._closed:
+                entry.idle.append((sock, time.time()))
+            else:
+                self._stats["discarded"] += 1
+                entry.count -= 1
+                sock.close()
+            self._available.notify_all()
+
+    @contextmanager
+    def connection(self, host, port, timeout = None):
+        """a context manager that checks out a connection, and checks it
+        back in when the block ends -- or discards it, if the block raised
+        an exception"""
+        sock = self.checkout(host, port, timeout)
+        try:
+            yield sock
+        except:
+            self.checkin(sock, False)
+            raise
+        else:
+            self.checkin(sock)
+
+    def evict_idle(self):
+        """closes the idle connections that have expired (this also happens
+        lazily, on checkout); returns the number of connections closed"""
+        evicted = 0
+        with self._lock:
+            now = time.time()
+            for entry in self._hosts.itervalues():
+                keep = []
+                for sock, checked_in in entry.idle:
+                    if now - checked_in > self.idle_timeout:
+                        sock.close()
+                        entry.count -= 1
+                        evicted += 1
+                    else:
+                        keep.append((sock, checked_in))
+                entry.idle[:] = keep
+            self._stats["expired"] += evicted
+            if evicted:
+                self._available.notify_all()
+        return evicted
+
+    def close(self):
+        """closes all the idle connections. connections that are checked out
+        are closed when they're checked in, and checkouts raise SocketClosed
+        from now on (including the ones waiting)"""
+        with self._lock:
+            self._closed = True
+            for entry in self._hosts.itervalues():
+                for sock, checked_in in entry.idle:
+                    sock.close()
+                    entry.count -= 1
+                del entry.idle[:]
+            self._available.notify_all()
@@ -0,0 +1,374 @@
+"""
+Reactor -- a readiness-based event loop over sock2 sockets
+
+Instead of blocking on each socket in turn (or having every user write a
+select loop of their own over fileno()), register sockets with a Reactor,
+along with callbacks for read- and write-readiness, and let it dispatch them
+from a single thread. the reactor uses the best mechanism the platform offers:
+epoll, falling back to poll and then to select.
+
+Notes:
+    * callbacks are invoked with the socket as the only argument
+    * sockets should be non-blocking (sock.timeout = 0), so a callback never
+      blocks the loop. with timeouts, the sock2 rules still hold: recv
+      returns an empty string when there's no data, and raises EOFError
+      when the peer has closed the connection
+    * edge-triggered mode is only supported by epoll; the other pollers
+      treat it as level-triggered, which is less efficient but still correct
+"""
+import time
+import heapq
+import errno
+import select
+from errors import TimeoutError
+
+
+READ = 1
+WRITE = 2
+
+
+#
+# pollers
+#
+class EpollPoller(object):
+    """epoll-based poller (linux)"""
+    __slots__ = ["_epoll"]
+
+    def __init__(self):
+        self._epoll = select.epoll()
+
+    def _mask(self, events, edge_triggered):
+        mask = 0
+        if events & READ:
+            mask |= select.EPOLLIN
+        if events & WRITE:
+            mask |= select.EPOLLOUT
+        if edge_triggered:
+            mask |= select.EPOLLET
+        return mask
+
+    def register(self, fd, events, edge_triggered):
+        self._epoll.register(fd, self._mask(events, edge_triggered))
+
+    def modify(self, fd, events, edge_triggered):
+        self._epoll.modify(fd, self._mask(events, edge_triggered))
+
+    def unregister(self, fd):
+        self._epoll.unregister(fd)
+
+    def poll(self, timeout):
+        if timeout is None:
+            timeout = -1
+        ready = []
+        for fd, mask in self._epoll.poll(timeout):
+            events = 0
+            if mask & (select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR):
+                events |= READ
+            if mask & (select.EPOLLOUT | select.EPOLLHUP | select.EPOLLERR):
+                events |= WRITE
+            ready.append((fd, events))
+        return ready
+
+    def close(self):
+        self._epoll.close()
+
+
+class PollPoller(object):
+    """poll-based poller (most unices)"""
+    __slots__ = ["_poll"]
+
+    def __init__(self):
+        self._poll = select.poll()
+
+    def _mask(self, events):
+        mask = 0
+        if events & READ:
+            mask |= select.POLLIN
+        if events & WRITE:
+            mask |= select.POLLOUT
+        return mask
+
+    def register(self, fd, events, edge_triggered):
+        self._poll.register(fd, self._mask(events))
+
+    def modify(self, fd, events, edge_triggered):
+        self._poll.modify(fd, self._mask(events))
+
+    def unregister(self, fd):
+        self._poll.unregister(fd)
+
+    def poll(self, timeout):
+        if timeout is not None:
+            timeout *= 1000
+        ready = []
+        for fd, mask in self._poll.poll(timeout):
+            events = 0
+            if mask & (select.POLLIN | select.POLLHUP | select.POLLERR):
+                events |= READ
+            if mask & (select.POLLOUT | select.POLLHUP | select.POLLERR):
+                events |= WRITE
+            ready.append((fd, events))
+        return ready
+
+    def close(self):
+        pass
+
+
+class SelectPoller(object):
+    """select-based poller (everywhere else)"""
+    __slots__ = ["_readers", "_writers"]
+
+    def __init__(self):
+        self._readers = set()
+        self._writers = set()
+
+    def register(self, fd, events, edge_triggered):
+        if events & READ:
+            self._readers.add(fd)
+        if events & WRITE:
+            self._writers.add(fd)
+
+    def modify(self, fd, events, edge_triggered):
+        self.unregister(fd)
+        self.register(fd, events, edge_triggered)
+
+    def unregister(self, fd):
+        self._readers.discard(fd)
+        self._writers.discard(fd)
+
+    def poll(self, timeout):
+        if not self._readers and not self._writers:
+            # select() with empty sets is an error on some platforms
+            if timeout:
+                time.sleep(timeout)
+            return []
+        rlist, wlist, xlist = select.select(self._readers, self._writers,
+            self._readers | self._writers, timeout)
+        ready = {}
+        for fd in rlist:
+            ready[fd] = READ
+        for fd in wlist:
+            ready[fd] = ready.get(fd, 0) | WRITE
+        for fd in xlist:
+            ready[fd] = READ | WRITE
+        return ready.items()
+
+    def close(self):
+        pass
+
+
+def best_poller():
+    """returns an instance of the best poller available on this platform"""
+    if hasattr(select, "epoll"):
+        return EpollPoller()
+    elif hasattr(select, "poll"):
+        return PollPoller()
+    else:
+        return SelectPoller()
+
+
+#
+# the reactor
+#
+class Timer(object):
+    """a scheduled call, as returned by Reactor.call_later and call_at"""
+    __slots__ = ["when", "callback", "args", "cancelled"]
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __repr__(self):
+        return "<%s(%r at %.3f)>" % (self.__class__.__name__, self.callback,
+            self.when)
+
+    def cancel(self):
+        """cancels the call (has no effect if it already took place)"""
+        self.cancelled = True
+
+
+class _Handler(object):
+    __slots__ = ["sock", "on_read", "on_write", "edge_triggered"]
+
+    def __init__(self, sock, on_read, on_write, edge_triggered):
+        self.sock = sock
+        self.on_read = on_read
+        self.on_write = on_write
+        self.edge_triggered = edge_triggered
+
+    def events(self):
+        events = 0
+        if self.on_read is not None:
+            events |= READ
+        if self.on_write is not None:
+            events |= WRITE
+        return events
+
+
+class Reactor(object):
+    """
+    a single-threaded event loop, dispatching socket readiness and timers.
+
+    poller - the polling mechanism to use (default: best_poller())
+    """
+    def __init__(self, poller = None):
+        if poller is None:
+            poller = best_poller()
+        self._poller = poller
+        self._handlers = {}
+        self._timers = []
+        self._timer_seq = 0
+        self._running = False
+
+    def __repr__(self):
+        return "<%s(%s, %d sockets)>" % (self.__class__.__name__,
+            self._poller.__class__.__name__, len(self._handlers))
+
+    def __len__(self):
+        """the number of registered sockets"""
+        return len(self._handlers)
+
+    def close(self):
+        """closes the reactor (but not the sockets registered with it)"""
+        self._handlers.clear()
+        del self._timers[:]
+        self._poller.close()
+
+    #
+    # sockets
+    #
+    def register(self, sock, on_read = None, on_write = None,
+            edge_triggered = False):
+        """
+        registers the given socket (or replaces its existing registration).
+        on_read is called when the socket becomes readable, on_write when it
+        becomes writable; pass None to ignore either. in edge-triggered mode,
+        callbacks are invoked only when the readiness changes, so they must
+        drain the socket (until recv returns an empty string)
+        """
+        fd = sock.fileno()
+        handler = _Handler(sock, on_read, on_write, edge_triggered)
+        if fd in self._handlers:
+            self._poller.modify(fd, handler.events(), edge_triggered)
+        else:
+            self._poller.register(fd, handler.events(), edge_triggered)
+        self._handlers[fd] = handler
+
+    def modify(self, sock, on_read = None, on_write = None):
+        """changes the callbacks of an already-registered socket, keeping its
+        triggering mode. this is typically used to start or stop waiting
+        for write-readiness, as output is queued or flushed"""
+        handler = self._handlers[sock.fileno()]
+        self.register(sock, on_read, on_write, handler.edge_triggered)
+
+    def unregister(self, sock):
+        """unregisters the given socket; this must be done before the
+        socket is closed"""
+        fd = sock.fileno()
+        if self._handlers.pop(fd, None) is not None:
+            self._poller.unregister(fd)
+
+    def register_listener(self, listener, on_accept, edge_triggered = False,
+            max_accepts = 64):
+        """
+        registers a ListenerSocket: whenever connections are pending, they
+        are accept()ed (at most `max_accepts` per wakeup, unless
+        edge-triggered, in which case the backlog is drained completely) and
+        on_accept is called with each new connected socket -- e.g., a
+        TcpConnectedSocket for a TcpListenerSocket. the new sockets are made
+        non-blocking, ready to be registered with the reactor.
+        """
+        listener.timeout = 0
+        def accept_ready(listener):
+            count = 0
+            while edge_triggered or count < max_accepts:
+                try:
+                    conn = listener.accept()
+                except TimeoutError:
+                    break
+                conn.timeout = 0
+                count += 1
+                on_accept(conn)
+        self.register(listener, accept_ready, None, edge_triggered)
+
+    #
+    # timers
+    #
+    def call_at(self, when, callback, *args):
+        """schedules callback(*args) to be called at the given time (as
+        returned by time.time()). returns a Timer"""
+        timer = Timer(when, callback, args)
+        self._timer_seq += 1
+        heapq.heappush(self._timers, (when, self._timer_seq, timer))
+        return timer
+
+    def call_later(self, delay, callback, *args):
+        """schedules callback(*args) to be called after `delay` seconds.
+        returns a Timer"""
+        return self.call_at(time.time() + delay, callback, *args)
+
+    def _run_timers(self):
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            when, seq, timer = heapq.heappop(self._timers)
+            if not timer.cancelled:
+                timer.callback(*timer.args)
+
+    def _prune_timers(self):
+        # drops the cancelled timers at the head of the heap
+        while self._timers and self._timers[0][2].cancelled:
+            heapq.heappop(self._timers)
+
+    def _next_timeout(self, timeout):
+        self._prune_timers()
+        if not self._timers:
+            return timeout
+        until_timer = max(self._timers[0][0] - time.time(), 0)
+        if timeout is None:
+            return until_timer
+        return min(timeout, until_timer)
+
+    #
+    # the loop
+    #
+    def run_once(self, timeout = None):
+        """polls once, waiting up to `timeout` seconds (or until the next
+        timer is due), and dispatches the ready sockets and due timers"""
+        try:
+            ready = self._poller.poll(self._next_timeout(timeout))
+        except (IOError, OSError, select.error), ex:
+            if ex.args[0] != errno.EINTR:
+                raise
+            ready = ()
+        for fd, events in ready:
+            # a previous callback may have unregistered this fd
+            handler = self._handlers.get(fd)
+            if handler is None:
+                continue
+            if events & READ and handler.on_read is not None:
+                handler.on_read(handler.sock)
+                if self._handlers.get(fd) is not handler:
+                    continue
+            if events & WRITE and handler.on_write is not None:
+                handler.on_write(handler.sock)
+        self._run_timers()
+
+    def run(self):
+        """runs the loop until stop() is called, or until there are no more
+        sockets or timers to wait for"""
+        self._running = True
+        try:
+            while self._running:
+                # a cancelled timer is nothing to wait for
+                self._prune_timers()
+                if not self._handlers and not self._timers:
+                    break
+                self.run_once()
+        finally:
+            self._running = False
+
+    def stop(self):
+        """stops the loop (takes effect once the current iteration ends)"""
+        self._running = False
@@ -0,0 +1,552 @@
+"""
+Server -- TCP servers around TcpListenerSocket, with a choice of concurrency
+
+Instead of hand-writing an accept loop for every service, subclass Handler
+and pick a concurrency model; the handler doesn't change between them:
+    * ThreadPoolServer -- a fixed pool of threads, each serving one
+      connection at a time with blocking I/O
+    * ReactorServer -- a single thread, serving all the connections with
+      non-blocking I/O (see reactor.Reactor)
+    * PreforkServer -- worker processes, each accepting on the listener (or
+      on its own shard of it, see ShardedListener) and running one of the
+      above
+
+Example:
+    class EchoHandler(Handler):
+        def on_data(self, data):
+            self.channel.send(data)
+
+    server = ThreadPoolServer(TcpListenerSocket("0.0.0.0", 8080),
+        EchoHandler, workers = 32)
+    server.serve_forever()
+
+Notes:
+    * handlers must not block: in all models, on_data should process the
+      data it's given and return, replying with channel.send(), which only
+      blocks in the thread-pool model
+    * shutdown() drains the server gracefully: it stops accepting, closes
+      the connections as they go quiet, and after `drain_timeout` seconds,
+      closes whatever is left. serve_forever() returns once it's done
+    * once max_connections are being served, the server stops accepting
+      (leaving new connections in the listener's backlog) until one closes.
+      the thread pool applies backpressure in the same way when all its
+      workers are busy and its queue is full; the reactor stops reading from
+      connections whose output backs up past `high_water` bytes
+"""
+import os
+import sys
+import time
+import errno
+import signal
+import threading
+import Queue
+from errors import TimeoutError, AcceptError
+from socket import TcpListenerSocket, ShardedListener, _poll
+from reactor import Reactor
+
+
+class Handler(object):
+    """
+    the base class of connection handlers; a new instance is created for
+    each connection, with the connection's Channel.
+    """
+    def __init__(self, channel):
+        self.channel = channel
+
+    def on_connect(self):
+        """called once the connection is accepted"""
+        pass
+
+    def on_data(self, data):
+        """called with each chunk of data received"""
+        pass
+
+    def on_close(self):
+        """called once the connection is closed (by either side)"""
+        pass
+
+
+class Channel(object):
+    """the handler's side of a connection"""
+    __slots__ = ["sock", "closing"]
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.closing = False
+
+    def __repr__(self):
+        return "<%s(%r)>" % (self.__class__.__name__, self.sock)
+
+    def send(self, data):
+        """sends the given data to the peer"""
+        raise NotImplementedError()
+
+    def close(self):
+        """closes the connection, once any pending output has been sent"""
+        self.closing = True
+
+
+class _BlockingChannel(Channel):
+    __slots__ = []
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+
+class _ReactorChannel(Channel):
+    __slots__ = ["server", "handler", "last_active", "events", "_wbuf"]
+
+    def __init__(self, server, sock):
+        Channel.__init__(self, sock)
+        self.server = server
+        self.handler = None
+        self.last_active = time.time()
+        self.events = None
+        self._wbuf = bytearray()
+
+    def send(self, data):
+        if not self._wbuf:
+            # try to send it right away; queue whatever doesn't make it
+            try:
+                sent = self.sock.send(data)
+            except TimeoutError:
+                sent = 0
+            if sent == len(data):
+                return
+            data = memoryview(data)[sent:]
+        self._wbuf += data
+        self.server._update(self)
+
+    def close(self):
+        self.closing = True
+        if not self._wbuf:
+            self.server._close(self)
+
+
+#
+# servers
+#
+class Server(object):
+    """
+    the base of the servers.
+
+    listener - a bound ListenerSocket
+    handler_class - the Handler (sub)class to instantiate per connection
+    max_connections - the max number of connections served at once
+    idle_timeout - connections that receive nothing for this many seconds
+                   are closed (None means never)
+    read_size - the max number of bytes passed to each on_data call
+    poll_interval - how often (in seconds) the server checks for shutdown
+    """
+    def __init__(self, listener, handler_class, max_connections = 1024,
+            idle_timeout = None, read_size = 65536, poll_interval = 0.5):
+        self.listener = listener
+        self.handler_class = handler_class
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.read_size = read_size
+        self.poll_interval = poll_interval
+        self._draining = False
+        self._drain_deadline = None
+        self._active = 0
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+
+    def __repr__(self):
+        return "<%s(%r, %d connections)>" % (self.__class__.__name__,
+            self.listener, self._active)
+
+    def _get_active_connections(self):
+        return self._active
+    active_connections = property(_get_active_connections, doc =
+        "the number of connections being served")
+
+    def _get_draining(self):
+        return self._draining
+    draining = property(_get_draining, doc =
+        "indicates whether or not the server is shutting down")
+
+    def serve_forever(self):
+        """serves connections until shutdown() is called, and the server has
+        drained"""
+        raise NotImplementedError()
+
+    def shutdown(self, drain_timeout = None):
+        """stops accepting connections, and lets the ones being served finish
+        within `drain_timeout` seconds (None means no limit). this doesn't
+        block (it may be called from a signal handler or a handler's
+        callback); serve_forever() returns once the server has drained"""
+        if drain_timeout is not None:
+            self._drain_deadline = time.time() + drain_timeout
+        # no locking here, as a signal handler may interrupt the thread
+        # that holds the lock; the waits are bounded by poll_interval anyway
+        self._draining = True
+
+    def _drain_expired(self):
+        return (self._drain_deadline is not None and
+            time.time() >= self._drain_deadline)
+
+    def _release(self):
+        with self._lock:
+            self._active -= 1
+            self._slot_freed.notify()
+
+    def _handler_error(self):
+        sys.excepthook(*sys.exc_info())
+
+
+class ThreadPoolServer(Server):
+    """
+    serves each connection on one of a fixed pool of threads. accepted
+    connections wait in a queue of `queue_size` for a free worker; when it's
+    full, accepting stops until a worker frees up.
+
+    workers - the number of worker threads
+    queue_size - the max number of accepted connections waiting for a worker
+    timeout - the timeout of the connections' sockets, which limits how long
+              channel.send() may block
+    """
+    def __init__(self, listener, handler_class, workers = 16,
+            queue_size = 64, timeout = None, **kw):
+        Server.__init__(self, listener, handler_class, **kw)
+        self.workers = workers
+        self.timeout = timeout
+        self._queue = Queue.Queue(queue_size)
+
+    def serve_forever(self):
+        threads = []
+        for i in range(self.workers):
+            thd = threading.Thread(target = self._work)
+            thd.daemon = True
+            thd.start()
+            threads.append(thd)
+        self.listener.timeout = self.poll_interval
+        try:
+            while not self._draining:
+                if not self._reserve():
+                    continue
+                try:
+                    conn = self.listener.accept()
+                except TimeoutError:
+                    self._release()
+                    continue
+                except AcceptError, ex:
+                    # a signal (e.g., one whose handler calls shutdown())
+                    # interrupted the accept: recheck whether to drain
+                    self._release()
+                    if ex.errno == errno.EINTR:
+                        continue
+                    raise
+                conn.timeout = self.timeout
+                self._enqueue(conn)
+        finally:
+            for thd in threads:
+                self._enqueue(None)
+            for thd in threads:
+                thd.join()
+
+    def _reserve(self):
+        with self._lock:
+            if self._active >= self.max_connections:
+                self._slot_freed.wait(self.poll_interval)
+                if self._active >= self.max_connections or self._draining:
+                    return False
+            self._active += 1
+            return True
+
+    def _enqueue(self, conn):
+        # blocks while all the workers are busy and the queue is full
+        while True:
+            try:
+                self._queue.put(conn, True, self.poll_interval)
+            except Queue.Full:
+                if conn is not None and self._drain_expired():
+                    conn.close()
+                    self._release()
+                    return
+            else:
+                return
+
+    def _work(self):
+        while True:
+            conn = self._queue.get()
+            if conn is None:
+                break
+            try:
+                self._serve(conn)
+            finally:
+                self._release()
+
+    def _serve(self, conn):
+        channel = _BlockingChannel(conn)
+        handler = None
+        try:
+            handler = self.handler_class(channel)
+            handler.on_connect()
+            last_active = time.time()
+            fd = conn.fileno()
+            while not channel.closing and not self._drain_expired():
+                if not _poll(fd, False, self.poll_interval):
+                    if self._draining:
+                        break
+                    if (self.idle_timeout is not None and
+                            time.time() - last_active > self.idle_timeout):
+                        break
+                    continue
+                try:
+                    data = conn.recv(self.read_size)
+                except EOFError:
+                    break
+                if data:
+                    last_active = time.time()
+                    handler.on_data(data)
+        except Exception:
+            self._handler_error()
+        finally:
+            try:
+                if handler is not None:
+                    handler.on_close()
+            except Exception:
+                self._handler_error()
+            conn.close()
+
+
+class ReactorServer(Server):
+    """
+    serves all the connections from a single thread, with a Reactor.
+
+    high_water - once this many bytes are queued for sending on a
+                 connection, the server stops reading from it until they've
+                 been sent
+    """
+    def __init__(self, listener, handler_class, high_water = 1 << 20, **kw):
+        Server.__init__(self, listener, handler_class, **kw)
+        self.high_water = high_water
+        self._reactor = Reactor()
+        self._channels = {}
+        self._accepting = False
+
+    def serve_forever(self):
+        self.listener.timeout = 0
+        try:
+            while True:
+                if self._draining:
+                    self._drain()
+                    if not self._channels:
+                        break
+                else:
+                    self._set_accepting(self._active < self.max_connections)
+                    if self.idle_timeout is not None:
+                        self._close_idle(self.idle_timeout)
+                self._reactor.run_once(self.poll_interval)
+        finally:
+            self._set_accepting(False)
+            for channel in self._channels.values():
+                self._close(channel)
+
+    def _drain(self):
+        self._set_accepting(False)
+        if self._drain_expired():
+            for channel in self._channels.values():
+                self._close(channel)
+        else:
+            self._close_idle(self.poll_interval)
+
+    def _close_idle(self, idle_time):
+        deadline = time.time() - idle_time
+        for channel in self._channels.values():
+            if channel.last_active < deadline and not channel._wbuf:
+                self._close(channel)
+
+    def _set_accepting(self, accepting):
+        if accepting == self._accepting:
+            return
+        if accepting:
+            self._reactor.register(self.listener, self._on_accept)
+        else:
+            self._reactor.unregister(self.listener)
+        self._accepting = accepting
+
+    def _on_accept(self, listener):
+        while self._active < self.max_connections:
+            try:
+                conn = listener.accept()
+            except TimeoutError:
+                break
+            conn.timeout = 0
+            channel = _ReactorChannel(self, conn)
+            self._channels[conn.fileno()] = channel
+            self._active += 1
+            self._update(channel)
+            self._call(channel, self._start)
+        if self._active >= self.max_connections:
+            self._set_accepting(False)
+
+    def _start(self, channel):
+        channel.handler = self.handler_class(channel)
+        channel.handler.on_connect()
+
+    def _call(self, channel, func, *args):
+        try:
+            func(channel, *args)
+        except Exception:
+            self._handler_error()
+            self._close(channel)
+
+    def _on_data(self, channel, data):
+        channel.handler.on_data(data)
+
+    def _on_readable(self, sock):
+        channel = self._channels[sock.fileno()]
+        try:
+            data = sock.recv(self.read_size)
+        except (EOFError, IOError):
+            self._close(channel)
+            return
+        if data:
+            channel.last_active = time.time()
+            self._call(channel, self._on_data, data)
+
+    def _on_writable(self, sock):
+        channel = self._channels[sock.fileno()]
+        try:
+            sent = sock.send(channel._wbuf)
+        except TimeoutError:
+            return
+        except IOError:
+            self._close(channel)
+            return
+        del channel._wbuf[:sent]
+        if not channel._wbuf and channel.closing:
+            self._close(channel)
+        else:
+            self._update(channel)
+
+    def _update(self, channel):
+        # read unless the output has backed up; write while there's output
+        if channel.sock.fileno() not in self._channels:
+            return
+        reading = len(channel._wbuf) < self.high_water
+        writing = len(channel._wbuf) > 0
+        if (reading, writing) == channel.events:
+            return
+        if channel.events is None:
+            register = self._reactor.register
+        else:
+            register = self._reactor.modify
+        register(channel.sock, self._on_readable if reading else None,
+            self._on_writable if writing else None)
+        channel.events = (reading, writing)
+
+    def _close(self, channel):
+        sock = channel.sock
+        if self._channels.pop(sock.fileno(), None) is None:
+            return
+        self._reactor.unregister(sock)
+        self._active -= 1
+        channel.closing = True
+        try:
+            if channel.handler is not None:
+                channel.handler.on_close()
+        except Exception:
+            self._handler_error()
+        sock.close()
+
+
+class PreforkServer(object):
+    """
+    forks worker processes that serve the same endpoint, each running a
+    server of `server_class` (ThreadPoolServer or ReactorServer, created
+    with **kw). with `sharded`, each worker accepts on its own listener,
+    bound with reuse_port (see ShardedListener), so the kernel spreads the
+    connections across them; otherwise they all accept on a single listener.
+
+    processes - the number of workers (default: the number of cpus)
+    drain_timeout - the drain_timeout of the workers' shutdown()
+
+    shutdown() signals the workers (with SIGTERM) to drain and exit;
+    serve_forever() returns once they all have.
+    """
+    def __init__(self, host, port, handler_class, processes = None,
+            sharded = True, server_class = ThreadPoolServer, backlog = 128,
+            drain_timeout = None, **kw):
+        if processes is None:
+            processes = os.sysconf("SC_NPROCESSORS_ONLN")
+        self.handler_class = handler_class
+        self.server_class = server_class
+        self.drain_timeout = drain_timeout
+        self.server_kw = kw
+        self.pids = []
+        if sharded:
+            self._sharded = ShardedListener(host, port, processes, backlog)
+            self.listeners = list(self._sharded)
+        else:
+            self._sharded = None
+            listener = TcpListenerSocket(host, port, backlog = backlog)
+            self.listeners = [listener] * processes
+        # the listeners are closed in the parent once the workers start
+        self._local_endpoint = self.listeners[0].local_endpoint
+
+    def __repr__(self):
+        return "<%s(%d workers)>" % (self.__class__.__name__,
+            len(self.listeners))
+
+    def _get_local_endpoint(self):
+        return self._local_endpoint
+    local_endpoint = property(_get_local_endpoint, doc =
+        "the endpoint being served")
+
+    def start(self):
+        """forks the workers (without waiting for them); returns their pids"""
+        if self._sharded is not None:
+            self.pids = self._sharded.fork(self._run_worker)
+        else:
+            listener = self.listeners[0]
+            for i in range(len(self.listeners)):
+                pid = os.fork()
+                if pid == 0:
+                    status = 0
+                    try:
+                        try:
+                            self._run_worker(listener)
+                        except:
+                            sys.excepthook(*sys.exc_info())
+                            status = 1
+                    finally:
+                        os._exit(status)
+                self.pids.append(pid)
+            listener.close()
+        return self.pids
+
+    def _run_worker(self, listener):
+        server = self.server_class(listener, self.handler_class,
+            **self.server_kw)
+        signal.signal(signal.SIGTERM,
+            lambda signum, frame: server.shutdown(self.drain_timeout))
+        server.serve_forever()
+
+    def serve_forever(self):
+        """starts the workers (unless start() was already called), and
+        waits for them all to exit"""
+        if not self.pids:
+            self.start()
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except OSError, ex:
+                if ex.errno == errno.EINTR:
+                    continue
+                if ex.errno == errno.ECHILD:
+                    break
+                raise
+            if pid in self.pids:
+                self.pids.remove(pid)
+
+    def shutdown(self):
+        """signals the workers to drain and exit"""
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError, ex:
+                if ex.errno != errno.ESRCH:
+                    raise
@@ -1,15 +1,33 @@
+import os
+import sys
+import time
+import errno
+import struct
+import select
 import _socket
+import threading
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 import consts
-from errors import (TimeoutError, SocketClosed, AcceptError, BindError, 
-    ConnectError, NotBoundError, NotConnectedError, AlreadyBoundError, 
+import _libc
+import packet
+from errors import (SocketError, TimeoutError, SocketClosed, AcceptError, 
+    BindError, ConnectError, NotBoundError, NotConnectedError, AlreadyBoundError, 
     AlreadyConnectedError, timeout_errnos)
 from options import SocketLevelOptions, IpLevelMixin, TcpLevelMixin
+from buffers import DatagramBatch
+from dns import canonize_ipaddr, resolve_concurrently
 
 
 __all__ = [
     "Socket", 
     "ConnectedSocket", "ListenerSocket", "DatagramSocket", "RawSocket",
     "TcpConnectedSocket", "TcpListenerSocket",  "UdpSocket",
+    "ShardedListener", "IpRawSocket", "PacketSocket",
+    "UnixConnectedSocket", "UnixListenerSocket", "UnixDatagramSocket",
+    "socketpair",
 ]
 
 
@@ -21,21 +39,81 @@ class closed_socket(object):
         raise SocketClosed()
 closed_socket = closed_socket()
 
+_new_object = object.__new__
+
+
+def _poll(fd, writable, timeout):
+    """waits up to `timeout` seconds for the fd to become readable/writable;
+    returns True if it's ready"""
+    if hasattr(select, "poll"):
+        poller = select.poll()
+        poller.register(fd, select.POLLOUT if writable else select.POLLIN)
+        return bool(poller.poll(timeout * 1000))
+    elif writable:
+        return bool(select.select([], [fd], [], timeout)[1])
+    else:
+        return bool(select.select([fd], [], [], timeout)[0])
+
+# the would-block check of the try_recv methods: a zero-timeout poll is
+# several times cheaper than a recv that fails with EAGAIN, as the latter
+# raises (and catches) an exception. the poll objects are cached per thread
+# (they may not be shared by concurrent pollers) and per fd (a poll object
+# holds nothing but the fd's number, so it remains valid for any socket
+# that reuses the number)
+_pollers = threading.local()
+
+if hasattr(select, "poll"):
+    _POLLIN = select.POLLIN
+    def _readable_now(fd):
+        try:
+            poller = _pollers.by_fd[fd]
+        except AttributeError:
+            _pollers.by_fd = {}
+            return _readable_now(fd)
+        except KeyError:
+            poller = _pollers.by_fd[fd] = select.poll()
+            poller.register(fd, _POLLIN)
+        return poller.poll(0)
+else:
+    def _readable_now(fd):
+        return select.select([fd], [], [], 0)[0]
+
+# the data may still be gone by the time of the recv (taken by another
+# reader, or dropped for a bad checksum), so the recv itself mustn't block
+# either, where the platform allows
+_MSG_DONTWAIT = getattr(consts.RecvFlags, "DONTWAIT", 0)
+
+def _poll_many(fds, writable, timeout):
+    """like _poll, but for many fds; returns the list of the ready ones"""
+    if hasattr(select, "poll"):
+        poller = select.poll()
+        for fd in fds:
+            poller.register(fd, select.POLLOUT if writable else select.POLLIN)
+        if timeout is not None:
+            timeout *= 1000
+        return [fd for fd, events in poller.poll(timeout)]
+    elif writable:
+        rlist, wlist, xlist = select.select([], fds, fds, timeout)
+        return list(set(wlist) | set(xlist))
+    else:
+        rlist, wlist, xlist = select.select(fds, [], fds, timeout)
+        return list(set(rlist) | set(xlist))
+
+
 
 #
 # the base socket
 #
 class Socket(SocketLevelOptions):
     """base socket"""
-    __slots__ = ["_sock", "_is_bound"]
+    # weakly referenceable, so sockets can be tracked (see instrument.py)
+    # without being kept alive
+    __slots__ = ["_sock", "_is_bound", "__weakref__"]
     
     def __init__(self, familty, type, protocol):
         self._sock = _socket.socket(familty, type, protocol)
         self._is_bound = False
     
-    def __del__(self):
-        self.close()
-    
     def __repr__(self):
         if self.closed:
             return "<%s(closed)>" % (self.__class__.__name__,)
@@ -79,6 +157,24 @@ class Socket(SocketLevelOptions):
         "the timeout for operations, in seconds (float). "
         "None means infinite timeout (blocking)")
     
+    def _get_deadline(self):
+        """returns the absolute time by which an operation must complete, 
+        given the socket's timeout; None means no deadline (blocking)"""
+        timeout = self._sock.gettimeout()
+        if timeout is None:
+            return None
+        return time.time() + timeout
+    
+    def _wait_ready(self, deadline, writable):
+        """waits for the socket to become readable/writable, or raises a 
+        TimeoutError once the deadline passes. a deadline of None means
+        the socket is blocking, so there's no need to wait"""
+        if deadline is None:
+            return
+        remaining = deadline - time.time()
+        if remaining <= 0 or not _poll(self._sock.fileno(), writable, remaining):
+            raise TimeoutError()
+    
     def shutdown(self, mode = "rw"):
         """shuts down the socket, for reading, writing or both. mode must be
         one of ('r', 'w', 'rw')"""
@@ -119,11 +215,14 @@ class Socket(SocketLevelOptions):
 #
 class ListenerSocket(Socket):
     """represents server sockets (binds to local address, can accept)"""
-    __slots__ = ["_backlog"]
+    __slots__ = ["_backlog", "_accept_profile"]
+    # the ConnectedSocket subclass that accepted sockets are wrapped in
+    connected_class = None
     
     def __init__(self, familty, type, protocol, local_endpoint = None, backlog = 4):
         Socket.__init__(self, familty, type, protocol)
         self._backlog = backlog
+        self._accept_profile = None
         if local_endpoint is not None:
             self.bind(local_endpoint)
     
@@ -137,14 +236,22 @@ class ListenerSocket(Socket):
     backlog = property(_get_backlog, _set_backlog, doc = 
         "gets or sets the socket's listen-backlog (int)")
     
+    def _get_accept_profile(self):
+        return self._accept_profile
+    def _set_accept_profile(self, profile):
+        self._accept_profile = profile
+    accept_profile = property(_get_accept_profile, _set_accept_profile, doc =
+        "an OptionProfile to apply to every accepted socket, or None. note "
+        "that some options (e.g., no_delay and the buffer sizes on linux) "
+        "are inherited from the listener, so setting them on the listener "
+        "itself is even cheaper")
+    
     def bind(self, local_endpoint):
         """binds the socket and listens"""
         Socket.bind(self, local_endpoint)
         self._sock.listen(self.backlog)
     
-    def accept(self):
-        """accepts a connection -- returns a real-socket that should 
-        be wrap()ped by a subclass of ClientSocket"""
+    def _accept_raw(self):
         if not self._is_bound:
             raise NotBoundError()
         try:
@@ -157,6 +264,58 @@ class ListenerSocket(Socket):
             else:
                 raise AcceptError(errno, info)
         return newsock
+    
+    def _accept_many_raw(self, count):
+        newsocks = []
+        try:
+            newsocks.append(self._accept_raw())
+        except TimeoutError:
+            return newsocks
+        timeout = self._sock.gettimeout()
+        if timeout != 0.0:
+            self._sock.setblocking(False)
+        try:
+            while len(newsocks) < count:
+                try:
+                    newsocks.append(self._accept_raw())
+                except TimeoutError:
+                    break
+        finally:
+            if timeout != 0.0:
+                self._sock.settimeout(timeout)
+        for newsock in newsocks:
+            newsock.setblocking(False)
+            if fcntl is not None:
+                fcntl.fcntl(newsock.fileno(), fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        return newsocks
+    
+    def accept(self):
+        """accepts a connection -- returns an instance of connected_class
+        (with the accept_profile applied), or a real-socket if the subclass
+        doesn't set connected_class"""
+        newsock = self._accept_raw()
+        if self.connected_class is None:
+            return newsock
+        conn = self.connected_class._accepted(newsock)
+        if self._accept_profile is not None:
+            self._accept_profile.apply(conn)
+        return conn
+    
+    def accept_many(self, count = 64):
+        """accepts up to `count` pending connections in one go, draining the 
+        backlog: waits for the first connection like accept() does, and then
+        takes whatever else is already pending. returns a list of connected 
+        sockets, as accept() does (the list is empty if the operation timed 
+        out), already set to non-blocking and close-on-exec"""
+        newsocks = self._accept_many_raw(count)
+        if self.connected_class is None:
+            return newsocks
+        accepted = self.connected_class._accepted
+        conns = [accepted(newsock) for newsock in newsocks]
+        if self._accept_profile is not None:
+            for conn in conns:
+                self._accept_profile.apply(conn)
+        return conns
 
 
 class ConnectedSocket(Socket):
@@ -172,6 +331,33 @@ class ConnectedSocket(Socket):
         if remote_endpoint is not None:
             self.connect(remote_endpoint)
     
+    @classmethod
+    def _accepted(cls, sock):
+        """wraps a connected real-socket, e.g., one returned by 
+        ListenerSocket.accept. this is the accept loop's fast path: the slots
+        are assigned directly, rather than through wrap()'s keyword 
+        arguments"""
+        obj = _new_object(cls)
+        obj._sock = sock
+        obj._is_bound = True
+        obj._is_connected = True
+        return obj
+    
+    @classmethod
+    def from_fd(cls, fd, family = None):
+        """wraps the given file descriptor of a connected stream socket (e.g.,
+        one received with UnixConnectedSocket.recv_fds) in an instance of 
+        this class, which takes it over: it's closed when the socket is. the
+        address family is detected, if not given"""
+        if family is None:
+            if _libc.socket_family is not None:
+                family = _libc.socket_family(fd)
+            else:
+                family = consts.AddressFamily.INET
+        sock = _socket.fromfd(fd, family, consts.SocketType.STREAM)
+        os.close(fd)
+        return cls._accepted(sock)
+    
     def connect(self, endpoint):
         """connects this socket to a remote endpoint. if the socket is not 
         already bound, it is automatically bound to a free local endpoint"""
@@ -214,6 +400,63 @@ class ConnectedSocket(Socket):
             raise EOFError()
         return data
     
+    def try_recv(self, count):
+        """receives whatever data is available right now, never waiting 
+        (regardless of the socket's timeout). returns None if there is none,
+        which -- unlike the timeout path of recv() -- involves no exceptions,
+        making it the cheaper call for non-blocking polling loops"""
+        if not self._is_connected:
+            raise NotConnectedError()
+        if not _readable_now(self._sock.fileno()):
+            return None
+        try:
+            data = self._sock.recv(count, _MSG_DONTWAIT)
+        except _socket.timeout:
+            return None
+        except _socket.error, (errno, info):
+            if errno in timeout_errnos:
+                return None
+            raise SocketError(errno, info)
+        if not data:
+            raise EOFError()
+        return data
+    
+    def recv_into(self, buffer, count = 0):
+        """receives data directly into the given writable buffer (a bytearray
+        or a memoryview over one), without allocating a new string. at most 
+        `count` bytes are received (0 means the whole buffer). returns the 
+        number of bytes actually received, or 0 if the operation timed out"""
+        if not self._is_connected:
+            raise NotConnectedError()
+        try:
+            count = self._sock.recv_into(buffer, count)
+        except _socket.timeout:
+            return 0
+        except _socket.error, (errno, info):
+            if errno in timeout_errnos:
+                return 0
+            else:
+                raise SocketError(errno, info)
+        if not count:
+            raise EOFError()
+        return count
+    
+    def recv_exact_into(self, buffer, count = 0):
+        """like recv_into, but keeps receiving until exactly `count` bytes 
+        (0 means the whole buffer) have been written into the buffer. returns
+        the number of bytes received, which is less than `count` only if the
+        operation timed out in the middle"""
+        view = memoryview(buffer)
+        if not count:
+            count = len(view)
+        received = 0
+        while received < count:
+            n = self.recv_into(view[received:count])
+            if not n:
+                break
+            received += n
+        return received
+    
     def send(self, data):
         """sends the given data over the socket, returns the number of bytes
         actually transmitted"""
@@ -228,6 +471,170 @@ class ConnectedSocket(Socket):
                 raise TimeoutError()
             else:
                 raise SocketError(errno, info)
+    
+    def sendall(self, data):
+        """sends all of the given data over the socket, retrying partial 
+        sends as needed. the socket's timeout applies to the operation as a 
+        whole, rather than to each underlying send"""
+        if not self._is_connected:
+            raise NotConnectedError()
+        deadline = self._get_deadline()
+        view = memoryview(data)
+        total = len(view)
+        sent = 0
+        while True:
+            try:
+                sent += self._sock.send(view[sent:])
+            except _socket.timeout:
+                pass
+            except _socket.error, (errno, info):
+                if errno not in timeout_errnos:
+                    raise SocketError(errno, info)
+            if sent >= total:
+                return total
+            self._wait_ready(deadline, True)
+    
+    def sendv(self, buffers):
+        """sends all of the given buffers, in order, as if they were a single
+        string -- but without joining them (scatter-gather I/O, using writev 
+        where available). like sendall(), the socket's timeout applies to the
+        operation as a whole. returns the number of bytes sent"""
+        if not self._is_connected:
+            raise NotConnectedError()
+        if _libc.writev is None:
+            return self.sendall("".join(memoryview(buf).tobytes() 
+                for buf in buffers))
+        views = [memoryview(buf) for buf in buffers]
+        views = [v for v in views if len(v)]
+        deadline = self._get_deadline()
+        fd = self._sock.fileno()
+        total = 0
+        first = 0
+        while True:
+            try:
+                n = _libc.writev(fd, views[first:first + _libc.IOV_MAX])
+            except _socket.error, (errno, info):
+                if errno not in timeout_errnos:
+                    raise SocketError(errno, info)
+                n = 0
+            total += n
+            # skip the buffers that were sent in full, trim the partial one
+            while first < len(views) and n >= len(views[first]):
+                n -= len(views[first])
+                first += 1
+            if first >= len(views):
+                return total
+            views[first] = views[first][n:]
+            self._wait_ready(deadline, True)
+    
+    def send_file(self, fileobj, offset = 0, count = None):
+        """sends `count` bytes (None means up to the end) of the given file 
+        (a file object or a file descriptor), starting at `offset`. uses 
+        sendfile where available, so the data is sent directly by the kernel,
+        without being copied through user space. the socket's timeout 
+        applies to the operation as a whole. returns the number of bytes 
+        sent, which is less than `count` only if the file is shorter"""
+        if not self._is_connected:
+            raise NotConnectedError()
+        if hasattr(fileobj, "fileno"):
+            fd = fileobj.fileno()
+        else:
+            fd = fileobj
+        if count is None:
+            count = max(os.fstat(fd).st_size - offset, 0)
+        if _libc.sendfile is None:
+            return self._send_file_fallback(fd, offset, count)
+        deadline = self._get_deadline()
+        sockfd = self._sock.fileno()
+        sent = 0
+        while sent < count:
+            try:
+                n = _libc.sendfile(sockfd, fd, offset + sent, count - sent)
+            except _socket.error, (errno, info):
+                if errno not in timeout_errnos:
+                    raise SocketError(errno, info)
+                self._wait_ready(deadline, True)
+                continue
+            if n == 0:
+                break
+            sent += n
+        return sent
+    
+    def _send_file_fallback(self, fd, offset, count, chunk_size = 65536):
+        os.lseek(fd, offset, os.SEEK_SET)
+        sent = 0
+        while sent < count:
+            data = os.read(fd, min(chunk_size, count - sent))
+            if not data:
+                break
+            sent += self.sendall(data)
+        return sent
+    
+    def splice_to(self, other, count = None, chunk_size = 65536):
+        """moves data received on this socket to the `other` ConnectedSocket,
+        until `count` bytes have been moved (None means until EOF). uses 
+        splice (through a pipe) where available, so the data never passes 
+        through user space. each socket's timeout applies to the operation as
+        a whole. returns the number of bytes moved, which is less than 
+        `count` only if EOF was reached first"""
+        if not self._is_connected or not other._is_connected:
+            raise NotConnectedError()
+        if _libc.splice is None:
+            return self._splice_to_fallback(other, count, chunk_size)
+        read_deadline = self._get_deadline()
+        write_deadline = other._get_deadline()
+        infd = self._sock.fileno()
+        outfd = other._sock.fileno()
+        moved = 0
+        rpipe, wpipe = os.pipe()
+        try:
+            while count is None or moved < count:
+                if count is None:
+                    size = chunk_size
+                else:
+                    size = min(chunk_size, count - moved)
+                try:
+                    pending = _libc.splice(infd, wpipe, size)
+                except _socket.error, (errno, info):
+                    if errno not in timeout_errnos:
+                        raise SocketError(errno, info)
+                    self._wait_ready(read_deadline, False)
+                    continue
+                if pending == 0:
+                    break
+                while pending:
+                    try:
+                        n = _libc.splice(rpipe, outfd, pending)
+                    except _socket.error, (errno, info):
+                        if errno not in timeout_errnos:
+                            raise SocketError(errno, info)
+                        other._wait_ready(write_deadline, True)
+                        continue
+                    pending -= n
+                    moved += n
+        finally:
+            os.close(rpipe)
+            os.close(wpipe)
+        return moved
+    
+    def _splice_to_fallback(self, other, count, chunk_size):
+        buffer = memoryview(bytearray(chunk_size))
+        deadline = self._get_deadline()
+        moved = 0
+        while count is None or moved < count:
+            if count is None:
+                size = chunk_size
+            else:
+                size = min(chunk_size, count - moved)
+            try:
+                n = self.recv_into(buffer, size)
+            except EOFError:
+                break
+            if not n:
+                self._wait_ready(deadline, False)
+                continue
+            moved += other.sendall(buffer[:n])
+        return moved
 
 
 #
@@ -235,6 +642,7 @@ class ConnectedSocket(Socket):
 #
 class DatagramSocket(Socket):
     """datagram sockets (not connected)"""
+    __slots__ = []
     
     def __init__(self, familty, type, protocol, local_endpoint = None):
         Socket.__init__(self, familty, type, protocol)
@@ -247,7 +655,26 @@ class DatagramSocket(Socket):
         except _socket.timeout:
             raise TimeoutError()
         except _socket.error, (errno, info):
-            raise SocketError(errno, info)
+            if errno in timeout_errnos:
+                raise TimeoutError()
+            else:
+                raise SocketError(errno, info)
+    
+    def sendv(self, buffers, addr):
+        """sends the given buffers as a single datagram, without joining them
+        (using sendmsg where available)"""
+        if _libc.sendmsg is None:
+            return self.send("".join(memoryview(buf).tobytes() 
+                for buf in buffers), addr)
+        deadline = self._get_deadline()
+        while True:
+            try:
+                return _libc.sendmsg(self._sock.fileno(), buffers, 
+                    self._sock.family, addr)
+            except _socket.error, (errno, info):
+                if errno not in timeout_errnos:
+                    raise SocketError(errno, info)
+            self._wait_ready(deadline, True)
     
     def recv(self, count):
         try:
@@ -259,43 +686,292 @@ class DatagramSocket(Socket):
                 return "", None
             else:
                 raise SocketError(errno, info)
+    
+    def try_recv(self, count):
+        """receives a datagram if one is available right now, never waiting
+        (regardless of the socket's timeout). returns a tuple of (data, addr),
+        or None if there is none; see ConnectedSocket.try_recv"""
+        if not _readable_now(self._sock.fileno()):
+            return None
+        try:
+            return self._sock.recvfrom(count, _MSG_DONTWAIT)
+        except _socket.timeout:
+            return None
+        except _socket.error, (errno, info):
+            if errno in timeout_errnos:
+                return None
+            raise SocketError(errno, info)
+    
+    def recv_many(self, max_msgs = 64, bufsize = 2048, batch = None):
+        """receives up to `max_msgs` datagrams, of up to `bufsize` bytes each,
+        in a single call (using recvmmsg where available). waits for the 
+        first datagram like recv() does, and then takes whatever else is 
+        already queued. returns a DatagramBatch, which is empty if the 
+        operation timed out. to avoid allocating a new batch on every call,
+        pass a previous one as `batch` (max_msgs and bufsize are then taken
+        from it)"""
+        if batch is None:
+            batch = DatagramBatch(max_msgs, bufsize)
+        batch.count = 0
+        if batch._mmsgs is None:
+            self._recv_many_fallback(batch)
+            return batch
+        deadline = self._get_deadline()
+        fd = self._sock.fileno()
+        while True:
+            try:
+                count = _libc.recvmmsg(fd, batch._mmsgs, batch.capacity, 
+                    _libc.MSG_WAITFORONE)
+            except _socket.error, (errno, info):
+                if errno not in timeout_errnos:
+                    raise SocketError(errno, info)
+            else:
+                batch._collect(count)
+                return batch
+            try:
+                self._wait_ready(deadline, False)
+            except TimeoutError:
+                return batch
+    
+    def _recv_many_fallback(self, batch):
+        fd = self._sock.fileno()
+        for i in range(batch.capacity):
+            # only the first recv may wait
+            if i > 0 and not _poll(fd, False, 0):
+                break
+            offset = batch.offsets[i]
+            try:
+                length, addr = self._sock.recvfrom_into(
+                    batch._view[offset:offset + batch.bufsize])
+            except _socket.timeout:
+                break
+            except _socket.error, (errno, info):
+                if errno in timeout_errnos:
+                    break
+                else:
+                    raise SocketError(errno, info)
+            batch.lengths[i] = length
+            batch._addrs[i] = addr
+            batch.count += 1
+    
+    def send_many(self, datagrams):
+        """sends the given list of (data, addr) tuples in as few calls as 
+        possible (using sendmmsg where available). the socket's timeout 
+        applies to the operation as a whole. returns the number of datagrams
+        sent"""
+        if _libc.sendmmsg is None:
+            for data, addr in datagrams:
+                self.send(data, addr)
+            return len(datagrams)
+        deadline = self._get_deadline()
+        fd = self._sock.fileno()
+        sent = 0
+        while sent < len(datagrams):
+            try:
+                sent += _libc.sendmmsg(fd, self._sock.family, 
+                    datagrams[sent:sent + _libc.IOV_MAX])
+            except _socket.error, (errno, info):
+                if errno not in timeout_errnos:
+                    raise SocketError(errno, info)
+                self._wait_ready(deadline, True)
+        return sent
 
 
-class RawSocket(Socket):
-    """to be implemented"""
-    pass
+class RawSocket(DatagramSocket):
+    """
+    raw sockets: these work like datagram sockets, except that each packet 
+    is sent and received whole, including the protocol headers (which ones
+    depends on the family; see IpRawSocket and PacketSocket). raw sockets 
+    require root privileges (CAP_NET_RAW)
+    """
+    __slots__ = []
 
 
 #
 # protocol-specific sockets
 #
 class TcpConnectedSocket(ConnectedSocket, IpLevelMixin, TcpLevelMixin):
-    """a connected (client) socket wrapper for TCP/IP"""
+    """
+    a connected (client) socket wrapper for TCP/IP. pass a 
+    dns.ResolverCache as `resolver` to have the host name resolved through
+    it, rather than by the resolver on every connection
+    """
     __slots__ = []
     def __init__(self, *endpoint, **kw):
         remote_endpoint = endpoint or None
         family = kw.pop("family", consts.AddressFamily.INET)
+        resolver = kw.pop("resolver", None)
+        if resolver is not None and remote_endpoint is not None:
+            host = remote_endpoint[0]
+            try:
+                canonize_ipaddr(host)
+            except ValueError:
+                host = resolver.from_name(host).addr
+            remote_endpoint = (host,) + remote_endpoint[1:]
         ConnectedSocket.__init__(self, family, consts.SocketType.STREAM, 
             consts.IpProtocol.TCP, remote_endpoint, **kw)
+    
+    @classmethod
+    def connect_fastest(cls, host, port, delay = 0.25, timeout = None, 
+            pool = None):
+        """
+        connects to the given host in the "happy eyeballs" manner (RFC 8305):
+        the host's IPv6 and IPv4 addresses are resolved in parallel (see 
+        dns.resolve_concurrently), and then connection attempts are raced 
+        across all of them, starting a new attempt every `delay` seconds (or
+        as soon as one fails). the first attempt to succeed wins and the rest
+        are closed, so a slow or dead address doesn't stall the connect.
+        
+        host may be a name, an ip-string or an Address (in which case all of
+        its addresses are tried). `timeout` limits the whole operation, and
+        becomes the returned socket's timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        candidates = resolve_concurrently(host, pool, timeout = timeout)
+        pending = {}
+        last_error = None
+        next_attempt = time.time()
+        try:
+            while candidates or pending:
+                now = time.time()
+                if deadline is not None and now >= deadline:
+                    raise TimeoutError()
+                if candidates and (now >= next_attempt or not pending):
+                    family, ip = candidates.pop(0)
+                    sock = cls(family = family)
+                    sock.timeout = 0
+                    try:
+                        sock.connect((ip, port))
+                    except ConnectError, ex:
+                        if ex.errno != errno.EINPROGRESS:
+                            sock.close()
+                            last_error = ex
+                            continue
+                        pending[sock.fileno()] = sock
+                    else:
+                        return sock._won_race(timeout)
+                    next_attempt = now + delay
+                
+                wait = None
+                if candidates:
+                    wait = max(next_attempt - now, 0)
+                if deadline is not None:
+                    remaining = max(deadline - now, 0)
+                    wait = remaining if wait is None else min(wait, remaining)
+                for fd in _poll_many(pending.keys(), True, wait):
+                    sock = pending.pop(fd)
+                    err = sock.error_state
+                    if not err:
+                        return sock._won_race(timeout)
+                    sock.close()
+                    last_error = ConnectError(err, os.strerror(err))
+                    # a failed attempt makes way for the next one right away
+                    next_attempt = time.time()
+        finally:
+            for sock in pending.values():
+                sock.close()
+        raise last_error
+    
+    def _won_race(self, timeout):
+        self._is_connected = True
+        self._is_bound = True
+        self.timeout = timeout
+        return self
 
 
 class TcpListenerSocket(ListenerSocket, IpLevelMixin, TcpLevelMixin):
     """a listener (server) socket wrapper for TCP/IP"""
     __slots__ = []
+    connected_class = TcpConnectedSocket
+    
     def __init__(self, *endpoint, **kw):
         local_endpoint = endpoint or None
         family = kw.pop("family", consts.AddressFamily.INET)
         ListenerSocket.__init__(self, family, consts.SocketType.STREAM, 
             consts.IpProtocol.TCP, local_endpoint, **kw)
+
+
+class ShardedListener(object):
+    """
+    a group of TcpListenerSockets, all bound to the same endpoint with 
+    reuse_port (SO_REUSEPORT), so the kernel spreads incoming connections
+    across them. each shard is meant to be served by its own worker process
+    (see fork()), which spreads the accept load across cores.
     
-    def accept(self):
-        return TcpConnectedSocket.wrap(
-            _sock = ListenerSocket.accept(self), 
-            _is_bound = True,
-            _is_connected = True
-        )
+    shards - the number of listeners (default: the number of cpus)
+    backlog - each listener's backlog
+    """
+    __slots__ = ["listeners"]
+    
+    def __init__(self, host, port, shards = None, backlog = 128, **kw):
+        if shards is None:
+            shards = os.sysconf("SC_NPROCESSORS_ONLN")
+        self.listeners = []
+        try:
+            for i in range(shards):
+                listener = TcpListenerSocket(backlog = backlog, **kw)
+                self.listeners.append(listener)
+                listener.reuse_port = True
+                listener.bind((host, port))
+                # when binding to an ephemeral port, the rest of the shards 
+                # must join the one chosen for the first
+                port = listener.local_endpoint[1]
+        except:
+            self.close()
+            raise
+    
+    def __repr__(self):
+        return "<%s(%d shards)>" % (self.__class__.__name__, 
+            len(self.listeners))
+    
+    def __len__(self):
+        return len(self.listeners)
+    
+    def __iter__(self):
+        return iter(self.listeners)
+    
+    def _get_local_endpoint(self):
+        return self.listeners[0].local_endpoint
+    local_endpoint = property(_get_local_endpoint, doc = 
+        "the endpoint shared by all shards")
+    
+    def close(self):
+        """closes all the shards"""
+        for listener in self.listeners:
+            listener.close()
+    
+    def fork(self, worker):
+        """forks a worker process per shard, which calls worker(listener) 
+        with its own shard (the rest are closed in the child), and exits when
+        it returns. the parent's copies of the shards are closed, as only 
+        the workers should accept on them. returns the workers' pids"""
+        pids = []
+        for listener in self.listeners:
+            pid = os.fork()
+            if pid == 0:
+                status = 0
+                try:
+                    try:
+                        for other in self.listeners:
+                            if other is not listener:
+                                other.close()
+                        worker(listener)
+                    except:
+                        sys.excepthook(*sys.exc_info())
+                        status = 1
+                finally:
+                    os._exit(status)
+            pids.append(pid)
+        self.close()
+        return pids
 
 
+# whether the kernel supports UDP segmentation offload (UDP_SEGMENT); None
+# until first checked
+_udp_gso = None
+# the max payload of a (segmented) UDP send
+_UDP_MAX_PAYLOAD = 65507
+
 class UdpSocket(DatagramSocket, IpLevelMixin):
     """udp sockets"""
     __slots__ = []
@@ -304,6 +980,314 @@ class UdpSocket(DatagramSocket, IpLevelMixin):
         family = kw.pop("family", consts.AddressFamily.INET)
         DatagramSocket.__init__(self, family, consts.SocketType.DGRAM, 
             consts.IpProtocol.UDP, local_endpoint, **kw)
+    
+    def _has_gso(self):
+        global _udp_gso
+        if _udp_gso is None:
+            try:
+                self._sock.getsockopt(_libc.SOL_UDP, _libc.UDP_SEGMENT)
+            except _socket.error:
+                _udp_gso = False
+            else:
+                _udp_gso = _libc.sendmsg is not None
+        return _udp_gso
+    
+    def send_segmented(self, buffer, segment_size, addr):
+        """
+        sends the given buffer as a series of datagrams of `segment_size` 
+        bytes each (the last one may be shorter), in as few calls as 
+        possible: with UDP segmentation offload (GSO, linux 4.18 and on), the
+        kernel (or the NIC) splits each send into up to 64 datagrams; 
+        otherwise, the datagrams are sent with send_many(). the socket's 
+        timeout applies to the operation as a whole. returns the number of
+        datagrams sent
+        """
+        view = memoryview(buffer)
+        if segment_size <= 0:
+            raise ValueError("segment_size must be positive", segment_size)
+        if segment_size > 65535:
+            raise ValueError("segment_size must be at most 65535", 
+                segment_size)
+        if not self._has_gso():
+            return self.send_many([(view[i:i + segment_size], addr)
+                for i in xrange(0, len(view), segment_size)])
+        per_call = max(1, min(_libc.UDP_MAX_SEGMENTS, 
+            _UDP_MAX_PAYLOAD // segment_size)) * segment_size
+        ancillary = [(_libc.SOL_UDP, _libc.UDP_SEGMENT, 
+            struct.pack("=H", segment_size))]
+        deadline = self._get_deadline()
+        fd = self._sock.fileno()
+        family = self._sock.family
+        offset = 0
+        while offset < len(view):
+            chunk = view[offset:offset + per_call]
+            try:
+                _libc.sendmsg(fd, [chunk], family, addr, 0, 
+                    ancillary if len(chunk) > segment_size else None)
+            except _socket.error, (err, info):
+                if err in (errno.EIO, errno.EINVAL):
+                    # the device can't offload this (EIO, e.g., no checksum
+                    # offload), or the segments exceed the path's MTU 
+                    # (EINVAL): send these datagrams one by one (a genuinely 
+                    # invalid send fails there too)
+                    self.send_many([(chunk[i:i + segment_size], addr)
+                        for i in xrange(0, len(chunk), segment_size)])
+                elif err in timeout_errnos:
+                    self._wait_ready(deadline, True)
+                    continue
+                else:
+                    raise SocketError(err, info)
+            offset += len(chunk)
+        return (len(view) + segment_size - 1) // segment_size
+    
+    def enable_gro(self, enabled = True):
+        """enables (or disables) UDP generic receive offload: consecutive
+        datagrams of a flow may then be received as a single buffer, by 
+        recv_coalesced(). returns False if the kernel doesn't support it 
+        (linux 5.0 and on), in which case each datagram is received on its
+        own"""
+        if _libc.recvmsg is None:
+            return False
+        try:
+            self._sock.setsockopt(_libc.SOL_UDP, _libc.UDP_GRO, int(enabled))
+        except _socket.error:
+            return False
+        return True
+    
+    def recv_coalesced_into(self, buffer, count = 0):
+        """
+        receives a datagram, or (with GRO enabled; see enable_gro) a run of 
+        coalesced datagrams, directly into the given writable buffer (like 
+        recv_into; at most `count` bytes, 0 meaning the whole buffer). 
+        returns a tuple of (number of bytes received, addr, segment_size): 
+        the datagrams are buffer[0:segment_size], 
+        buffer[segment_size:2*segment_size], etc., up to the number of bytes
+        received (the last one may be shorter; see segments()). if the 
+        operation timed out, returns (0, None, 0)
+        """
+        if count:
+            buffer = memoryview(buffer)[:count]
+        if _libc.recvmsg is None:
+            try:
+                n, addr = self._sock.recvfrom_into(buffer)
+            except _socket.timeout:
+                return 0, None, 0
+            except _socket.error, (err, info):
+                if err in timeout_errnos:
+                    return 0, None, 0
+                raise SocketError(err, info)
+            return n, addr, n
+        deadline = self._get_deadline()
+        fd = self._sock.fileno()
+        while True:
+            try:
+                n, ancillary, flags, addr = _libc.recvmsg(fd, buffer, 
+                    _libc.CMSG_SPACE(4), 0, True)
+            except _socket.error, (err, info):
+                if err not in timeout_errnos:
+                    raise SocketError(err, info)
+            else:
+                break
+            try:
+                self._wait_ready(deadline, False)
+            except TimeoutError:
+                return 0, None, 0
+        segment_size = n
+        for level, type, data in ancillary:
+            if level == _libc.SOL_UDP and type == _libc.UDP_GRO:
+                segment_size, = struct.unpack_from("=i", data)
+        return n, addr, segment_size
+    
+    def recv_coalesced(self, count = 65535):
+        """
+        like recv_coalesced_into, but receives into a new bytearray of up to
+        `count` bytes, which is trimmed in place to the received size. 
+        returns a tuple of (data, addr, segment_size). to receive without 
+        allocating at all, pass a reused buffer to recv_coalesced_into
+        """
+        buffer = bytearray(count)
+        n, addr, segment_size = self.recv_coalesced_into(buffer)
+        del buffer[n:]
+        return buffer, addr, segment_size
+    
+    @staticmethod
+    def segments(data, segment_size):
+        """splits the data of recv_coalesced() into its datagrams, as 
+        memoryviews (without copying)"""
+        view = memoryview(data)
+        return [view[i:i + segment_size] 
+            for i in xrange(0, len(view), segment_size)]
+
+
+class IpRawSocket(RawSocket, IpLevelMixin):
+    """
+    raw IP sockets, for the given IP protocol (e.g., consts.IpProtocol.ICMP).
+    received packets include their IP header; sent ones don't, unless 
+    header_included is set (the port of the endpoints is ignored). binding 
+    to `host` limits the packets received to the ones destined to it
+    """
+    __slots__ = []
+    def __init__(self, protocol, host = None, **kw):
+        family = kw.pop("family", consts.AddressFamily.INET)
+        DatagramSocket.__init__(self, family, consts.SocketType.RAW, protocol,
+            None if host is None else (host, 0), **kw)
+
+
+class PacketSocket(RawSocket):
+    """
+    link-level (AF_PACKET) sockets, linux specific. receives the packets of
+    the given ethernet protocol (all of them, by default), on the given 
+    interface (or on all of them). packets include their link-level header,
+    unless `cooked` is set. the endpoints are tuples of (interface, protocol,
+    packet type, hardware type, hardware address).
+    
+    for high packet rates, use rx_ring(), which receives the packets into 
+    memory shared with the kernel, without a system call per packet
+    """
+    __slots__ = []
+    def __init__(self, interface = None, protocol = packet.ETH_P_ALL, 
+            cooked = False):
+        if cooked:
+            type = consts.SocketType.DGRAM
+        else:
+            type = consts.SocketType.RAW
+        DatagramSocket.__init__(self, consts.AddressFamily.PACKET, type, 
+            _socket.htons(protocol))
+        if interface is not None:
+            self.bind((interface, protocol))
+    
+    def rx_ring(self, block_size = 1 << 22, block_count = 64, 
+            frame_size = 2048, retire_timeout = 60):
+        """sets up a TPACKET_V3 receive ring on the socket, and returns it 
+        as a packet.PacketRing. once it's set up, packets are only received
+        through the ring"""
+        return packet.PacketRing(self, block_size, block_count, frame_size,
+            retire_timeout)
+
+
+#
+# unix domain sockets
+#
+class UnixConnectedSocket(ConnectedSocket):
+    """
+    a connected (client) unix domain stream socket. `path` is the listener's
+    path, or an abstract name (starting with a NUL character; linux only).
+    besides data, unix sockets can pass file descriptors (see send_fds)
+    """
+    __slots__ = []
+    def __init__(self, path = None, **kw):
+        ConnectedSocket.__init__(self, consts.AddressFamily.UNIX, 
+            consts.SocketType.STREAM, 0, path, **kw)
+    
+    def send_fds(self, data, fds):
+        """sends the given data (which must not be empty) along with the 
+        given file descriptors: ints, or objects with a fileno() method, like
+        sockets and files. the receiver gets new descriptors of the same open
+        files (see recv_fds) -- e.g., a front process can hand accepted 
+        connections over to its workers this way. the descriptors go with the
+        first byte of the data; the rest is sent like sendall() does. returns
+        the number of bytes sent"""
+        if not self._is_connected:
+            raise NotConnectedError()
+        if _libc.sendmsg is None:
+            raise NotImplementedError("descriptor passing is not supported "
+                "on this platform")
+        if not data:
+            raise ValueError("data must not be empty")
+        fds = [fd if isinstance(fd, (int, long)) else fd.fileno() 
+            for fd in fds]
+        ancillary = [(consts.OptionLevels.SOCKET, _libc.SCM_RIGHTS, 
+            struct.pack("=%di" % (len(fds),), *fds))]
+        deadline = self._get_deadline()
+        while True:
+            try:
+                sent = _libc.sendmsg(self._sock.fileno(), [data], 
+                    ancillary = ancillary)
+            except _socket.error, (errno, info):
+                if errno not in timeout_errnos:
+                    raise SocketError(errno, info)
+                self._wait_ready(deadline, True)
+            else:
+                break
+        if sent < len(data):
+            self.sendall(memoryview(data)[sent:])
+        return len(data)
+    
+    def recv_fds(self, count, max_fds = 16):
+        """receives up to `count` bytes of data, along with up to `max_fds` 
+        file descriptors sent with it. returns a tuple of (data, list of 
+        fds); the fds are set to close-on-exec, and are the caller's to close
+        (see from_fd for wrapping socket fds). if the operation times out, 
+        the data is an empty string (and there are no fds). if more than 
+        `max_fds` descriptors were sent, the message is dropped and 
+        SocketError (EMSGSIZE) is raised"""
+        if not self._is_connected:
+            raise NotConnectedError()
+        if _libc.recvmsg is None:
+            raise NotImplementedError("descriptor passing is not supported "
+                "on this platform")
+        buffer = bytearray(count)
+        deadline = self._get_deadline()
+        while True:
+            try:
+                n, ancillary, flags = _libc.recvmsg(self._sock.fileno(), 
+                    buffer, _libc.CMSG_SPACE(max_fds * 4), 
+                    _libc.MSG_CMSG_CLOEXEC)
+            except _socket.error, (err, info):
+                if err not in timeout_errnos:
+                    raise SocketError(err, info)
+                try:
+                    self._wait_ready(deadline, False)
+                except TimeoutError:
+                    return "", []
+            else:
+                break
+        fds = []
+        for level, type, data in ancillary:
+            if level == consts.OptionLevels.SOCKET and type == _libc.SCM_RIGHTS:
+                fds.extend(struct.unpack("=%di" % (len(data) // 4,), 
+                    data[:len(data) // 4 * 4]))
+        if flags & _libc.MSG_CTRUNC:
+            # the kernel dropped the descriptors that didn't fit (closing 
+            # them); the data has been consumed, but the message is useless
+            # to the caller without all of its descriptors
+            for fd in fds:
+                os.close(fd)
+            raise SocketError(errno.EMSGSIZE, "more file descriptors were "
+                "sent than max_fds (%d); the descriptors were lost" % (max_fds,))
+        if not n and not fds:
+            raise EOFError()
+        return str(buffer[:n]), fds
+
+
+class UnixListenerSocket(ListenerSocket):
+    """
+    a listener (server) unix domain stream socket. note that the socket's
+    file is not removed when the socket is closed (other processes may still
+    be listening on it) -- unlink it when done, or use an abstract name
+    """
+    __slots__ = []
+    connected_class = UnixConnectedSocket
+    
+    def __init__(self, path = None, **kw):
+        ListenerSocket.__init__(self, consts.AddressFamily.UNIX, 
+            consts.SocketType.STREAM, 0, path, **kw)
+
+
+class UnixDatagramSocket(DatagramSocket):
+    """unix domain datagram sockets"""
+    __slots__ = []
+    def __init__(self, path = None, **kw):
+        DatagramSocket.__init__(self, consts.AddressFamily.UNIX, 
+            consts.SocketType.DGRAM, 0, path, **kw)
+
+
+def socketpair():
+    """returns a pair of UnixConnectedSockets, connected to each other"""
+    first, second = _socket.socketpair(consts.AddressFamily.UNIX, 
+        consts.SocketType.STREAM)
+    return (UnixConnectedSocket._accepted(first), 
+        UnixConnectedSocket._accepted(second))
 
 
 
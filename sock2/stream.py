@@ -0,0 +1,191 @@
+"""
+NetworkStream -- buffered, stream-oriented I/O over a ConnectedSocket
+
+ConnectedSocket.recv returns whatever happens to be available, so protocols
+that deal in lines or fixed-size records need a buffering layer on top of it.
+this is that layer (instead of the legacy makefile): reads are served from a
+single read buffer, which is refilled with recv_into and compacted in place
+(so its memory is reused rather than reallocated), and small writes are
+coalesced into a single send.
+
+Notes:
+    * the sock2 rules carry over: a timeout is not an error for read() and
+      peek(), which return an empty string; readexactly(), readuntil() and
+      readline() raise TimeoutError instead, since they cannot return a
+      partial result -- but whatever was received stays buffered, so the
+      call can simply be retried
+    * EOFError is raised once the peer has closed the connection and the
+      buffered data has been consumed
+"""
+from errors import TimeoutError
+
+
+class NetworkStream(object):
+    """
+    a buffered stream over a ConnectedSocket.
+
+    sock - the underlying ConnectedSocket
+    read_size - the initial size of the read buffer (it grows as needed)
+    write_threshold - buffered writes are flushed once they reach this size
+    """
+    def __init__(self, sock, read_size = 65536, write_threshold = 65536):
+        self.sock = sock
+        self.write_threshold = write_threshold
+        self._rbuf = bytearray(read_size)
+        self._start = 0
+        self._end = 0
+        self._wbuf = bytearray()
+
+    def __repr__(self):
+        return "<%s(%r, %d buffered)>" % (self.__class__.__name__, self.sock,
+            self._end - self._start)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, v, tb):
+        self.close()
+
+    def close(self):
+        """flushes any buffered writes and closes the socket"""
+        if not self.sock.closed:
+            try:
+                self.flush()
+            finally:
+                self.sock.close()
+
+    def _get_closed(self):
+        return self.sock.closed
+    closed = property(_get_closed, doc =
+        "indicates whether or not the underlying socket is closed")
+
+    #
+    # reading
+    #
+    def _fill(self):
+        """receives more data into the read buffer; returns the number of
+        bytes received (0 if timed out)"""
+        if self._end == len(self._rbuf):
+            if self._start > 0:
+                # move the unread data to the front
+                remaining = self._end - self._start
+                self._rbuf[:remaining] = self._rbuf[self._start:self._end]
+                self._start = 0
+                self._end = remaining
+            else:
+                # the buffer is full of unread data
+                self._rbuf.extend(bytearray(len(self._rbuf)))
+        n = self.sock.recv_into(memoryview(self._rbuf)[self._end:])
+        self._end += n
+        return n
+
+    def _consume(self, count):
+        data = str(self._rbuf[self._start:self._start + count])
+        self._start += count
+        if self._start == self._end:
+            self._start = self._end = 0
+        return data
+
+    def _get_buffered(self):
+        return self._end - self._start
+    buffered = property(_get_buffered, doc =
+        "the number of bytes received but not read yet")
+
+    def read(self, count):
+        """reads up to `count` bytes: the buffered data if there is any,
+        otherwise the result of a single receive. returns an empty string if
+        the operation timed out"""
+        if self._start == self._end:
+            if count >= len(self._rbuf):
+                # no point in going through the buffer
+                return self.sock.recv(count)
+            self._fill()
+        return self._consume(min(count, self._end - self._start))
+
+    def readexactly(self, count):
+        """reads exactly `count` bytes, raising TimeoutError if they don't
+        all arrive in time"""
+        while self._end - self._start < count:
+            if not self._fill():
+                raise TimeoutError()
+        return self._consume(count)
+
+    def readuntil(self, delimiter, limit = 65536):
+        """reads up to and including the given delimiter, raising
+        TimeoutError if it doesn't arrive in time, and ValueError if it's not
+        found within the first `limit` bytes"""
+        searched = self._start
+        while True:
+            index = self._rbuf.find(delimiter, searched, self._end)
+            if index >= 0:
+                return self._consume(index + len(delimiter) - self._start)
+            if self._end - self._start >= limit:
+                raise ValueError("delimiter not found within limit", limit)
+            # the delimiter may straddle what's buffered and what's to come
+            searched = max(self._end - len(delimiter) + 1, self._start)
+            searched -= self._start
+            if not self._fill():
+                raise TimeoutError()
+            searched += self._start
+
+    def readline(self, limit = 65536):
+        """reads a line (including the trailing newline); see readuntil"""
+        return self.readuntil("\n", limit)
+
+    def peek(self, count):
+        """returns up to `count` bytes without consuming them: the buffered
+        data if there is any, otherwise the result of a single receive"""
+        if self._start == self._end:
+            self._fill()
+        return str(self._rbuf[self._start:min(self._start + count, self._end)])
+
+    #
+    # writing
+    #
+    def write(self, data):
+        """buffers the given data, flushing once write_threshold is reached.
+        large writes go out directly (after what's buffered), without being
+        copied into the buffer. if the operation times out, whatever wasn't
+        sent remains buffered, for a later flush()"""
+        if len(self._wbuf) + len(data) < self.write_threshold:
+            self._wbuf += data
+            return
+        deadline = self.sock._get_deadline()
+        try:
+            self._send_buffered(deadline)
+        except TimeoutError:
+            self._wbuf += data
+            raise
+        view = memoryview(data)
+        sent = 0
+        try:
+            while sent < len(view):
+                sent += self._send_some(view[sent:], deadline)
+        except TimeoutError:
+            self._wbuf += view[sent:]
+            # don't leave the view around (the traceback keeps this frame)
+            del view
+            raise
+
+    def _send_some(self, data, deadline):
+        # a single send, waiting for the socket to become writable if
+        # nothing could be sent (or raising TimeoutError past the deadline)
+        try:
+            n = self.sock.send(data)
+        except TimeoutError:
+            n = 0
+        if not n:
+            self.sock._wait_ready(deadline, True)
+        return n
+
+    def _send_buffered(self, deadline):
+        # the buffer is trimmed after each send, so that if the operation
+        # times out, only what wasn't sent remains
+        while self._wbuf:
+            n = self._send_some(self._wbuf, deadline)
+            del self._wbuf[:n]
+
+    def flush(self):
+        """sends all the buffered data. if the operation times out, whatever
+        wasn't sent remains buffered, so flush() can simply be retried"""
+        self._send_buffered(self.sock._get_deadline())
@@ -0,0 +1,161 @@
+"""
+TCP_INFO -- decoded TCP connection metrics (linux specific)
+
+Linux exposes a connection's internal state -- round-trip times, congestion
+window, retransmissions, delivery rate, etc. -- through the TCP_INFO socket
+option, as a `struct tcp_info`. this module decodes it into a TcpInfo
+object (see the tcp_info property of TCP sockets), and provides a sampler
+that polls many sockets and records the metrics as time series.
+
+Notes:
+    * times (rtt, rto, etc.) are in microseconds, rates in bytes per second
+    * older kernels return a shorter struct; the missing fields are zero
+"""
+import time
+import array
+import struct
+
+
+# the fields of struct tcp_info (linux/tcp.h), in order. the two bytes of
+# bitfields are split into their components after unpacking
+_fields = (
+    # u8
+    "state", "ca_state", "retransmits", "probes", "backoff", "options",
+    "_wscale", "_app_limited",
+    # u32
+    "rto", "ato", "snd_mss", "rcv_mss",
+    "unacked", "sacked", "lost", "retrans", "fackets",
+    "last_data_sent", "last_ack_sent", "last_data_recv", "last_ack_recv",
+    "pmtu", "rcv_ssthresh", "rtt", "rttvar", "snd_ssthresh", "snd_cwnd",
+    "advmss", "reordering",
+    "rcv_rtt", "rcv_space",
+    "total_retrans",
+    # u64
+    "pacing_rate", "max_pacing_rate", "bytes_acked", "bytes_received",
+    # u32
+    "segs_out", "segs_in",
+    "notsent_bytes", "min_rtt", "data_segs_in", "data_segs_out",
+    # u64
+    "delivery_rate",
+    "busy_time", "rwnd_limited", "sndbuf_limited",
+    # u32
+    "delivered", "delivered_ce",
+    # u64
+    "bytes_sent", "bytes_retrans",
+    # u32
+    "dsack_dups", "reord_seen",
+    "rcv_ooopack", "snd_wnd",
+)
+
+_public_fields = tuple(name for name in _fields if not name.startswith("_"))
+
+tcp_info_struct = struct.Struct("=8B24I4Q6IQ3Q2I2Q4I")
+_padding = "\x00" * tcp_info_struct.size
+
+def unpack_tcp_info(raw):
+    """unpacks a raw struct tcp_info (possibly a short one, as returned by
+    older kernels) into a tuple of values, ordered like _fields"""
+    if len(raw) < tcp_info_struct.size:
+        raw += _padding[len(raw):]
+    return tcp_info_struct.unpack_from(raw)
+
+
+class TcpInfo(object):
+    """
+    the decoded TCP_INFO of a connection. the attributes are named after the
+    fields of linux's struct tcp_info, without the tcpi_ prefix; e.g., rtt
+    and rttvar (microseconds), snd_cwnd (segments), retransmits, unacked,
+    bytes_acked, delivery_rate (bytes per second), and so on.
+    """
+    __slots__ = _public_fields + ("snd_wscale", "rcv_wscale", 
+        "delivery_rate_app_limited")
+
+    def __init__(self, raw):
+        values = unpack_tcp_info(raw)
+        for name, value in zip(_fields, values):
+            if not name.startswith("_"):
+                setattr(self, name, value)
+        wscale = values[6]
+        self.snd_wscale = wscale & 0x0f
+        self.rcv_wscale = wscale >> 4
+        self.delivery_rate_app_limited = bool(values[7] & 1)
+
+    def __repr__(self):
+        return "<%s(rtt = %d us, snd_cwnd = %d, retransmits = %d)>" % (
+            self.__class__.__name__, self.rtt, self.snd_cwnd,
+            self.retransmits)
+
+    def as_dict(self):
+        """returns the fields as a dict"""
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+#
+# sampling
+#
+default_sampled_fields = ("rtt", "rttvar", "snd_cwnd", "retransmits",
+    "unacked", "bytes_acked", "delivery_rate")
+
+class TcpInfoSampler(object):
+    """
+    polls the TCP_INFO of many sockets, and records the chosen fields as
+    time series, stored in arrays (of doubles) rather than lists of objects.
+
+    fields - the names of the TcpInfo fields to record
+    maxlen - the max number of samples kept per socket (None is unbounded);
+             the oldest samples are discarded first
+
+    sample() polls all the sockets once; it's cheap, as it unpacks the raw
+    struct directly, without creating TcpInfo objects. sockets that have
+    been closed are dropped (along with their series) by the next sample().
+    """
+    def __init__(self, fields = default_sampled_fields, maxlen = None):
+        unknown = [name for name in fields if name not in _fields]
+        if unknown:
+            raise ValueError("unknown fields", unknown)
+        self.fields = tuple(fields)
+        self.maxlen = maxlen
+        self._indexes = [_fields.index(name) for name in fields]
+        self._series = {}
+
+    def __repr__(self):
+        return "<%s(%d sockets)>" % (self.__class__.__name__,
+            len(self._series))
+
+    def __len__(self):
+        return len(self._series)
+
+    def add(self, sock):
+        """starts sampling the given TCP socket"""
+        if sock not in self._series:
+            self._series[sock] = dict((name, array.array("d"))
+                for name in ("time",) + self.fields)
+
+    def remove(self, sock):
+        """stops sampling the given socket, and discards its series"""
+        self._series.pop(sock, None)
+
+    def sample(self):
+        """polls all the sockets once, appending a sample to each series"""
+        now = time.time()
+        for sock, series in self._series.items():
+            try:
+                raw = sock._tcp_info
+            except IOError:
+                # closed, or no longer a valid connection
+                del self._series[sock]
+                continue
+            values = unpack_tcp_info(raw)
+            series["time"].append(now)
+            for name, index in zip(self.fields, self._indexes):
+                series[name].append(values[index])
+            if self.maxlen is not None and len(series["time"]) > self.maxlen:
+                # trim in bulk, to amortize the cost
+                excess = len(series["time"]) - self.maxlen // 2
+                for arr in series.itervalues():
+                    del arr[:excess]
+
+    def series(self, sock, field):
+        """returns the array of recorded values of the given field (or of
+        the sampling times, if field is "time") for the given socket"""
+        return self._series[sock][field]
@@ -0,0 +1,228 @@
+"""
+ZeroCopy -- MSG_ZEROCOPY sends, with completion tracking (linux specific)
+
+A regular send copies the data into the kernel, which for multi-megabyte
+sends is where most of the CPU goes. with MSG_ZEROCOPY, the kernel sends
+straight out of the caller's buffer instead -- which means the buffer must
+not be modified until the kernel is done with it. the kernel reports that
+through the socket's error queue; a ZeroCopySender reads these reports and
+tells the caller which buffers may be reused, either through a callback or
+through completions(), which can be polled.
+
+Example:
+    sender = ZeroCopySender(sock, on_complete = pool.release)
+    sender.send(pool.acquire_filled())
+    ...
+    sender.wait()
+
+Notes:
+    * zerocopy only pays off for large sends (the kernel pins the pages and
+      queues a notification for every call); sends below `threshold` bytes
+      are copied as usual, and are reported as complete right away
+    * where zerocopy isn't supported (old kernels, other platforms), all
+      sends are copied, so the sender can be used unconditionally
+    * the kernel numbers the zerocopy sends of a socket from its first one,
+      so a socket must only be sent over by a single ZeroCopySender
+    * the kernel may still copy (e.g., over the loopback interface); such
+      completions are counted in `copied`. if most sends end up copied,
+      zerocopy only adds overhead, and should be disabled
+"""
+import time
+import errno
+import select
+import struct
+import _socket
+import _libc
+import consts
+from errors import SocketError, NotConnectedError, timeout_errnos
+
+
+SO_ZEROCOPY = getattr(consts.SocketLevelOptions, "ZEROCOPY", None)
+MSG_ZEROCOPY = getattr(consts.RecvFlags, "ZEROCOPY", 0)
+MSG_ERRQUEUE = getattr(consts.RecvFlags, "ERRQUEUE", 0)
+MSG_DONTWAIT = getattr(consts.RecvFlags, "DONTWAIT", 0)
+# the (level, type) pairs of the kernel's notifications
+_RECVERR_TYPES = (
+    (consts.IpProtocol.IP, getattr(consts.IpLevelOptions, "RECVERR", None)),
+    (consts.IpProtocol.IPV6, getattr(consts.Ipv6LevelOptions, "RECVERR", None)),
+)
+
+# linux/errqueue.h
+SO_EE_ORIGIN_ZEROCOPY = 5
+SO_EE_CODE_ZEROCOPY_COPIED = 1
+
+# struct sock_extended_err: ee_errno, ee_origin, ee_type, ee_code, ee_pad,
+# ee_info, ee_data
+sock_extended_err = struct.Struct("=I4B2I")
+
+# the size below which sends are copied. this follows the kernel's own
+# guidance (Documentation/networking/msg_zerocopy.rst), which benchmarks
+# (see benchmarks/zerocopy.py) bear out: the page pinning and notification
+# costs outweigh the saved copy for writes under about 10KB
+DEFAULT_THRESHOLD = 10 * 1024
+
+
+class ZeroCopySender(object):
+    """
+    sends buffers over a connected (TCP) socket with MSG_ZEROCOPY.
+
+    sock - the ConnectedSocket to send over
+    threshold - sends smaller than this (in bytes) are copied
+    on_complete - called with each buffer's token (see send()) once the
+                  buffer may be reused; if None, the tokens are queued for
+                  completions() instead
+    """
+    def __init__(self, sock, threshold = DEFAULT_THRESHOLD,
+            on_complete = None):
+        self.sock = sock
+        self.threshold = threshold
+        self.on_complete = on_complete
+        self.copied = 0
+        self.enabled = _libc.recvmsg is not None and SO_ZEROCOPY is not None
+        if self.enabled:
+            try:
+                sock._sock.setsockopt(_socket.SOL_SOCKET, SO_ZEROCOPY, 1)
+            except _socket.error:
+                self.enabled = False
+        # the kernel numbers the zerocopy calls, from 0
+        self._next_call = 0
+        # call number -> [token, number of its calls in flight] (tokens may
+        # be unhashable, e.g., bytearrays)
+        self._calls = {}
+        self._pending = 0
+        self._completed = []
+        self._poller = select.poll()
+        self._poller.register(sock.fileno(), select.POLLERR)
+
+    def __repr__(self):
+        return "<%s(%s, %d in flight)>" % (self.__class__.__name__,
+            "enabled" if self.enabled else "disabled", self._pending)
+
+    def _get_pending(self):
+        return self._pending
+    pending = property(_get_pending, doc =
+        "the number of buffers the kernel has yet to release")
+
+    def _complete(self, token):
+        if self.on_complete is None:
+            self._completed.append(token)
+        else:
+            self.on_complete(token)
+
+    def send(self, buffer, token = None):
+        """sends all of the given buffer, like sendall(). unless it's copied
+        (small sends, or where zerocopy isn't supported), the buffer must not
+        be modified until its token (the buffer itself, if None) has been
+        reported complete. returns True if the buffer was sent with zerocopy,
+        and False if it was copied (and is reported complete already)"""
+        if token is None:
+            token = buffer
+        view = memoryview(buffer)
+        if not self.enabled or len(view) < self.threshold:
+            self.sock.sendall(view)
+            self._complete(token)
+            return False
+        sock = self.sock
+        if not sock._is_connected:
+            raise NotConnectedError()
+        deadline = sock._get_deadline()
+        sent = 0
+        calls = 0
+        entry = [token, 0]
+        while sent < len(view):
+            try:
+                n = sock._sock.send(view[sent:], MSG_ZEROCOPY)
+            except _socket.timeout:
+                n = 0
+            except _socket.error, (err, info):
+                if err == errno.ENOBUFS:
+                    # too many notifications outstanding: reap what's there
+                    # and send the rest the regular way
+                    self.poll_completions()
+                    sock.sendall(view[sent:])
+                    break
+                if err not in timeout_errnos:
+                    raise SocketError(err, info)
+                n = 0
+            if n > 0:
+                sent += n
+                if not calls:
+                    # the buffer is in flight from its first call on, even
+                    # if the rest of the send times out or fails
+                    self._pending += 1
+                self._calls[self._next_call] = entry
+                self._next_call = (self._next_call + 1) & 0xffffffff
+                entry[1] += 1
+                calls += 1
+            else:
+                sock._wait_ready(deadline, True)
+        if not calls:
+            self._complete(token)
+        return calls > 0
+
+    def poll_completions(self):
+        """reads the notifications the kernel has queued (without waiting),
+        and reports the buffers that are done with; returns the number of
+        buffers reported"""
+        if not self._calls:
+            return 0
+        fd = self.sock.fileno()
+        scratch = bytearray(1)
+        reported = 0
+        while True:
+            try:
+                n, ancillary, flags = _libc.recvmsg(fd, scratch, 128,
+                    MSG_ERRQUEUE | MSG_DONTWAIT)
+            except _socket.error, (err, info):
+                if err in timeout_errnos:
+                    break
+                raise SocketError(err, info)
+            for level, type, data in ancillary:
+                if (level, type) not in _RECVERR_TYPES:
+                    continue
+                (ee_errno, origin, ee_type, code, pad, first,
+                    last) = sock_extended_err.unpack_from(data)
+                if origin != SO_EE_ORIGIN_ZEROCOPY:
+                    continue
+                count = ((last - first) & 0xffffffff) + 1
+                if code & SO_EE_CODE_ZEROCOPY_COPIED:
+                    self.copied += count
+                for i in xrange(count):
+                    entry = self._calls.pop((first + i) & 0xffffffff, None)
+                    if entry is None:
+                        continue
+                    entry[1] -= 1
+                    if not entry[1]:
+                        self._pending -= 1
+                        self._complete(entry[0])
+                        reported += 1
+        return reported
+
+    def completions(self):
+        """returns (and forgets) the tokens of the buffers that may be
+        reused, since the last call. used when there's no on_complete
+        callback"""
+        self.poll_completions()
+        completed = self._completed
+        self._completed = []
+        return completed
+
+    def wait(self, timeout = None):
+        """waits up to `timeout` seconds (None means forever) for all the
+        buffers in flight to be released; returns True if they all were"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            self.poll_completions()
+            if not self._pending:
+                return True
+            if deadline is None:
+                wait = -1
+            else:
+                wait = (deadline - time.time()) * 1000
+                if wait <= 0:
+                    return False
+            try:
+                self._poller.poll(wait)
+            except select.error, ex:
+                if ex.args[0] != errno.EINTR:
+                    raise
@@ -0,0 +1,71 @@
+import sys
+try:
+    import trollius
+    from trollius import From, Return
+except ImportError:
+    print "trollius is not installed; skipping"
+    sys.exit(0)
+import sock2
+from sock2 import aio
+
+
+listener = sock2.TcpListener("127.0.0.1", 0)
+loop = trollius.new_event_loop()
+trollius.set_event_loop(loop)
+
+@trollius.coroutine
+def server():
+    conn = yield From(aio.accept(listener))
+    data = yield From(aio.recv(conn, 100))
+    yield From(aio.sendall(conn, data * 100000))
+    conn.close()
+
+@trollius.coroutine
+def client():
+    sock = sock2.TcpSocket()
+    yield From(aio.connect(sock, listener.local_endpoint))
+    yield From(aio.sendall(sock, "ping"))
+    received = []
+    while True:
+        try:
+            received.append((yield From(aio.recv(sock, 65536))))
+        except EOFError:
+            break
+    sock.close()
+    raise Return("".join(received))
+
+task = trollius.async(server())
+result = loop.run_until_complete(client())
+loop.run_until_complete(task)
+assert result == "ping" * 100000
+
+# datagrams
+u1 = sock2.UdpSocket("127.0.0.1", 0)
+u2 = sock2.UdpSocket("127.0.0.1", 0)
+
+@trollius.coroutine
+def datagrams():
+    receiving = aio.recv(u1, 100)
+    yield From(aio.send(u2, "dgram", u1.local_endpoint))
+    data, addr = yield From(receiving)
+    raise Return((data, addr))
+
+assert loop.run_until_complete(datagrams()) == ("dgram", u2.local_endpoint)
+
+# connection failures
+@trollius.coroutine
+def refused():
+    port = sock2.TcpListener("127.0.0.1", 0)
+    endpoint = port.local_endpoint
+    port.close()
+    try:
+        yield From(aio.connect(sock2.TcpSocket(), endpoint))
+    except sock2.ConnectError:
+        raise Return(True)
+    raise Return(False)
+
+assert loop.run_until_complete(refused())
+
+for sock in (u1, u2, listener):
+    sock.close()
+loop.close()
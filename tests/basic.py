@@ -1,8 +1,11 @@
+import sys
+import errno
 import sock2
 
 s1 = sock2.TcpListener("localhost", 11223)
 s2 = sock2.TcpSocket("localhost", 11223)
 s3 = s1.accept()
+assert not hasattr(s3, "__dict__") and s3.remote_endpoint == s2.local_endpoint
 
 s2.send("hello")
 assert s3.recv(100) == "hello"
@@ -10,7 +13,183 @@ assert s3.recv(100) == "hello"
 s3.send("world")
 assert s2.recv(100) == "world"
 
+buf = bytearray(10)
+s2.send("zero-copy")
+assert s3.recv_exact_into(buf, 9) == 9
+assert buf[:9] == "zero-copy"
 
+pool = sock2.BufferPool(16, 2)
+s3.send("pooled")
+chunk, n = pool.recv(s2)
+assert chunk[:n].tobytes() == "pooled"
+pool.release(chunk)
+assert len(pool) == 2
 
+s2.sendall("x" * 100000)
+buf = bytearray(100000)
+assert s3.recv_exact_into(buf) == 100000
+s2.sendv(["header:", buffer("--payload--", 2, 7), bytearray("!"), memoryview("ab")[1:]])
+assert s3.recv(100) == "header:payload!b"
 
+u1 = sock2.UdpSocket("localhost", 0)
+u2 = sock2.UdpSocket("localhost", 0)
+assert not hasattr(u2, "__dict__")
+u2.sendv(["dgram", "-", "parts"], u1.local_endpoint)
+assert u1.recv(100)[0] == "dgram-parts"
 
+u2.send_many([("one", u1.local_endpoint), ("two", u1.local_endpoint), 
+    (bytearray("three"), u1.local_endpoint)])
+batch = u1.recv_many(8, 64)
+assert [data.tobytes() for data, addr in batch] == ["one", "two", "three"]
+assert batch.address(0) == u2.local_endpoint
+# the message headers are reused across calls; the peers must still change
+u3 = sock2.UdpSocket("localhost", 0)
+for first, second in [(u1, u3), (u3, u1)]:
+    u2.send_many([("a", first.local_endpoint), ("b", second.local_endpoint),
+        (memoryview("c"), first.local_endpoint)])
+    assert [data.tobytes() for data, addr in first.recv_many(8, 64)] == \
+        ["a", "c"]
+    assert second.recv(100) == ("b", u2.local_endpoint)
+u3.close()
+u1.timeout = 0
+assert len(u1.recv_many(batch = batch)) == 0
+assert u1.try_recv(100) is None
+u2.send("now", u1.local_endpoint)
+sock2.socket._poll(u1.fileno(), False, 1)
+assert u1.try_recv(100) == ("now", u2.local_endpoint)
+
+assert s3.try_recv(100) is None
+s2.send("ready")
+sock2.socket._poll(s3.fileno(), False, 1)
+assert s3.try_recv(100) == "ready"
+
+# even if the data is gone by the time of the recv (e.g., taken by another
+# reader), try_recv doesn't block
+readable_now = sock2.socket._readable_now
+sock2.socket._readable_now = lambda fd: True
+u1.timeout = s3.timeout = None
+assert u1.try_recv(100) is None
+assert s3.try_recv(100) is None
+sock2.socket._readable_now = readable_now
+
+clients = [sock2.TcpSocket("localhost", 11223) for i in range(3)]
+conns = s1.accept_many()
+assert len(conns) == 3 and not conns[0].blocking
+s1.timeout = 0
+assert s1.accept_many() == []
+
+profile = sock2.OptionProfile("test", no_delay = True, linger = 5, 
+    send_buffer_size = 65536)
+s1.accept_profile = profile
+s1.timeout = None
+client = sock2.TcpSocket("localhost", 11223)
+conn = s1.accept()
+assert conn.no_delay and conn.linger == 5
+s3.linger = None
+assert s3.linger is None
+
+# newer options, numbered by sock2 where _socket doesn't know them
+if sys.platform.startswith("linux"):
+    conn.user_timeout = 2.5
+    assert conn.user_timeout == 2.5
+    conn.notsent_low_water = 32768
+    assert conn.notsent_low_water == 32768
+    conn.congestion_control = "reno"
+    assert conn.congestion_control == "reno"
+    assert conn.max_pacing_rate is None
+    conn.max_pacing_rate = 1000000
+    assert conn.max_pacing_rate == 1000000
+    conn.zero_copy = True
+    assert conn.zero_copy
+    assert conn.incoming_cpu >= -1
+    sock2.low_latency_profile.apply(conn)
+    assert conn.no_delay and conn.notsent_low_water == 16384
+    sock2.bulk_throughput_profile.apply(client)
+    assert not client.no_delay
+
+# sendfile and splice
+import tempfile
+listener = sock2.TcpListener("localhost", 0)
+a = sock2.TcpSocket(*listener.local_endpoint)
+b = listener.accept()
+c = sock2.TcpSocket(*listener.local_endpoint)
+d = listener.accept()
+f = tempfile.TemporaryFile()
+f.write("0123456789" * 10000)
+f.flush()
+assert a.send_file(f, 10, 50000) == 50000
+assert b.splice_to(c, 50000) == 50000
+buf = bytearray(50000)
+assert d.recv_exact_into(buf) == 50000
+assert buf == "0123456789" * 5000
+for sock in [a, c, b, d, listener]:
+    sock.close()
+
+# segmented udp sends (GSO) and coalesced receives (GRO), with and without
+# offload support
+payload = "".join(chr(65 + i % 26) * 1000 for i in range(25)) + "tail"
+for gso in (None, False):
+    sock2.socket._udp_gso = gso
+    u1 = sock2.UdpSocket("localhost", 0)
+    u2 = sock2.UdpSocket("localhost", 0)
+    u1.timeout = 1
+    assert u2.send_segmented(payload, 1000, u1.local_endpoint) == 26
+    batch = u1.recv_many(64, 2048)
+    while len(batch) < 26:
+        more = u1.recv_many(64, 2048)
+        assert len(more)
+        batch = list(batch) + list(more)
+    assert [data.tobytes() for data, addr in batch] == \
+        [payload[i:i + 1000] for i in range(0, len(payload), 1000)]
+    u1.enable_gro()
+    u2.send_segmented(payload, 1000, u1.local_endpoint)
+    received = ""
+    while len(received) < len(payload):
+        data, addr, segment_size = u1.recv_coalesced()
+        assert addr == u2.local_endpoint
+        assert segment_size == min(1000, len(data))
+        assert all(len(seg) <= 1000
+            for seg in sock2.UdpSocket.segments(data, segment_size))
+        received += data
+    assert received == payload
+    assert u1.recv_coalesced() == ("", None, 0)
+    # into a reused buffer
+    buffer = bytearray(65535)
+    u2.send_segmented(payload[:5000], 1000, u1.local_endpoint)
+    received = ""
+    while len(received) < 5000:
+        n, addr, segment_size = u1.recv_coalesced_into(buffer)
+        assert n and addr == u2.local_endpoint
+        received += buffer[:n]
+    assert received == payload[:5000]
+    assert u1.recv_coalesced_into(buffer) == (0, None, 0)
+    u1.close()
+    u2.close()
+sock2.socket._udp_gso = None
+
+# segmented sends that the kernel rejects (e.g., segments larger than the
+# path's MTU) fall back to sending the datagrams one by one
+def rejecting_sendmsg(*args):
+    raise sock2.socket._socket.error(errno.EINVAL, "Invalid argument")
+real_sendmsg = sock2._libc.sendmsg
+sock2._libc.sendmsg = rejecting_sendmsg
+u1 = sock2.UdpSocket("localhost", 0)
+u2 = sock2.UdpSocket("localhost", 0)
+if u2._has_gso():
+    assert u2.send_segmented(payload[:3000], 1000, u1.local_endpoint) == 3
+    assert [data.tobytes() for data, addr in u1.recv_many(8, 2048)] == \
+        [payload[:1000], payload[1000:2000], payload[2000:3000]]
+sock2._libc.sendmsg = real_sendmsg
+for size in (0, 65536):
+    try:
+        u2.send_segmented(payload, size, u1.local_endpoint)
+    except ValueError:
+        pass
+    else:
+        assert False
+u1.close()
+u2.close()
+
+# close the clients first, so the listener's port isn't left in TIME_WAIT
+for sock in [s2, client] + clients + [s3, conn] + conns + [s1]:
+    sock.close()
@@ -0,0 +1,34 @@
+import sock2
+from sock2.framing import (FrameReader, send_frames, LengthPrefixCodec, 
+    VarintCodec, DelimiterCodec)
+
+
+listener = sock2.TcpListener("localhost", 0)
+client = sock2.TcpSocket(*listener.local_endpoint)
+server = listener.accept()
+
+frames = ["", "a", "bb" * 100, "c" * 1000]
+for codec in [LengthPrefixCodec(2), LengthPrefixCodec(4, "little"), 
+        LengthPrefixCodec(8), VarintCodec(), DelimiterCodec("\r\n")]:
+    reader = FrameReader(server, codec, 64)
+    if isinstance(codec, DelimiterCodec):
+        sent = frames[1:]
+    else:
+        sent = frames
+    send_frames(client, sent, codec)
+    received = []
+    while len(received) < len(sent):
+        received.extend(frame.tobytes() for frame in reader.read_frames())
+    assert received == sent, codec
+
+codec = LengthPrefixCodec(2, max_frame_size = 10)
+send_frames(client, ["x" * 5], LengthPrefixCodec(2))
+client.sendall("\x00\x20")
+reader = FrameReader(server, codec)
+assert reader.read_frame().tobytes() == "x" * 5
+try:
+    reader.read_frame()
+except sock2.FramingError:
+    pass
+else:
+    assert False
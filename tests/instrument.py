@@ -0,0 +1,66 @@
+import gc
+import time
+import threading
+import sock2
+from sock2 import instrument
+from sock2.socket import ConnectedSocket
+
+
+original_recv = ConnectedSocket.__dict__["recv"]
+instrument.enable()
+assert ConnectedSocket.__dict__["recv"] is not original_recv
+
+listener = sock2.TcpListener("localhost", 0)
+client = sock2.TcpSocket(*listener.local_endpoint)
+server = listener.accept()
+client.sendall("hello")
+client.sendv(["wor", "ld"])
+assert server.recv(100) == "helloworld"
+server.timeout = 0
+assert server.recv(100) == ""
+client.close()
+try:
+    server.recv(100)
+except EOFError:
+    pass
+
+stats = instrument.registry.get(server)
+assert stats.bytes_received == 10 and stats.recvs == 2
+assert stats.timeouts == 1 and stats.eofs == 1
+assert stats.latency["recv"].count == 3
+assert instrument.registry.get(listener).accepts == 1
+client_stats = instrument.registry.get(client)
+assert client_stats.bytes_sent == 10 and client_stats.sends == 2
+
+# the stats of collected sockets are folded into the totals
+del client, client_stats
+gc.collect()
+totals = instrument.registry.snapshot()["totals"]
+assert totals["bytes_sent"] == 10 and totals["bytes_received"] == 10
+assert totals["latency"]["send"]["count"] == 2
+
+# a thread blocked in recv doesn't hide the sends of other threads on the
+# same socket
+a = sock2.TcpSocket(*listener.local_endpoint)
+b = listener.accept()
+reader = threading.Thread(target = a.recv, args = (100,))
+reader.start()
+time.sleep(0.1)
+for i in range(100):
+    a.send("x")
+assert instrument.registry.get(a).sends == 100
+b.sendall("y")
+reader.join()
+assert instrument.registry.get(a).recvs == 1
+a.close()
+b.close()
+
+# closed sockets share a repr, but each keeps its own entry in the snapshot
+sockets = instrument.registry.snapshot()["sockets"]
+assert sockets[id(a)]["sends"] == 100 and sockets[id(b)]["sends"] == 1
+assert sockets[id(a)]["socket"] == sockets[id(b)]["socket"] == repr(a)
+
+instrument.disable()
+assert ConnectedSocket.__dict__["recv"] is original_recv
+server.close()
+listener.close()
@@ -0,0 +1,44 @@
+import os
+import sys
+import sock2
+from sock2 import consts
+
+
+if os.geteuid() != 0:
+    # raw sockets require root privileges
+    sys.exit(0)
+
+sock = sock2.PacketSocket("lo")
+ring = sock.rx_ring(block_size = 1 << 16, block_count = 4,
+    retire_timeout = 10)
+raw = sock2.IpRawSocket(consts.IpProtocol.UDP, "127.0.0.1")
+
+u1 = sock2.UdpSocket("127.0.0.1", 0)
+u2 = sock2.UdpSocket("127.0.0.1", 0)
+for i in range(10):
+    u2.send("sampled-%d" % (i,), u1.local_endpoint)
+
+# on the loopback interface, each packet is seen twice: outgoing and incoming
+seen = []
+while len(seen) < 20:
+    block = ring.next_block(timeout = 5)
+    assert block is not None
+    with block:
+        for timestamp, length, frame in block.packets():
+            data = frame.tobytes()
+            if "sampled-" in data:
+                assert len(data) == length
+                seen.append(data[data.index("sampled-"):])
+assert seen == ["sampled-%d" % (i // 2,) for i in range(20)]
+packets, drops, freezes = ring.stats()
+assert packets >= 20
+
+# the raw IP socket gets the same datagrams, with their IP header
+raw.timeout = 5
+data, addr = raw.recv(1000)
+assert addr[0] == "127.0.0.1" and data.endswith("sampled-0")
+assert ord(data[0]) >> 4 == 4
+
+ring.close()
+for s in (sock, raw, u1, u2):
+    s.close()
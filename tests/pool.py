@@ -0,0 +1,105 @@
+import time
+import threading
+import sock2
+from sock2.pool import ConnectionPool
+
+
+listener = sock2.TcpListener("localhost", 0)
+host, port = listener.local_endpoint
+pool = ConnectionPool(max_per_host = 2, idle_timeout = 0.5,
+    profile = sock2.OptionProfile("rpc", no_delay = True))
+
+# LIFO reuse
+with pool.connection(host, port) as c1:
+    assert c1.no_delay
+    s1 = listener.accept()
+c2 = pool.checkout(host, port)
+assert c2 is c1
+s2 = s1
+
+# the per-host limit
+c3 = pool.checkout(host, port)
+s3 = listener.accept()
+try:
+    pool.checkout(host, port, timeout = 0.1)
+except sock2.TimeoutError:
+    pass
+else:
+    assert False
+
+# a connection closed by the peer is not reused
+pool.checkin(c2)
+pool.checkin(c3)
+s3.close()
+time.sleep(0.1)
+c4 = pool.checkout(host, port)
+assert c4 is c2
+pool.checkin(c4)
+assert pool.stats()["dead"] == 1
+
+# idle connections expire
+time.sleep(0.6)
+assert pool.evict_idle() == 1
+stats = pool.stats()
+assert stats["idle"] == 0 and stats["checked_out"] == 0
+assert stats["created"] == 2 and stats["reused"] == 2
+
+# errors discard the connection
+try:
+    with pool.connection(host, port) as c5:
+        raise ValueError()
+except ValueError:
+    pass
+assert c5.closed and pool.stats()["discarded"] == 1
+
+# a checkin wakes the waiters of its own endpoint, even when others wait
+# on other endpoints
+listener2 = sock2.TcpListener("localhost", 0)
+pool2 = ConnectionPool(max_per_host = 1)
+ca = pool2.checkout(host, port)
+cb = pool2.checkout(*listener2.local_endpoint)
+got = {}
+def waiter(name, endpoint):
+    got[name] = pool2.checkout(*endpoint, timeout = 5)
+wb = threading.Thread(target = waiter, args = ("b", listener2.local_endpoint))
+wb.start()
+time.sleep(0.1)
+wa = threading.Thread(target = waiter, args = ("a", (host, port)))
+wa.start()
+time.sleep(0.1)
+t0 = time.time()
+pool2.checkin(ca)
+wa.join(5)
+assert got["a"] is ca and time.time() - t0 < 1
+pool2.checkin(cb)
+wb.join(5)
+assert got["b"] is cb
+
+# closing the pool fails the waiting (and later) checkouts, and closes the
+# connections checked in afterwards
+failed = []
+def closed_waiter():
+    try:
+        pool2.checkout(host, port)
+    except sock2.SocketClosed:
+        failed.append(True)
+wc = threading.Thread(target = closed_waiter)
+wc.start()
+time.sleep(0.1)
+pool2.close()
+wc.join(5)
+assert failed == [True]
+try:
+    pool2.checkout(*listener2.local_endpoint)
+except sock2.SocketClosed:
+    pass
+else:
+    assert False
+pool2.checkin(ca)
+assert ca.closed and pool2.stats()["idle"] == 0
+pool2.checkin(cb)
+
+pool.close()
+s1.close()
+listener.close()
+listener2.close()
@@ -0,0 +1,43 @@
+import threading
+import sock2
+from sock2.reactor import Reactor
+
+
+reactor = Reactor()
+listener = sock2.TcpListener("localhost", 0)
+received = []
+
+def on_data(conn):
+    data = conn.recv(100)
+    if data:
+        received.append(data)
+        conn.send(data.upper())
+    if "".join(received) == "pingpong":
+        reactor.unregister(conn)
+        reactor.unregister(listener)
+
+def on_accept(conn):
+    reactor.register(conn, on_data)
+
+reactor.register_listener(listener, on_accept)
+
+client = sock2.TcpSocket(*listener.local_endpoint)
+client.send("ping")
+reactor.call_later(0.05, client.send, "pong")
+fired = []
+reactor.call_later(10, fired.append, 1).cancel()
+reactor.run()
+
+assert received == ["ping", "pong"]
+assert client.recv(100) == "PINGPONG"
+assert not fired
+
+# a cancelled timer alone is nothing to wait for
+reactor = Reactor()
+reactor.call_later(10, fired.append, 2).cancel()
+thd = threading.Thread(target = reactor.run)
+thd.daemon = True
+thd.start()
+thd.join(5)
+assert not thd.is_alive()
+assert not fired
@@ -0,0 +1,109 @@
+import time
+import threading
+import sock2
+from sock2.dns import Address, ResolverCache
+
+
+queries = []
+real_from_name = Address.from_name
+def slow_from_name(name):
+    queries.append(name)
+    time.sleep(0.1)
+    return real_from_name(name)
+Address.from_name = staticmethod(slow_from_name)
+
+cache = ResolverCache(maxsize = 2, ttl = 60)
+
+# concurrent lookups are coalesced into a single query
+threads = [threading.Thread(target = cache.from_name, args = ("localhost",))
+    for i in range(5)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+assert queries == ["localhost"]
+assert cache.resolve("localhost") == "127.0.0.1"
+assert queries == ["localhost"]
+
+# failures are cached too
+try:
+    cache.from_name("no-such-host.invalid")
+except sock2.AddressError:
+    pass
+else:
+    assert False
+try:
+    cache.from_name("no-such-host.invalid")
+except sock2.AddressError:
+    pass
+assert queries.count("no-such-host.invalid") == 1
+
+# unexpected errors reach the waiters too, and aren't cached
+errors = []
+def lookup_none():
+    try:
+        cache.from_name(None)
+    except Exception, ex:
+        errors.append(ex)
+threads = [threading.Thread(target = lookup_none) for i in range(3)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join(5)
+    assert not t.is_alive()
+assert len(errors) == 3 and not isinstance(errors[0], sock2.AddressError)
+assert not cache._pending
+
+# bounded LRU, and expired entries
+cache.from_addr("127.0.0.1")
+assert len(cache) == 2
+cache.from_name("localhost")
+assert queries.count("localhost") == 2
+cache.invalidate("localhost")
+cache.from_name("localhost", ttl = 0)
+cache.from_name("localhost")
+assert queries.count("localhost") == 4
+
+listener = sock2.TcpListener("127.0.0.1", 0)
+conn = sock2.TcpSocket("localhost", listener.local_endpoint[1], 
+    resolver = cache)
+assert conn.remote_endpoint == listener.local_endpoint
+
+# the built-in addresses are resolved only on first use
+assert not sock2.dns.anyhost.resolved
+assert sock2.loopback == "127.0.0.1"
+assert sock2.loopback.resolved
+
+# happy eyeballs: resolve concurrently, race the connection attempts
+assert sock2.dns.resolve_concurrently("127.0.0.1") == [
+    (sock2.consts.AddressFamily.INET, "127.0.0.1")]
+conn = sock2.TcpSocket.connect_fastest("localhost", listener.local_endpoint[1])
+assert conn.remote_endpoint == listener.local_endpoint
+
+# the timeout covers the name resolution too
+hung = threading.Event()
+def hung_get_ips(name, family):
+    hung.wait()
+    return []
+real_get_ips = sock2.dns._get_ips
+sock2.dns._get_ips = hung_get_ips
+t0 = time.time()
+try:
+    sock2.TcpSocket.connect_fastest("hung.invalid", 80, timeout = 0.2)
+except sock2.TimeoutError:
+    pass
+else:
+    assert False
+assert time.time() - t0 < 1
+hung.set()
+
+# an IPv4-only name: the empty AAAA answer mustn't cut a slow A answer short
+def v4_only_get_ips(name, family):
+    if family == sock2.consts.AddressFamily.INET:
+        time.sleep(0.2)
+        return ["127.0.0.1"]
+    return []
+sock2.dns._get_ips = v4_only_get_ips
+assert sock2.dns.resolve_concurrently("v4only.invalid") == [
+    (sock2.consts.AddressFamily.INET, "127.0.0.1")]
+sock2.dns._get_ips = real_get_ips
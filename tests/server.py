@@ -0,0 +1,84 @@
+import os
+import threading
+import sock2
+from sock2.server import (Handler, ThreadPoolServer, ReactorServer,
+    PreforkServer)
+
+
+class EchoHandler(Handler):
+    def on_data(self, data):
+        if data == "bye":
+            self.channel.close()
+        else:
+            self.channel.send("%d:%s" % (os.getpid(), data))
+
+def echo(client, data):
+    client.sendall(data)
+    pid, reply = client.recv(1000).split(":", 1)
+    assert reply == data
+    return int(pid)
+
+def check_server(server_class, **kw):
+    listener = sock2.TcpListener("localhost", 0, backlog = 16)
+    server = server_class(listener, EchoHandler, max_connections = 2,
+        poll_interval = 0.05, **kw)
+    thd = threading.Thread(target = server.serve_forever)
+    thd.start()
+    c1 = sock2.TcpSocket(*listener.local_endpoint)
+    c2 = sock2.TcpSocket(*listener.local_endpoint)
+    echo(c1, "hello")
+    echo(c2, "world")
+    assert server.active_connections == 2
+
+    # the third connection waits in the backlog until a slot frees up
+    c3 = sock2.TcpSocket(*listener.local_endpoint)
+    c3.sendall("waiting")
+    c3.timeout = 0.2
+    assert c3.recv(100) == ""
+    c1.sendall("bye")
+    c3.timeout = 5
+    assert c3.recv(100).endswith(":waiting")
+
+    # a graceful drain closes the connections once they're quiet
+    server.shutdown(drain_timeout = 5)
+    thd.join(5)
+    assert not thd.is_alive()
+    assert server.active_connections == 0
+    for client in (c2, c3):
+        client.timeout = 5
+        try:
+            client.recv(100)
+        except EOFError:
+            pass
+        else:
+            assert False
+        client.close()
+    c1.close()
+
+check_server(ThreadPoolServer, workers = 2, queue_size = 1)
+check_server(ReactorServer)
+
+server = PreforkServer("localhost", 0, EchoHandler, processes = 2,
+    server_class = ReactorServer, drain_timeout = 1, poll_interval = 0.05)
+server.start()
+pids = set()
+for i in range(20):
+    client = sock2.TcpSocket(*server.local_endpoint)
+    pids.add(echo(client, "ping"))
+    client.close()
+assert pids <= set(server.pids) and pids
+server.shutdown()
+server.serve_forever()
+assert not server.pids
+
+# SIGTERM interrupts the thread pool's accept: the workers must drain and
+# exit cleanly, rather than die of the interrupted call
+server = PreforkServer("localhost", 0, EchoHandler, processes = 2,
+    server_class = ThreadPoolServer, drain_timeout = 1, poll_interval = 0.5)
+server.start()
+client = sock2.TcpSocket(*server.local_endpoint)
+assert echo(client, "ping") in server.pids
+client.close()
+server.shutdown()
+for pid in server.pids:
+    assert os.waitpid(pid, 0)[1] == 0
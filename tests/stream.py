@@ -0,0 +1,72 @@
+import sock2
+from sock2.stream import NetworkStream
+
+
+listener = sock2.TcpListener("localhost", 0)
+client = NetworkStream(sock2.TcpSocket(*listener.local_endpoint), 
+    read_size = 16)
+server = NetworkStream(listener.accept(), read_size = 16)
+
+for i in range(100):
+    client.write("line %d\n" % (i,))
+client.write("HEAD")
+client.write("x" * 100)
+client.flush()
+for i in range(100):
+    assert server.readline() == "line %d\n" % (i,)
+assert server.peek(4) == "HEAD"
+assert server.readexactly(4) == "HEAD"
+assert server.readuntil("xx" * 50) == "x" * 100
+
+server.sock.timeout = 0.1
+try:
+    server.readexactly(1)
+except sock2.TimeoutError:
+    pass
+else:
+    assert False
+assert server.read(10) == ""
+
+client.write("partial")
+client.flush()
+try:
+    server.readline()
+except sock2.TimeoutError:
+    pass
+client.write(" line\n")
+client.close()
+assert server.readline() == "partial line\n"
+try:
+    server.read(10)
+except EOFError:
+    pass
+else:
+    assert False
+
+# a write that times out halfway keeps only the unsent data, for flush()
+client = NetworkStream(sock2.TcpSocket(*listener.local_endpoint))
+server = listener.accept()
+client.sock.timeout = 0.1
+payload = "".join(chr(65 + i % 26) * 1000 for i in range(5000))
+try:
+    client.write(payload)
+except sock2.TimeoutError:
+    pass
+else:
+    assert False
+try:
+    # the buffer is over the threshold, so this tries to flush it too
+    client.write("tail")
+except sock2.TimeoutError:
+    pass
+received = bytearray()
+while len(received) < len(payload) + 4:
+    received += server.recv(1 << 20)
+    try:
+        client.flush()
+    except sock2.TimeoutError:
+        pass
+assert received == payload + "tail"
+client.close()
+server.close()
+listener.close()
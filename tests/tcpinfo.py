@@ -0,0 +1,25 @@
+import sock2
+from sock2.tcpinfo import TcpInfoSampler
+
+
+listener = sock2.TcpListener("localhost", 0)
+client = sock2.TcpSocket(*listener.local_endpoint)
+conn = listener.accept()
+client.sendall("x" * 100000)
+conn.recv_exact_into(bytearray(100000))
+
+info = client.tcp_info
+assert info.snd_cwnd > 0 and info.rtt > 0
+assert info.bytes_acked > 0
+assert "rttvar" in info.as_dict()
+
+sampler = TcpInfoSampler(("rtt", "snd_cwnd"), maxlen = 4)
+sampler.add(client)
+sampler.add(conn)
+for i in range(5):
+    sampler.sample()
+assert len(sampler.series(client, "time")) <= 4
+assert sampler.series(client, "snd_cwnd")[-1] == client.tcp_info.snd_cwnd
+conn.close()
+sampler.sample()
+assert len(sampler) == 1
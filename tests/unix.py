@@ -0,0 +1,55 @@
+import os
+import tempfile
+import sock2
+
+
+a, b = sock2.socketpair()
+a.sendall("hello")
+assert b.recv(100) == "hello"
+
+# pass a TCP connection over the pair, and use it on the other side
+listener = sock2.TcpListener("localhost", 0)
+client = sock2.TcpSocket(*listener.local_endpoint)
+conn = listener.accept()
+a.send_fds("conn", [conn])
+conn.close()
+data, fds = b.recv_fds(100)
+assert data == "conn" and len(fds) == 1
+conn = sock2.TcpSocket.from_fd(fds[0])
+assert conn.remote_endpoint == client.local_endpoint
+conn.sendall("via the pair")
+assert client.recv(100) == "via the pair"
+for sock in (conn, client, listener):
+    sock.close()
+
+b.timeout = 0
+assert b.recv_fds(100) == ("", [])
+a.close()
+try:
+    b.recv_fds(100)
+except EOFError:
+    pass
+else:
+    assert False
+b.close()
+
+# path-bound listener and datagram sockets
+tmpdir = tempfile.mkdtemp()
+path = os.path.join(tmpdir, "listener")
+listener = sock2.UnixListenerSocket(path)
+client = sock2.UnixConnectedSocket(path)
+conn = listener.accept()
+client.sendall("ping")
+assert conn.recv(100) == "ping"
+for sock in (conn, client, listener):
+    sock.close()
+
+d1 = sock2.UnixDatagramSocket(os.path.join(tmpdir, "d1"))
+d2 = sock2.UnixDatagramSocket(os.path.join(tmpdir, "d2"))
+d2.sendv(["dgr", "am"], d1.local_endpoint)
+assert d1.recv(100) == ("dgram", d2.local_endpoint)
+d1.close()
+d2.close()
+for name in os.listdir(tmpdir):
+    os.unlink(os.path.join(tmpdir, name))
+os.rmdir(tmpdir)
@@ -0,0 +1,81 @@
+import threading
+import sock2
+from sock2 import ZeroCopySender
+
+
+listener = sock2.TcpListener("localhost", 0)
+client = sock2.TcpSocket(*listener.local_endpoint)
+server = listener.accept()
+
+buffers = [bytearray(chr(65 + i) * (1 << 20)) for i in range(4)]
+small = bytearray("small")
+expected = "".join(str(buf) for buf in buffers) + "small"
+received = []
+def receive():
+    total = 0
+    while total < len(expected):
+        data = server.recv(1 << 20)
+        received.append(data)
+        total += len(data)
+thd = threading.Thread(target = receive)
+thd.start()
+
+sender = ZeroCopySender(client)
+for i, buf in enumerate(buffers):
+    assert sender.send(buf, i) == sender.enabled
+assert not sender.send(small)
+thd.join()
+assert "".join(received) == expected
+assert sender.wait(5)
+assert sender.pending == 0
+# the small send is copied, so it's reported complete first
+done = sender.completions()
+assert done[0] is small
+assert sorted(done[1:]) == range(4)
+if sender.enabled:
+    # the kernel copies over the loopback interface
+    assert sender.copied > 0
+
+for sock in (client, server):
+    sock.close()
+
+# with a callback, nothing is queued
+client = sock2.TcpSocket(*listener.local_endpoint)
+server = listener.accept()
+released = []
+sender = ZeroCopySender(client, on_complete = released.append)
+chunk = bytearray("z" * 65536)
+sender.send(chunk, "chunk")
+data = bytearray(len(chunk))
+server.recv_exact_into(data)
+assert data == chunk
+# (over loopback, the buffer is released once the receiver consumed it)
+assert sender.wait(5)
+assert released == ["chunk"]
+assert sender.completions() == []
+
+for sock in (client, server):
+    sock.close()
+
+# a send that times out partway: the calls already made are still in flight
+client = sock2.TcpSocket(*listener.local_endpoint)
+server = listener.accept()
+client.timeout = 0.2
+sender = ZeroCopySender(client)
+big = bytearray("t" * (64 << 20))
+try:
+    sender.send(big)
+except sock2.TimeoutError:
+    pass
+else:
+    assert False
+if sender.enabled:
+    assert sender.pending == 1
+server.timeout = 0.2
+while server.recv(1 << 20):
+    pass
+assert sender.wait(5)
+assert sender.pending == 0
+
+for sock in (client, server, listener):
+    sock.close()